@@ -1,21 +1,65 @@
+import argparse
+import atexit
 import math
+import os
+import sys
+import threading
 import time
 import krpc
-import websocket
-
-conn = krpc.connect(name='FlightComputer', address='127.0.0.1', rpc_port=50000, stream_port=50001)
-vessel = conn.space_center.active_vessel
+import ascent
+import bodies
+import dispatcher
+import guidance
+import kepler
+import maneuver
+import orbital
+import porkchop
+import recorder
+import rpcstats
+import sequencer
+import snapshot
+import staging
+import supervisor
+import telemetry
+import transfer
+import waits
+
+sim_world = None
+
+def connect():
+	global sim_world
+	if os.environ.get('KRPC_SIM'): # Fly against the local simulator, e.g. KRPC_SIM=pad
+		import sim
+		connection = sim.connect(name='FlightComputer', scenario=os.environ['KRPC_SIM'], world=sim_world)
+		sim_world = connection.world # Reconnects rejoin the same simulated game
+	else:
+		connection = krpc.connect(name='FlightComputer', address='127.0.0.1', rpc_port=50000, stream_port=50001)
+	return rpcstats.profile(connection) # Opt-in RPC accounting (KRPC_PROFILE=1)
+
+link = None # Both links are opened by main(), so importing this module connects to nothing
+relay = None
+conn = None
+vessel = None
+ready = threading.Event() # Set once kRPC and the relay are both up; commands wait for it
+startup = {} # Seconds from main() to each link being usable, and to ready
 
 start_gravity_turn = 0
 end_gravity_turn = 0
+turn = None # (start, end) of the gravity turn being flown
 ut = None
 altitude = None
 apoapsis = None
 periapsis = None
+stages = None
+registry = None
+executor = None
+sequence = None
+snapshots = None
+orbits = None
+recording = None
+commands = None # dispatcher.Dispatcher of the relay commands, built by main()
 
 def prelaunch(sGT=250, eGT=45000):
-	global vessel
-	global conn
 	global ut
 	global altitude
 	global apoapsis
@@ -23,129 +67,44 @@ def prelaunch(sGT=250, eGT=45000):
 	global start_gravity_turn
 	global end_gravity_turn
 
-	vessel = conn.space_center.active_vessel
 	start_gravity_turn = sGT
 	end_gravity_turn = eGT
-	ut = conn.add_stream(getattr, conn.space_center, 'ut')
-	altitude = conn.add_stream(getattr, vessel.flight(), 'mean_altitude')
-	apoapsis = conn.add_stream(getattr, vessel.orbit, 'apoapsis_altitude')
-	periapsis = conn.add_stream(getattr, vessel.orbit, 'periapsis_altitude')
+	ut = link.add_stream(lambda c: c.add_stream(getattr, c.space_center, 'ut'))
+	altitude = link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.flight(), 'mean_altitude'))
+	apoapsis = link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.orbit, 'apoapsis_altitude'))
+	periapsis = link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.orbit, 'periapsis_altitude'))
+	bind(link.conn)
 	vessel.control.sas = False
 	vessel.control.rcs = True
 	vessel.control.throttle = 0
 
-def circularize_burn(rcs = False): # Circularises at apoapsis
-	print('Planning circularization burn')
-	mu = vessel.orbit.body.gravitational_parameter
-	r = vessel.orbit.apoapsis
-	a1 = vessel.orbit.semi_major_axis
-	a2 = r
-	v1 = math.sqrt(mu * ((2. / r) - (1. / a1)))
-	v2 = math.sqrt(mu * ((2. / r) - (1. / a2)))
-	delta_v = v2 - v1
-	node = vessel.control.add_node(
-		ut() + vessel.orbit.time_to_apoapsis, prograde=delta_v)
-
-	# Calculate burn time (using rocket equation)
-	F = vessel.available_thrust
-	Isp = vessel.specific_impulse * vessel.orbit.body.surface_gravity
-	m0 = vessel.mass
-	m1 = m0 / math.exp(delta_v / Isp)
-	flow_rate = F / Isp
-	burn_time = abs((m0 - m1) / flow_rate)
-	# Orientate ship
-	print('Orientating ship for circularization burn')
-	vessel.control.rcs = rcs
-	vessel.auto_pilot.reference_frame = node.reference_frame
-	vessel.auto_pilot.target_direction = (0, 1, 0)
-	vessel.auto_pilot.wait()
+def bind(connection): # Point the script at a connection's active vessel
+	global conn, vessel, registry, stages, executor, sequence, snapshots, orbits
+	conn = connection
+	vessel = conn.space_center.active_vessel
+	registry = bodies.load(conn)
+	snapshots = snapshot.Snapshots(conn, vessel, ut, {'mean_altitude': altitude, 'apoapsis_altitude': apoapsis}) # Planning and guidance reads, from one physics frame
+	orbits = kepler.Tracker(snapshots, registry) # Elements for local propagation
+	stages = staging.StagingPlan(conn, vessel) # Staged by server-side burnout events
+	if recording is not None: # The recorder reads fuel_left() on the stream thread
+		stages.watch_fuel()
+	executor = maneuver.NodeExecutor(conn, vessel, ut, tick=stages.check, burn_time=stages.burn_time)
+	sequence = sequencer.Sequencer(vessel, executor, snapshots, registry, upcoming=upcoming_step)
+
+def reconnected(connection): # Supervisor hook: rebind, clear what the lost burn left behind and carry on
+	bind(connection)
+	vessel.control.throttle = 0
+	vessel.control.remove_nodes()
+	commands.resume()
 
-	# Wait until burn
-	print('Waiting until circularization burn')
-	burn_ut = ut() + vessel.orbit.time_to_apoapsis - (burn_time / 2.)
-	lead_time = 5
-	conn.space_center.warp_to(burn_ut - lead_time)
-	# Execute burn
-	print('Ready to execute burn')
-	time_to_apoapsis = conn.add_stream(getattr, vessel.orbit, 'time_to_apoapsis')
-	while time_to_apoapsis() - (burn_time / 2.) > 0:
-		pass
-	print('Executing burn')
-	vessel.control.throttle = 1.0
-	end_time = ut() + burn_time
-	while (end_time - 1) > ut():
-		checkFuel()
-	print('Fine tuning')
-	vessel.control.throttle = 0.05
-	remaining_burn = conn.add_stream(node.remaining_burn_vector, node.reference_frame)
-	while remaining_burn()[1] > 2.0: # 2m/s
-		checkFuel()
-	vessel.control.throttle = 0.0
-	node.remove()
+def circularize_burn(rcs = False): # Circularises at apoapsis
+	sequence.fly([sequencer.circularise('apoapsis')], rcs)
 
 def circularize_burn_periapsis(rcs = False):
-	print('Planning circularization burn')
-	mu = vessel.orbit.body.gravitational_parameter
-	r = vessel.orbit.periapsis
-	a1 = vessel.orbit.semi_major_axis
-	a2 = r
-	v1 = math.sqrt(mu * ((2. / r) - (1. / a1)))
-	v2 = math.sqrt(mu * ((2. / r) - (1. / a2)))
-	delta_v = v2 - v1
-	node = vessel.control.add_node(
-		ut() + vessel.orbit.time_to_periapsis, prograde=delta_v)
-
-	# Calculate burn time (using rocket equation)
-	F = vessel.available_thrust
-	Isp = vessel.specific_impulse * vessel.orbit.body.surface_gravity
-	m0 = vessel.mass
-	m1 = m0 / math.exp(delta_v / Isp)
-	flow_rate = F / Isp
-	burn_time = abs((m0 - m1) / flow_rate)
-	# Orientate ship
-	print('Orientating ship for circularization burn')
-	vessel.control.rcs = rcs
-	vessel.auto_pilot.reference_frame = node.reference_frame
-	vessel.auto_pilot.target_direction = (0, 1, 0)
-	vessel.auto_pilot.wait()
-
-	# Wait until burn
-	print('Waiting until circularization burn')
-	burn_ut = ut() + vessel.orbit.time_to_periapsis - (burn_time / 2.)
-	lead_time = 5
-	conn.space_center.warp_to(burn_ut - lead_time)
-	# Execute burn
-	print('Ready to execute burn')
-	time_to_periapsis = conn.add_stream(getattr, vessel.orbit, 'time_to_periapsis')
-	while time_to_periapsis() - (burn_time / 2.) > 0:
-		pass
-	print('Executing burn')
-	vessel.control.throttle = 1.0
-	end_time = ut() + burn_time
-	while (end_time - 1) > ut():
-		checkFuel()
-	print('Fine tuning')
-	vessel.control.throttle = 0.05
-	remaining_burn = conn.add_stream(node.remaining_burn_vector, node.reference_frame)
-	while remaining_burn()[1] > 2.0:
-		checkFuel()
-	vessel.control.throttle = 0.0
-	node.remove()
-
-def current_stage():
-	return vessel.control.current_stage - 1
-
-def stage_resources():
-	return vessel.resources_in_decouple_stage(current_stage()).names
+	sequence.fly([sequencer.circularise('periapsis')], rcs)
 
 def stage():
-	return vessel.control.activate_next_stage()
-
-def liquid_fuel():
-	return vessel.resources_in_decouple_stage(current_stage()).amount("LiquidFuel")
-
-def solid_fuel():
-	return vessel.resources_in_decouple_stage(current_stage()).amount("SolidFuel")
+	return stages.activate_next_stage()
 
 def liftoff():
 	vessel.control.throttle = 1
@@ -153,322 +112,253 @@ def liftoff():
 	vessel.auto_pilot.engage()
 	vessel.auto_pilot.target_pitch_and_heading(90, 90)
 
+def body(): # Constants of the body currently being orbited
+	return registry[snapshots.read("body").body]
+
 def hohmann_elliptical(r1, r2):
-	return math.sqrt(vessel.orbit.body.gravitational_parameter/r1) * (math.sqrt((2*r2)/(r1+r2)) - 1)
+	return float(orbital.hohmann_elliptical(body().gravitational_parameter, r1, r2))
 
 def hohmann_circular(r1, r2):
-	return math.sqrt(vessel.orbit.body.gravitational_parameter/r2) * (1 - math.sqrt((2*r1)/(r1+r2)))
+	return float(orbital.hohmann_circular(body().gravitational_parameter, r1, r2))
 
 def checkFuel():
-	if "LiquidFuel" in stage_resources():
-		if (liquid_fuel() <= 0.1):
-			stage()
-	
-	if "SolidFuel" in stage_resources():
-		if (solid_fuel() <= 0.1):
-			stage()
+	return stages.check()
 
 def set_apoapsis(desired_alt, rcs=False):
-	mu = vessel.orbit.body.gravitational_parameter
-	delta_v = hohmann_elliptical(vessel.orbit.apoapsis, desired_alt + vessel.orbit.body.equatorial_radius)
-	node_time = ut() + vessel.orbit.time_to_periapsis
-	node = vessel.control.add_node(node_time, prograde=delta_v)
-	F = vessel.available_thrust
-	Isp = vessel.specific_impulse * vessel.orbit.body.surface_gravity
-	m0 = vessel.mass
-	m1 = m0 / math.exp(abs(delta_v) / Isp)
-	flow_rate = F / Isp
-	burn_time = abs((m0 - m1) / flow_rate)
-
-	# Orientate ship
-	print('Orientating ship for apoapsis change burn')
-	vessel.control.rcs = rcs
-	vessel.control.throttle = 0
-	vessel.auto_pilot.engage()
-	vessel.auto_pilot.reference_frame = node.reference_frame
-	vessel.auto_pilot.wait()
-
-	# Wait until burn
-	print('Waiting until apoapsis change burn')
-	burn_ut = node_time - (burn_time / 2.)
-	lead_time = 5
-	conn.space_center.warp_to(burn_ut - lead_time)
-	# Execute burn
-	print('Ready to execute burn')
-	while ut() - (node_time + (burn_time / 2.)) > 0:
-		pass
-	print('Executing burn')
-	vessel.control.throttle = 1.0
-	end_time = ut() + burn_time
-	while (end_time - 1) > ut():
-		checkFuel()
-	print('Fine tuning')
-	vessel.control.throttle = 0.05
-	remaining_burn = conn.add_stream(node.remaining_burn_vector, node.reference_frame)
-	while remaining_burn()[1] > 2.0:
-		pass
-	vessel.control.throttle = 0.0
-	node.remove()
+	sequence.fly([sequencer.set_apoapsis(desired_alt)], rcs)
 
 def set_periapsis(desired_alt, rcs=False):
-	mu = vessel.orbit.body.gravitational_parameter
-	delta_v = hohmann_elliptical(vessel.orbit.periapsis, desired_alt + vessel.orbit.body.equatorial_radius)
-	node_time = ut() + vessel.orbit.time_to_apoapsis
-	node = vessel.control.add_node(node_time, prograde=delta_v)
-	F = vessel.available_thrust
-	Isp = vessel.specific_impulse * vessel.orbit.body.surface_gravity
-	m0 = vessel.mass
-	m1 = m0 / math.exp(abs(delta_v) / Isp)
-	flow_rate = F / Isp
-	burn_time = abs((m0 - m1) / flow_rate)
-
-	# Orientate ship
-	print('Orientating ship for periapsis change burn')
-	vessel.control.rcs = rcs
-	vessel.control.throttle = 0
-	vessel.auto_pilot.engage()
-	vessel.auto_pilot.reference_frame = node.reference_frame
-	vessel.auto_pilot.wait()
-
-	# Wait until burn
-	print('Waiting until periapsis change burn')
-	burn_ut = node_time - (burn_time / 2.)
-	lead_time = 5
-	conn.space_center.warp_to(burn_ut - lead_time)
-	# Execute burn
-	print('Ready to execute burn')
-	time_to_apoapsis = conn.add_stream(getattr, vessel.orbit, 'time_to_apoapsis')
-	while ut() - (node_time + (burn_time / 2.)) > 0:
-		pass
-	print('Executing burn')
-	vessel.control.throttle = 1.0
-	end_time = ut() + burn_time
-	while (end_time - 1) > ut():
-		checkFuel()
-	print('Fine tuning')
-	vessel.control.throttle = 0.05
-	remaining_burn = conn.add_stream(node.remaining_burn_vector, node.reference_frame)
-	while remaining_burn()[1] > 2.0:
-		pass
-	vessel.control.throttle = 0.0
-	node.remove()
+	sequence.fly([sequencer.set_periapsis(desired_alt)], rcs)
 
 def launch_to(desired_alt):
-	liftoff()
-	turn_angle = 0
-	while True:
-		checkFuel()
-		if altitude() > start_gravity_turn and altitude() < end_gravity_turn:
-			frac = ((altitude() - start_gravity_turn) /
-					(end_gravity_turn - start_gravity_turn))
-			new_turn_angle = frac * 90
-			if abs(new_turn_angle - turn_angle) > 0.5:
-				print('Setting angle ' + str(abs(90 - turn_angle)))
-				turn_angle = new_turn_angle
-				vessel.auto_pilot.target_pitch_and_heading(90 - turn_angle, 90)
-		if apoapsis() > desired_alt * 0.9:
-			print("Target hit")
-			break
-	
+	rpcstats.mark('ascent')
+	global turn
+	if vessel.situation == conn.space_center.VesselSituation.pre_launch:
+		liftoff()
+		turn = ascent.lookup(vessel) or (start_gravity_turn, end_gravity_turn) # The craft's cached profile, if optimised
+	else: # Resumed after a reconnect: carry on with the ascent from here
+		vessel.control.throttle = 1
+		vessel.auto_pilot.engage()
+	start, end = turn or (start_gravity_turn, end_gravity_turn)
+	if recording is not None:
+		recording.note('turn', start=start, end=end, apoapsis=desired_alt)
+	guidance.ascend(vessel, ut, altitude, apoapsis, start, end, desired_alt, tick=checkFuel, snapshots=snapshots)
+	print("Target hit")
+
 	vessel.control.throttle = 0.25
-	while apoapsis() < desired_alt:
-		checkFuel()
+	waits.wait_until(lambda: apoapsis() >= desired_alt, apoapsis, tick=checkFuel)
 
 	print('Target apoapsis reached')
 	vessel.control.throttle = 0.0
 
 	# Wait until out of atmosphere
+	rpcstats.mark('coast')
 	print('Coasting out of atmosphere')
-	while altitude() < 70500:
-		pass
+	out_of_atmosphere = waits.add_threshold_event(conn, conn.get_call(getattr, vessel.flight(), 'mean_altitude'), 70500)
+	waits.wait_for_event(out_of_atmosphere)
+	out_of_atmosphere.remove()
+	rpcstats.mark('circularise')
 	circularize_burn()
 	print("Launch complete!")
 
 def mun_transfer():
+	rpcstats.mark('transfer')
 	print("Starting transfer")
 	vessel.control.toggle_action_group(1)
-	celestial_body = conn.space_center.bodies["Mun"]
-	destSemiMajor = celestial_body.orbit.semi_major_axis
-	hohmannSemiMajor = destSemiMajor / 2
-	neededPhase = 2 * math.pi * (1 / (2 * (destSemiMajor ** 3 / hohmannSemiMajor ** 3) ** (1 / 2)))
-	optimalPhaseAngle = 180 - neededPhase * 180 / math.pi  # In degrees; for mun, mun should be ahead of vessel
-
-	# Get current phase angle
-	phaseAngle = 5040  # Random default value
+	celestial_body = registry["Mun"]
+	mu = body().gravitational_parameter  # Get gravitation parameter (mu) for Kerbin
+
+	# Warp straight to the transfer window (mun ahead of vessel by the Hohmann phase angle)
+	transfer.warp_to_window(conn, orbits, celestial_body, mu, ut)
+
 	vessel.control.rcs = True
 	vessel.auto_pilot.engage()
 	vessel.auto_pilot.reference_frame = vessel.orbital_reference_frame
 	vessel.auto_pilot.target_direction = (0.0, 1.0, 0.0)  # Point pro-grade
 	vessel.auto_pilot.wait()
 
-	angleDec = False  # Whether or not phase angle is decreasing; used to make sure mun is ahead of vessel
-	prevPhase = 0
-	while abs(phaseAngle - optimalPhaseAngle) > 1 or not angleDec:
-		bodyRadius = celestial_body.orbit.radius
-		vesselRadius = vessel.orbit.radius
-
-		time.sleep(1)
-
-		bodyPos = celestial_body.orbit.position_at(conn.space_center.ut,
-												   celestial_body.reference_frame)
-		vesselPos = vessel.orbit.position_at(conn.space_center.ut, celestial_body.reference_frame)
-
-		bodyVesselDistance = ((bodyPos[0] - vesselPos[0]) ** 2 + (bodyPos[1] - vesselPos[1]) ** 2 + (
-				bodyPos[2] - vesselPos[2]) ** 2) ** (1 / 2)
-
-		try:
-			phaseAngle = math.acos(
-				(bodyRadius ** 2 + vesselRadius ** 2 - bodyVesselDistance ** 2) / (2 * bodyRadius * vesselRadius))
-		except:
-			print("Domain error! Cannot calculate. Standby...")
-			continue  # Domain error
-		phaseAngle = phaseAngle * 180 / math.pi
-
-		if prevPhase - phaseAngle > 0:
-			angleDec = True
-			if abs(phaseAngle - optimalPhaseAngle) > 18:
-				conn.space_center.rails_warp_factor = 4
-			else:
-				conn.space_center.rails_warp_factor = 0
-		else:
-			angleDec = False
-			conn.space_center.rails_warp_factor = 4
-
-		prevPhase = phaseAngle
-
-		print("Phase:", phaseAngle)
-
 	# Use vis-viva to calculate deltaV required to raise orbit to that of the moon
-	mu = vessel.orbit.body.gravitational_parameter  # Get gravitation parameter (mu) for Kerbin
-	r = vessel.orbit.radius
-	a = vessel.orbit.semi_major_axis
-
-	v1 = math.sqrt(mu * ((2 / r) - (1 / a)))
-
-	a = (celestial_body.orbit.radius + vessel.orbit.radius) / 2
-
-	v2 = math.sqrt(mu * ((2 / r) - (1 / a)))
-
+	now = snapshots.read('radius', 'semi_major_axis')
+	r = now.radius
+	v1 = float(orbital.vis_viva(mu, r, now.semi_major_axis))
+	v2 = float(orbital.vis_viva(mu, r, (celestial_body.semi_major_axis + r) / 2))
 	delta_v = v2 - v1
 	print("Maneuver Now With DeltaV:", delta_v)
 
-	actual_delta_v = 0
+	def gained():
+		now = snapshots.read('radius', 'semi_major_axis')
+		return float(orbital.vis_viva(mu, now.radius, now.semi_major_axis)) - v1
+
 	vessel.control.throttle = 1.0
-	while (delta_v > actual_delta_v):
-		time.sleep(0.15)
-		r = vessel.orbit.radius
-		a = vessel.orbit.semi_major_axis
-		actual_delta_v = (mu * ((2 / r) - (1 / a))) ** (1 / 2) - v1
-		print("DeltaV so far: ", actual_delta_v, "out of needed", delta_v)
-		checkFuel()
+	waits.wait_until(lambda: gained() >= delta_v, snapshots.streams['semi_major_axis'], tick=checkFuel)
 	vessel.control.throttle = 0
 	vessel.auto_pilot.disengage()
 	print("Burn complete")
 	cir_moon()
 
 
-def cir_moon():
-	conn.space_center.warp_to(ut() + vessel.orbit.time_to_soi_change + vessel.orbit.next_orbit.time_to_periapsis - 120)
-	print('Planning Munar circularisation burn')
-	mu = vessel.orbit.body.gravitational_parameter
-	r = vessel.orbit.periapsis
-	a1 = vessel.orbit.semi_major_axis
-	a2 = r
-	v1 = math.sqrt(mu * ((2. / r) - (1. / a1)))
-	v2 = math.sqrt(mu * ((2. / r) - (1. / a2)))
-	delta_v = v2 - v1
-	nodeTime = ut() + vessel.orbit.time_to_periapsis
-	node = vessel.control.add_node(nodeTime, prograde=delta_v)
-
-	# Calculate burn time (using rocket equation)
-	F = vessel.available_thrust
-	Isp = vessel.specific_impulse * vessel.orbit.body.surface_gravity
-	m0 = vessel.mass
-	m1 = m0 / math.exp(delta_v / Isp)
-	flow_rate = F / Isp
-	burn_time = abs((m0 - m1) / flow_rate)
-	# Orientate ship
-	print('Orientating ship for Munar capture burn')
-	vessel.control.rcs = True
-	vessel.auto_pilot.engage()
-	vessel.auto_pilot.reference_frame = node.reference_frame
-	vessel.auto_pilot.target_direction = (0, 1, 0)
-	vessel.auto_pilot.wait()
+MUN_ORBIT = [sequencer.set_periapsis(30000), sequencer.circularise('periapsis')] # Lowered to 30 km
 
-	# Wait until burn
-	print('Waiting until Munar capture burn')
-	burn_ut = nodeTime - (burn_time / 2.)
-	lead_time = 5
-	conn.space_center.warp_to(burn_ut - lead_time)
-	# Execute burn
-	print('Ready to execute burn')
-	time_to_periapsis = conn.add_stream(getattr, vessel.orbit, 'time_to_periapsis')
-	while time_to_periapsis() - (burn_time / 2.) > 0:
-		pass
-	print('Executing burn')
-	vessel.control.throttle = 1.0
-	end_time = ut() + burn_time
-	while (end_time - 10) > ut():
-		checkFuel()
-	print('Fine tuning')
-	vessel.control.throttle = 0.1
-	remaining_burn = conn.add_stream(node.remaining_burn_vector, node.reference_frame)
-	while remaining_burn()[1] > 10.0:
-		checkFuel()
-	vessel.control.throttle = 0.0
-	node.remove()
-	lower_mun_orbit()
+def cir_moon():
+	rpcstats.mark('coast')
+	entry, periapsis_ut = transfer.arrival(orbits, registry['Mun'], body().gravitational_parameter, ut())
+	conn.space_center.warp_to(periapsis_ut - 120)
+	rpcstats.mark('capture')
+	print('Munar capture, then lowering to 30,000 metres')
+	# One plan, so each burn is planned while the one before it runs
+	sequence.fly([sequencer.circularise('periapsis')] + MUN_ORBIT, True)
+	print("Welcome to the Mün!")
 
 def lower_mun_orbit():
 	print("Lowering to 30,000 metres")
-	vessel.control.rcs = True
-	vessel.auto_pilot.engage()
-	set_periapsis(30000, True)
-	circularize_burn_periapsis(True)
+	sequence.fly(MUN_ORBIT, True)
 	print("Welcome to the Mün!")
 
-prelaunch()
-
-def on_message(ws, message):
-	if (message != "ping"):
-		print(message)
-	command = message.split(",")[0]
-	if (command == "launch"):
-		launch_to(int(message.split(",")[1]))
-	elif (command == "circularise"):
-		circularize_burn()
-	elif (command == "setapoapsis"):
-		set_apoapsis(int(message.split(",")[1]))
-	elif (command == "setperiapsis"):
-		set_periapsis(int(message.split(",")[1]))
-	elif (command == "muntransfer"):
-		mun_transfer()
-	elif (command == "abort"):
-		vessel.control.abort = True
-	elif (command == "execute069"):
-		vessel.control.throttle = 0.3
-		vessel.control.rcs = True
-		vessel.control.sas = False
-		vessel.auto_pilot.engage()
-		vessel.auto_pilot.target_pitch_and_heading(90, 270)
-		stage()
-		time.sleep(1)
-		stage()
-		vessel.control.throttle = 0
-		vessel.auto_pilot.target_pitch_and_heading(0, 270)
-		while True:
-			if (vessel.flight().pitch <= 5.0):
+def transfer_to(name): # Departure burn of the cheapest transfer to any body, e.g. "transfer,Duna"
+	rpcstats.mark('transfer')
+	current = body()
+	if name not in porkchop.targets(registry, current):
+		print(porkchop.unreachable(registry, current, name))
+		return
+	print("Planning transfer to {}...".format(name))
+	node, plan = transfer.node_to(vessel, orbits, registry, registry[name], ut())
+	print("Departure burn {:.0f} m/s, capture {:.0f} m/s, arriving in {:.1f} days".format(
+		plan.departure_delta_v, plan.arrival_delta_v, (plan.arrival - ut()) / 21600.))
+	executor.execute(node)
+	if plan.origin != "vessel": # Ejected from a parking orbit: correct course once out of the sphere of influence
+		rpcstats.mark('coast')
+		parent = registry[plan.origin].parent
+		while body().name != parent: # Through any moon's sphere of influence met on the way out
+			now = snapshots.read('time_to_soi_change')
+			if math.isnan(now.time_to_soi_change):
 				break
-		vessel.control.throttle = 1
-		time.sleep(3.2)
-		vessel.control.toggle_action_group(1)
+			conn.space_center.warp_to(now.ut + now.time_to_soi_change + 60)
+		rpcstats.mark('transfer')
+		node, plan = transfer.correction_node(vessel, orbits, registry, plan, ut())
+		print("Correction burn {:.0f} m/s".format(plan.departure_delta_v))
+		executor.execute(node)
+	print("Burn complete")
+
+def abort():
+	vessel.control.abort = True
+
+def cut_throttle():
+	vessel.control.throttle = 0
+
+def execute069():
+	vessel.control.throttle = 0.3
+	vessel.control.rcs = True
+	vessel.control.sas = False
+	vessel.auto_pilot.engage()
+	vessel.auto_pilot.target_pitch_and_heading(90, 270)
+	stage()
+	waits.sleep(1)
+	stage()
+	vessel.control.throttle = 0
+	vessel.auto_pilot.target_pitch_and_heading(0, 270)
+	pitch = conn.add_stream(getattr, vessel.flight(), 'pitch')
+	waits.wait_until(lambda: pitch() <= 5.0, pitch)
+	pitch.remove()
+	vessel.control.throttle = 1
+	waits.sleep(3.2)
+	vessel.control.toggle_action_group(1)
+
+# Relay commands that are a single apsis burn, so the sequencer can plan them while the burn before runs
+STEPS = {
+	'circularise': lambda: sequencer.circularise('apoapsis'),
+	'setapoapsis': sequencer.set_apoapsis,
+	'setperiapsis': sequencer.set_periapsis,
+}
 
-def on_open(ws):
-	print("Connected to server!")
+def upcoming_step(): # Step of the next queued command, if it is a burn
+	pending = commands.pending()
+	if pending and pending[0].name in STEPS:
+		return STEPS[pending[0].name](*pending[0].args)
+	return None
 
-def on_close(ws):
-	print("Server connection lost!\nReconnecting...")
+def running_command(): # e.g. "launch,80000", for the flight recorder
+	command = commands.running
+	return ','.join(map(str, (command.name,) + command.args)) if command is not None else None
 
-mun_transfer()
-ws = websocket.WebSocketApp("ws://35.242.157.185/", on_message = on_message, on_close = on_close, on_open = on_open)
-ws.run_forever()
\ No newline at end of file
+def on_message(message):
+	if (message != "ping"):
+		print(message)
+	ready.wait() # Commands sent during startup run once the streams are up
+	commands.submit(message)
+
+def start_krpc(): # Connect, subscribe every stream and load the body constants
+	global link, current_stage, fuel, throttle
+	# Reconnects with backoff when KSP or the connection goes away; streams are re-created on the new connection
+	link = supervisor.KRPCLink(connect, on_connect=[reconnected], on_lost=[lambda reason: commands.connection_lost()])
+	prelaunch()
+	current_stage = link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.control, 'current_stage'))
+	fuel = link.add_stream(lambda c: c.add_stream(c.space_center.active_vessel.resources.amount, 'LiquidFuel'))
+	throttle = link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.control, 'throttle'))
+	for stream in (ut, altitude, apoapsis, periapsis, current_stage, fuel, throttle):
+		stream() # Pre-warm: the first read of a stream waits for its first update
+
+def main(argv=None):
+	global relay, feed, recording, commands
+	parser = argparse.ArgumentParser(description='Fly the active vessel on commands from the relay')
+	parser.add_argument('commands', nargs='*', help='commands to fly first, e.g. muntransfer or launch,80000')
+	args = parser.parse_args(argv)
+
+	commands = dispatcher.Dispatcher({
+		"launch": lambda alt: launch_to(alt),
+		"circularise": lambda: circularize_burn(),
+		"setapoapsis": lambda alt: set_apoapsis(alt),
+		"setperiapsis": lambda alt: set_periapsis(alt),
+		"muntransfer": lambda: mun_transfer(),
+		"transfer": lambda name: transfer_to(name),
+		"abort": abort,
+		"execute069": execute069,
+	}, on_preempt=cut_throttle, resumable=("launch", "circularise", "setapoapsis", "setperiapsis")).start()
+	started = time.monotonic()
+	# RELAY_URL points at another relay, e.g. a local websocket-server/index.js
+	relay = supervisor.RelayLink(os.environ.get('RELAY_URL', 'ws://35.242.157.185/'), on_message)
+	serving = threading.Thread(target=relay.run, name='relay')
+	serving.daemon = True
+	serving.start() # The handshake runs while kRPC connects and subscribes
+	start_krpc()
+	startup['krpc'] = time.monotonic() - started
+	relay.wait()
+	startup['relay'] = relay.opened_at - started
+	# Telemetry for dashboards and the voice skill, pushed through the relay (TELEMETRY_RATE frames a second)
+	feed = telemetry.Publisher({
+		'ut': ut,
+		'altitude': altitude,
+		'apoapsis': apoapsis,
+		'periapsis': periapsis,
+		'stage': current_stage,
+		'fuel': fuel,
+		'throttle': throttle,
+		'phase': lambda: rpcstats.current,
+	}, relay.send, rate=float(os.environ.get('TELEMETRY_RATE', 5))).start()
+	if os.environ.get('FLIGHT_RECORD'): # Record the flight to this directory (see recorder.py)
+		stages.watch_fuel()
+		recording = recorder.Recorder(os.environ['FLIGHT_RECORD'], ut, {
+			'altitude': altitude,
+			'apoapsis': apoapsis,
+			'periapsis': periapsis,
+			'remaining_burn': lambda: executor.remaining_burn(),
+			'throttle': throttle,
+			'stage': current_stage,
+			'stage_fuel': lambda: stages.fuel_left(),
+			'fuel': fuel,
+			'mass': link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel, 'mass')),
+			'available_thrust': link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel, 'available_thrust')),
+			'target_pitch': link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.auto_pilot, 'target_pitch')),
+			'target_heading': link.add_stream(lambda c: c.add_stream(getattr, c.space_center.active_vessel.auto_pilot, 'target_heading')),
+		}, phase=lambda: rpcstats.current, command=running_command)
+		recording.note('staging', threshold=stages.threshold, stages=[stage._asdict() for stage in stages.stages.values()])
+		atexit.register(recording.close)
+	startup['ready'] = time.monotonic() - started
+	print('Ready for commands in {ready:.2f}s (kRPC, streams and bodies {krpc:.2f}s, relay {relay:.2f}s)'.format(**startup))
+	ready.set()
+	for command in args.commands:
+		commands.submit(command)
+	serving.join()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,155 @@
+# Gravity turn profiles per craft, found offline in the simulator and cached on disk.
+# The optimizer flies Flight.launch() for a grid of turn start/end altitudes, one flight per worker
+# process, and keeps the profile that reaches orbit with the most propellant left. Profiles are keyed
+# by the craft as it leaves the pad (mass, thrust and specific impulse, each rounded into a bucket),
+# so a launch looks its profile up with three reads and a dict lookup, and falls back to the script's
+# fixed turn for a craft that has not been optimised.
+#
+#   python ascent.py                       optimise the simulator's default craft
+#   python ascent.py craft.json --target 80000 --workers 4
+#
+# craft.json lists the craft's segments in sim.DEFAULT_CRAFT's format. The cache lives in
+# ~/.cache/alexa-ksp/ascent.json; KSP_ASCENT_CACHE moves it, and an empty value turns lookups off.
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+
+import bodies
+
+CACHE = os.environ.get("KSP_ASCENT_CACHE", os.path.join(os.path.dirname(bodies.CACHE), "ascent.json"))
+
+MASS_BUCKET = 1.05  # Ratio between neighbouring mass and thrust buckets
+ISP_BUCKET = 10.  # Seconds
+
+STARTS = (100., 250., 500., 1000., 2000., 4000.)  # Default sweep (m)
+ENDS = (20000., 30000., 40000., 50000., 60000., 70000., 80000.)
+
+profiles = None  # Cache contents, read on first lookup
+
+
+def key(mass, thrust, isp):
+    return "m{}-t{}-i{}".format(int(round(math.log(max(mass, 1.)) / math.log(MASS_BUCKET))),
+                                int(round(math.log(max(thrust, 1.)) / math.log(MASS_BUCKET))),
+                                int(round(isp / ISP_BUCKET)))
+
+
+def vessel_key(vessel):
+    # Key of a vessel that has just lit its first stage
+    return key(vessel.mass, vessel.available_thrust, vessel.specific_impulse)
+
+
+def lookup(vessel, path=None):
+    # (start, end) of the gravity turn cached for this vessel, or None; costs no RPCs when the
+    # cache is empty or turned off
+    global profiles
+    path = CACHE if path is None else path
+    if not path:
+        return None
+    if profiles is None:
+        profiles = bodies.read(path)
+    if not profiles:
+        return None
+    profile = profiles.get(vessel_key(vessel))
+    if profile is None:
+        return None
+    return profile["start"], profile["end"]
+
+
+def fly(craft, start, end, target, limit=1200.):
+    # One launch in a fresh simulated game; runs in a worker process. Returns the propellant (kg)
+    # left in orbit, or None if the flight failed or ran past limit game seconds
+    os.environ.pop("FLIGHT_RECORD", None)
+    import sim
+    import waits
+    with contextlib.redirect_stdout(io.StringIO()):
+        import Flight
+    conn = sim.connect(name="Ascent", scenario="pad", craft=craft)
+    world = conn.world
+    vessel = world.active
+
+    def watchdog():
+        if vessel.crashed or world.ut > limit:
+            waits.cancel.set()
+
+    waits.cancel.clear()
+    world.listeners.append(watchdog)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            Flight.bind(conn)
+            Flight.launch(target, turn=(start, end))
+    except waits.ManeuverAborted:
+        return None
+    finally:
+        world.listeners.remove(watchdog)
+        waits.cancel.clear()
+        conn.close()
+    conic = vessel.conic(world.ut)
+    body = vessel.body
+    if vessel.crashed or conic.periapsis - body.radius < body.atmosphere_depth:
+        return None
+    return vessel.mass - vessel.dry_mass
+
+
+def craft_key(craft):
+    # The key the craft will look its profile up by: its stats once the first stage is lit
+    import sim
+    conn = sim.connect(name="Ascent", scenario="pad", craft=craft)
+    vessel = conn.space_center.active_vessel
+    vessel.control.activate_next_stage()
+    result = vessel_key(vessel)
+    conn.close()
+    return result
+
+
+def optimise(craft, target=100000., starts=STARTS, ends=ENDS, workers=None, path=None):
+    # Fly the whole grid and cache the best profile for the craft; returns (key, profile)
+    path = CACHE if path is None else path
+    grid = [(start, end) for start in starts for end in ends if end > start]
+    results = {}
+    began = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(fly, craft, start, end, target): (start, end) for start, end in grid}
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+    flown = [(fuel, turn) for turn, fuel in results.items() if fuel is not None]
+    print("Flew {} profiles in {:.1f}s, {} reached orbit".format(len(grid), time.perf_counter() - began, len(flown)))
+    if not flown:
+        raise RuntimeError("No profile reached orbit")
+    fuel, (start, end) = max(flown)
+    craft_id = craft_key(craft)
+    profile = {"start": start, "end": end, "target": target, "propellant_left": fuel, "flown": len(grid)}
+    cache = bodies.read(path)
+    cache[craft_id] = profile
+    bodies.write(path, cache)
+    return craft_id, profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the best gravity turn for a craft in the simulator")
+    parser.add_argument("craft", nargs="?", help="JSON list of the craft's segments (default: the sim's craft)")
+    parser.add_argument("--target", type=float, default=100000., help="apoapsis to launch to (m)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--cache", default=CACHE, help="profile cache file")
+    args = parser.parse_args(argv)
+    if not args.cache:
+        parser.error("the profile cache is turned off (KSP_ASCENT_CACHE is empty)")
+
+    craft = None
+    if args.craft:
+        with open(args.craft) as f:
+            craft = json.load(f)
+    craft_id, profile = optimise(craft, args.target, workers=args.workers, path=args.cache)
+    print("{}: turn from {start:.0f} m to {end:.0f} m, {propellant_left:.0f} kg of propellant left in orbit".format(
+        craft_id, **profile))
+    print("Saved to {}".format(args.cache))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# Benchmarks for the Flight.py mission phases, flown against the local simulator (sim.py).
+#
+#   python bench.py            run every phase and compare with bench_baseline.json
+#   python bench.py --save     run and overwrite the baseline
+#   python bench.py launch     run selected phases only
+#
+# RPC round trips, control-loop wake-ups and simulated time are deterministic, so the comparison
+# fails on any growth in RPCs beyond the tolerance. CPU and wall time are reported for reference.
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("KSP_ASCENT_CACHE", "")  # Fly the scripts' fixed gravity turn, not a cached profile
+
+import sim
+import waits
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import Flight
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# name -> (starting scenario, phase)
+PHASES = [
+    ("launch", "pad", lambda: Flight.launch(100000)),
+    ("circularise", "suborbital", lambda: Flight.circularise()),
+    ("set_altitude", "orbit", lambda: Flight.set_altitude(250000)),
+    ("mun_transfer", "orbit", lambda: Flight.mun_transfer()),
+    ("land_on_mun", "munar", lambda: Flight.land_on_mun()),
+]
+
+
+def run(name, scenario, phase, verbose=False):
+    conn = sim.connect(name="Benchmark", scenario=scenario)
+    Flight.bind(conn)
+    rpcs, wakeups, ut = conn.rpc_count, waits.wakeups, conn.world.ut
+    wall, cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        phase()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    iterations = waits.wakeups - wakeups
+    sim_time = conn.world.ut - ut
+    conn.close()
+    return {
+        "rpcs": conn.rpc_count - rpcs,
+        "loop_iterations": iterations,
+        "loop_rate": iterations / wall if wall > 0 else 0.,
+        "cpu_seconds": cpu,
+        "wall_seconds": wall,
+        "sim_seconds": sim_time,
+        "speedup": sim_time / wall if wall > 0 else 0.,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Names of the phases whose RPC count grew by more than tolerance (a fraction)
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        allowed = baseline[name]["rpcs"] * (1. + tolerance)
+        if result["rpcs"] > allowed:
+            regressions.append(name)
+    return regressions
+
+
+def report(results, baseline):
+    print("{:<14} {:>9} {:>8} {:>10} {:>8} {:>8} {:>10} {:>9}".format(
+        "phase", "rpcs", "(base)", "loops", "loop/s", "cpu s", "sim s", "sim/wall"))
+    for name, r in results.items():
+        base = baseline.get(name, {}).get("rpcs")
+        print("{:<14} {:>9} {:>8} {:>10} {:>8.0f} {:>8.2f} {:>10.1f} {:>9.0f}".format(
+            name, r["rpcs"], "-" if base is None else base, r["loop_iterations"], r["loop_rate"],
+            r["cpu_seconds"], r["sim_seconds"], r["speedup"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the flight script phases against the simulator")
+    parser.add_argument("phases", nargs="*", help="phases to run (default: all)")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed fractional RPC growth")
+    parser.add_argument("--verbose", action="store_true", help="show the flight scripts' output")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.phases) - set(name for name, _, _ in PHASES)
+    if unknown:
+        parser.error("unknown phase(s): {}".format(", ".join(sorted(unknown))))
+    results = {}
+    for name, scenario, phase in PHASES:
+        if not args.phases or name in args.phases:
+            results[name] = run(name, scenario, phase, args.verbose)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Baseline saved to {}".format(args.baseline))
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("RPC regression in: {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
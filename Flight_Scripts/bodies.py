@@ -0,0 +1,109 @@
+# Celestial body constants, fetched from conn.space_center.bodies once per game and cached on disk.
+# Looking a body up (by name or by its kRPC CelestialBody object) then gives plain attributes
+# instead of an RPC per constant. The cache is keyed by kRPC server version and save name ($KSP_SAVE),
+# so a modded solar system gets its own entry; offline tools can read it with cached().
+import json
+import os
+
+CACHE = os.environ.get("KSP_BODY_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "alexa-ksp", "bodies.json")
+
+# Constants read from each CelestialBody, and from its orbit (absent for the root body)
+BODY_FIELDS = ("gravitational_parameter", "surface_gravity", "equatorial_radius", "has_atmosphere",
+               "atmosphere_depth", "sphere_of_influence", "rotational_period")
+ORBIT_FIELDS = ("semi_major_axis", "eccentricity", "inclination", "argument_of_periapsis",
+                "longitude_of_ascending_node", "mean_anomaly_at_epoch", "epoch", "period")
+
+
+class Body(object):
+    def __init__(self, name, constants, remote=None):
+        self.name = name
+        self.parent = constants.get("parent")
+        for field in BODY_FIELDS + ORBIT_FIELDS:
+            setattr(self, field, constants.get(field))
+        self.remote = remote  # kRPC CelestialBody, when loaded from a live connection
+
+    def constants(self):
+        data = {field: getattr(self, field) for field in BODY_FIELDS + ORBIT_FIELDS}
+        data["parent"] = self.parent
+        return data
+
+    def __repr__(self):
+        return "<Body {}>".format(self.name)
+
+
+class Registry(object):
+    def __init__(self, bodies):
+        self.bodies = bodies  # name -> Body
+        self.remotes = {body.remote: body for body in bodies.values() if body.remote is not None}
+
+    def __getitem__(self, key):
+        # By name, or by the CelestialBody object kRPC returns (e.g. vessel.orbit.body)
+        if isinstance(key, str):
+            return self.bodies[key]
+        return self.remotes[key]
+
+    def __contains__(self, key):
+        return key in self.bodies if isinstance(key, str) else key in self.remotes
+
+    def __iter__(self):
+        return iter(self.bodies.values())
+
+    def names(self):
+        return list(self.bodies)
+
+
+def session_key(conn):
+    return "{}/{}".format(conn.krpc.get_status().version, os.environ.get("KSP_SAVE", "default"))
+
+
+def fetch(body):
+    # One RPC per constant; only done when the cache has no entry for this game
+    constants = {field: getattr(body, field) for field in BODY_FIELDS}
+    orbit = body.orbit
+    if orbit is not None:
+        constants["parent"] = orbit.body.name
+        constants.update((field, getattr(orbit, field)) for field in ORBIT_FIELDS)
+    return constants
+
+
+def read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write(path, cache, indent=2):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(cache, f, indent=indent, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def load(conn, path=CACHE):
+    # Registry for this game; costs two RPCs when the cache already has it
+    key = session_key(conn)
+    remotes = conn.space_center.bodies
+    cache = read(path)
+    entry = cache.get(key)
+    if entry is None or set(entry) != set(remotes):
+        entry = {name: fetch(body) for name, body in remotes.items()}
+        cache[key] = entry
+        try:
+            write(path, cache)
+        except (IOError, OSError) as e:
+            print("Could not save body cache: {}".format(e))
+    return Registry({name: Body(name, entry[name], remotes[name]) for name in remotes})
+
+
+def cached(key=None, path=CACHE):
+    # Registry from disk only (no connection); the first cached game unless key is given
+    cache = read(path)
+    if not cache:
+        raise KeyError("No cached bodies in {}".format(path))
+    entry = cache[key] if key is not None else cache[sorted(cache)[0]]
+    return Registry({name: Body(name, constants) for name, constants in entry.items()})
@@ -0,0 +1,323 @@
+# Powered descent: predicts when to light the engine for a suicide burn, then flies it down.
+# The braking trajectory is integrated numerically (inverse-square gravity, thrust against the
+# velocity, mass falling with the propellant flow) for a whole vector of candidate ignition delays
+# or throttle settings at once, one NumPy step per time step for all of them. From the stop
+# altitude of each candidate the solver interpolates the latest ignition (while coasting) or the
+# throttle (while braking) that brings the vessel to rest `target` metres above the ground.
+#
+# Every solve starts from streamed telemetry and only searches around the previous answer, so it
+# stays cheap enough to redo at the guidance rate: the controller runs on guidance.Scheduler, a
+# fixed game-time rate, and re-plans more often the closer the ignition gets.
+import collections
+import math
+
+import numpy as np
+
+import guidance
+
+G0 = 9.80665
+
+# Surface-relative state; vertical_speed is positive upwards. The engine cuts out at dry_mass
+State = collections.namedtuple("State", ["altitude", "vertical_speed", "horizontal_speed", "mass", "dry_mass"],
+                               defaults=(0.,))
+Telemetry = collections.namedtuple("Telemetry", ["ut", "altitude", "vertical_speed", "horizontal_speed", "mass",
+                                                 "dry_mass", "thrust", "isp", "landed"])
+# delay: seconds of coast before ignition; profile: the braking trajectory from ignition, as arrays
+# of seconds since ignition, altitude, speed and throttle (None when the coast passes its lowest
+# point above the target, so there is nothing to plan until then)
+Plan = collections.namedtuple("Plan", ["delay", "ignition_altitude", "burn_time", "stop_altitude", "profile"])
+
+
+class Solver(object):
+    def __init__(self, mu, radius, target=20., throttle=0.9, lanes=16, dt=0.2, coast_dt=10., max_time=3600.):
+        self.mu = mu
+        self.radius = radius
+        self.target = target  # Altitude (m) to come to rest at
+        self.throttle = throttle  # Planned braking throttle: the margin left for the controller
+        self.lanes = lanes  # Candidates integrated side by side
+        self.dt = dt  # Integration step while a candidate burns
+        self.coast_dt = coast_dt  # Longest step for a candidate still coasting
+        self.max_time = max_time
+        self.solves = 0
+
+    def integrate(self, state, thrust, isp, delays, throttles, history=False):
+        # Coast each candidate for its delay, then brake at its throttle until it comes to rest
+        # or hits the ground. Returns (stop altitude, ignition altitude, burn time) arrays, and with
+        # history also the per-step (time, altitude, speed, burning) arrays. A candidate reaching
+        # the ground still moving gets a negative stop altitude: the extra height it would need.
+        # Each candidate keeps its own clock, so coasting ones take long steps while others burn.
+        self.solves += 1
+        delays, throttles = np.broadcast_arrays(np.asarray(delays, float), np.asarray(throttles, float))
+        n = delays.shape
+        x = np.zeros(n)  # Downrange, in the plane of the motion
+        y = np.full(n, self.radius + state.altitude)
+        vx = np.full(n, float(state.horizontal_speed))
+        vy = np.full(n, float(state.vertical_speed))
+        mass = np.full(n, float(state.mass))
+        exhaust = max(isp, 1e-3) * G0
+        t = np.zeros(n)
+        stop = np.full(n, np.inf)  # Stays inf for a candidate that never comes down within max_time
+        ignition = np.full(n, np.nan)
+        ignited = np.full(n, np.nan)
+        done = np.zeros(n, bool)
+        steps = []
+
+        def acceleration(x, y, vx, vy, mass, force):
+            r3 = (x * x + y * y) ** 1.5
+            a = force / mass / np.maximum(np.hypot(vx, vy), 1e-9)
+            return -self.mu * x / r3 - a * vx, -self.mu * y / r3 - a * vy
+
+        while not done.all():
+            burning = (delays - t <= 1e-9) & ~done
+            just = burning & np.isnan(ignited)
+            ignited[just] = t[just]
+            ignition[just] = np.hypot(x[just], y[just]) - self.radius
+            # Coast straight to the ignition (in steps of at most coast_dt), then integrate the burn finely
+            dt = np.where(burning, self.dt, np.minimum(self.coast_dt, delays - t))
+            dt = np.where(done, 0., dt)
+            force = np.where(burning & (mass > state.dry_mass), thrust * throttles, 0.)
+            flow = force / exhaust
+
+            # Runge-Kutta step: accurate enough over the long coast steps to follow an orbit skimming the ground
+            h = dt / 2
+            ax1, ay1 = acceleration(x, y, vx, vy, mass, force)
+            vx2, vy2 = vx + ax1 * h, vy + ay1 * h
+            ax2, ay2 = acceleration(x + vx * h, y + vy * h, vx2, vy2, mass - flow * h, force)
+            vx3, vy3 = vx + ax2 * h, vy + ay2 * h
+            ax3, ay3 = acceleration(x + vx2 * h, y + vy2 * h, vx3, vy3, mass - flow * h, force)
+            vx4, vy4 = vx + ax3 * dt, vy + ay3 * dt
+            ax4, ay4 = acceleration(x + vx3 * dt, y + vy3 * dt, vx4, vy4, mass - flow * dt, force)
+            x = x + (vx + 2 * vx2 + 2 * vx3 + vx4) * dt / 6
+            y = y + (vy + 2 * vy2 + 2 * vy3 + vy4) * dt / 6
+            vx = vx + (ax1 + 2 * ax2 + 2 * ax3 + ax4) * dt / 6
+            vy = vy + (ay1 + 2 * ay2 + 2 * ay3 + ay4) * dt / 6
+            mass = mass - flow * dt
+            t = t + dt
+            altitude = np.hypot(x, y) - self.radius
+            speed = np.hypot(vx, vy)
+            if history:
+                steps.append((t.copy(), altitude, speed, burning))
+
+            # Stopped: slow enough for one more step of thrust to reverse the motion
+            stopped = burning & (speed <= force / mass * self.dt)
+            stop[stopped] = altitude[stopped]
+            # Hit the ground still moving: how much higher it would have had to stop
+            grounded = ~done & ~stopped & (altitude <= 0)
+            if grounded.any():
+                gravity = self.mu / self.radius ** 2
+                deceleration = np.maximum(thrust * throttles / mass - gravity, 1e-3)
+                stop[grounded] = altitude[grounded] - speed[grounded] ** 2 / (2 * deceleration[grounded])
+            done |= stopped | grounded | (t >= self.max_time)
+        burn = np.where(np.isnan(ignited), 0., t - ignited)
+        if history:
+            return stop, ignition, burn, steps
+        return stop, ignition, burn
+
+    def lowest_point(self, state):
+        # Seconds until the coast reaches its lowest point (periapsis), or None if it is climbing
+        # away on an open orbit. Later ignitions only stop lower up to there.
+        r = self.radius + state.altitude
+        h = r * state.horizontal_speed
+        energy = (state.vertical_speed ** 2 + state.horizontal_speed ** 2) / 2 - self.mu / r
+        e_cos = h * h / (self.mu * r) - 1
+        e_sin = h * state.vertical_speed / self.mu
+        e = math.hypot(e_cos, e_sin)
+        if energy >= 0 or e >= 1:
+            return 0. if state.vertical_speed >= 0 else None
+        a = -self.mu / (2 * energy)
+        anomaly = math.atan2(math.sqrt(1 - e * e) * e_sin, e * e + e_cos) if e > 1e-9 else 0.  # Eccentric
+        mean = anomaly - e * math.sin(anomaly) if e > 1e-9 else 0.
+        return ((2 * math.pi - mean) % (2 * math.pi)) / math.sqrt(self.mu / a ** 3)
+
+    def plan(self, state, thrust, isp, previous=None, elapsed=0.):
+        # Latest ignition that stops at the target, searching around the previous plan (its delay
+        # less the elapsed seconds) when there is one; None without thrust
+        if thrust <= 0:
+            return None
+        lowest = self.lowest_point(state)
+        if lowest is None:
+            # Free fall time from here bounds the ignition delay
+            gravity = self.mu / (self.radius + state.altitude) ** 2
+            down = max(0., -state.vertical_speed)
+            lowest = (down + math.sqrt(down * down + 2 * gravity * max(0., state.altitude))) / gravity
+        if previous is not None and previous.delay is not None:
+            centre = min(lowest, max(0., previous.delay - elapsed))
+            width = max(4 * self.dt, 0.25 * centre)
+        else:
+            centre = width = lowest / 2
+        for _ in range(8):
+            low, high = max(0., centre - width), min(lowest, centre + width)
+            delays = np.linspace(low, high, self.lanes)
+            stop, ignition, burn = self.integrate(state, thrust, isp, delays, self.throttle)
+            above = stop >= self.target
+            if above.all():
+                if high >= lowest:
+                    # Passes its lowest point above the target: plan again from there
+                    return Plan(float(lowest), float("nan"), 0., float(stop[-1]), None)
+                centre, width = high + width, 2 * width  # Can wait longer than the window
+                continue
+            if not above.any():
+                if low > 0:
+                    centre, width = low / 2., low / 2.  # Too late already at the window start
+                    continue
+                return self.finish(state, thrust, isp, 0.)  # Too late: brake now, as hard as planned
+            # stop falls as the delay grows: interpolate between the last candidate above the
+            # target and the first one below it
+            k = int(np.flatnonzero(above)[-1])
+            if k == self.lanes - 1:
+                delay = delays[k]
+            else:
+                fraction = (stop[k] - self.target) / (stop[k] - stop[k + 1]) if stop[k] != stop[k + 1] else 0.
+                delay = delays[k] + fraction * (delays[k + 1] - delays[k])
+            return self.finish(state, thrust, isp, delay)
+        return self.finish(state, thrust, isp, low)  # Not bracketed: the best found
+
+    def finish(self, state, thrust, isp, delay):
+        # The plan for one ignition delay, with its braking profile
+        stop, ignition, burn, steps = self.integrate(state, thrust, isp, [delay], self.throttle, history=True)
+        burning = np.array([lane[0] for _, _, _, lane in steps], bool)
+        times = np.array([t[0] for t, _, _, _ in steps])[burning] - delay
+        profile = (times,
+                   np.array([altitude[0] for _, altitude, _, _ in steps])[burning],
+                   np.array([speed[0] for _, _, speed, _ in steps])[burning],
+                   np.full(len(times), self.throttle))
+        return Plan(float(delay), float(ignition[0]), float(burn[0]), float(stop[0]), profile)
+
+    def throttle_for(self, state, thrust, isp, previous=None):
+        # (throttle, burn time) that, burning from now, stops the vessel at the target altitude
+        if thrust <= 0:
+            return 1., 0.
+        centre = previous or self.throttle
+        throttles = np.clip(np.linspace(centre - 0.25, centre + 0.25, self.lanes), 0.05, 1.)
+        stop, _, burn = self.integrate(state, thrust, isp, 0., throttles)
+        above = stop >= self.target
+        if not above.any():
+            return 1., float(burn[-1])
+        k = int(np.flatnonzero(above)[0])
+        if k == 0:
+            return float(throttles[0]), float(burn[0])
+        # stop rises with the throttle: interpolate between the last candidate short of the target
+        # and the first one reaching it
+        fraction = (self.target - stop[k - 1]) / (stop[k] - stop[k - 1])
+        return (float(throttles[k - 1] + fraction * (throttles[k] - throttles[k - 1])),
+                float(burn[k - 1] + fraction * (burn[k] - burn[k - 1])))
+
+
+class Descent(object):
+    # Suicide burn and touchdown, one step per guidance tick: coast while re-planning the ignition,
+    # brake to rest at the solver's target altitude, then settle at touchdown_speed
+    def __init__(self, vessel, solver, tick=None, period=0.05, touchdown_speed=2., gain=1., resolution=0.01):
+        self.vessel = vessel
+        self.solver = solver
+        self.tick = tick  # Called every guidance tick (e.g. checkFuel)
+        self.period = period  # Seconds between steps
+        self.touchdown_speed = touchdown_speed
+        self.gain = gain  # Touchdown throttle response, per m/s of vertical speed error
+        self.resolution = resolution  # Throttle changes smaller than this are not sent
+        self.phase = "coast"
+        self.plan = None
+        self.planned_at = None
+        self.next_plan = -math.inf
+        self.commanded = None  # Throttle already set
+
+    def set_throttle(self, throttle):
+        throttle = min(1., max(0., throttle))
+        if self.commanded is None or abs(throttle - self.commanded) >= self.resolution or \
+                (throttle == 0.) != (self.commanded == 0.):
+            self.vessel.control.throttle = throttle
+            self.commanded = throttle
+
+    def replan(self, telemetry, state=None):
+        # Solve for the ignition again from this telemetry; None (and brake at once) without thrust
+        if state is None:
+            state = State(telemetry.altitude, telemetry.vertical_speed, telemetry.horizontal_speed, telemetry.mass,
+                          telemetry.dry_mass)
+        elapsed = telemetry.ut - self.planned_at if self.planned_at is not None else 0.
+        plan = self.solver.plan(state, telemetry.thrust, telemetry.isp, self.plan, elapsed)
+        if plan is None:
+            print("Descent: cannot stop in time, braking now")
+            self.phase = "braking"
+            self.next_plan = -math.inf
+            return None
+        self.plan, self.planned_at = plan, telemetry.ut
+        # Re-plan more often as the ignition gets closer
+        self.next_plan = telemetry.ut + max(self.period, plan.delay / 2.)
+        return plan
+
+    def remaining(self, ut):
+        # Seconds to the planned ignition
+        return self.plan.delay - (ut - self.planned_at)
+
+    def step(self, telemetry):
+        # True once landed
+        if self.tick is not None:
+            self.tick()
+        if telemetry.landed:
+            self.set_throttle(0.)
+            return True
+        state = State(telemetry.altitude, telemetry.vertical_speed, telemetry.horizontal_speed, telemetry.mass,
+                      telemetry.dry_mass)
+        if self.phase == "coast":
+            if telemetry.ut >= self.next_plan:
+                self.replan(telemetry, state)
+            if self.phase == "coast":
+                if self.remaining(telemetry.ut) > self.period / 2:
+                    return False
+                print("Descent: igniting at {:.0f} m for a {:.1f} s burn".format(telemetry.altitude, self.plan.burn_time))
+                self.phase = "braking"
+                self.next_plan = -math.inf
+        if self.phase == "braking":
+            speed = math.hypot(telemetry.vertical_speed, telemetry.horizontal_speed)
+            if speed > self.touchdown_speed and telemetry.altitude > self.solver.target / 2:
+                if telemetry.ut >= self.next_plan:
+                    throttle, burn = self.solver.throttle_for(state, telemetry.thrust, telemetry.isp, self.commanded)
+                    self.set_throttle(throttle)
+                    # A solve costs in proportion to the burn left, so the last seconds get one every tick
+                    self.next_plan = telemetry.ut + min(1., max(self.period, burn / 20.))
+                return False
+            print("Descent: touching down from {:.0f} m".format(telemetry.altitude))
+            self.phase = "touchdown"
+        # Touchdown: hold a gentle descent rate
+        if telemetry.thrust > 0:
+            gravity = self.solver.mu / (self.solver.radius + telemetry.altitude) ** 2
+            error = -self.touchdown_speed - telemetry.vertical_speed
+            self.set_throttle(telemetry.mass * (gravity + self.gain * error) / telemetry.thrust)
+        return False
+
+
+def land(conn, vessel, ut, mu, radius, tick=None, rate=20., target=20., throttle=0.9, warp_lead=30., observer=None):
+    # Fly the descent from streams until landed, on the current body (mu, radius). The vessel is
+    # expected to hold retrograde (e.g. SAS). The coast is warped through, re-planning after each
+    # jump, up to warp_lead seconds before the ignition. observer(descent, telemetry) sees every
+    # sample the descent plans or steps on (the flight recorder). Returns the descent for its plan
+    # and the scheduler for its timing statistics
+    flight = vessel.flight(vessel.orbit.body.reference_frame)
+    altitude = conn.add_stream(getattr, flight, "surface_altitude")
+    vertical = conn.add_stream(getattr, flight, "vertical_speed")
+    horizontal = conn.add_stream(getattr, flight, "horizontal_speed")
+    mass = conn.add_stream(getattr, vessel, "mass")
+    dry_mass = conn.add_stream(getattr, vessel, "dry_mass")
+    thrust = conn.add_stream(getattr, vessel, "available_thrust")
+    isp = conn.add_stream(getattr, vessel, "specific_impulse")
+    situation = conn.add_stream(getattr, vessel, "situation")
+    landed = (conn.space_center.VesselSituation.landed, conn.space_center.VesselSituation.splashed)
+    descent = Descent(vessel, Solver(mu, radius, target, throttle), tick=tick, period=1. / rate)
+    scheduler = guidance.Scheduler(ut, rate)
+
+    def sample(now):
+        telemetry = Telemetry(now, altitude(), vertical(), horizontal(), mass(), dry_mass(), thrust(), isp(),
+                              situation() in landed)
+        if observer is not None:
+            observer(descent, telemetry)
+        return telemetry
+
+    try:
+        # A second of slack: a re-plan landing just past warp_lead would otherwise warp by nothing, forever
+        while descent.replan(sample(ut())) is not None and descent.remaining(ut()) > warp_lead + 1.:
+            conn.space_center.warp_to(ut() + descent.remaining(ut()) - warp_lead)
+        scheduler.run(lambda now: descent.step(sample(now)))
+    finally:
+        for stream in (altitude, vertical, horizontal, mass, dry_mass, thrust, isp, situation):
+            stream.remove()
+    print("Descent: {}, {} solves".format(scheduler.summary(), descent.solver.solves))
+    return descent, scheduler
@@ -0,0 +1,187 @@
+# Command dispatcher for the relay connection.
+# Messages are parsed into typed commands and run one at a time on a worker thread,
+# so the websocket thread keeps reading frames (pings, aborts) while a burn runs.
+import collections
+import queue
+import threading
+import time
+
+import waits
+
+Command = collections.namedtuple("Command", ["name", "args", "received"])
+
+# Argument types for each command; anything not listed takes no arguments
+ARGUMENTS = {
+    "launch": (int,),
+    "setapoapsis": (int,),
+    "setperiapsis": (int,),
+    "transfer": (str,),
+}
+
+# Commands handled immediately on the receiving thread, interrupting the running maneuver
+PRIORITY = {"abort", "status"}
+
+
+def parse(message):
+    parts = message.split(",")
+    name = parts[0].strip()
+    types = ARGUMENTS.get(name, ())
+    if len(parts) - 1 < len(types):
+        raise ValueError("{} expects {} argument(s)".format(name, len(types)))
+    args = tuple(convert(value.strip()) for convert, value in zip(types, parts[1:]))
+    return Command(name, args, time.monotonic())
+
+
+class Dispatcher(object):
+    def __init__(self, handlers, on_preempt=None, resumable=()):
+        self.handlers = dict(handlers)
+        self.handlers.setdefault("status", self.report)
+        self.on_preempt = on_preempt  # Cleanup after a maneuver is interrupted (e.g. cut throttle)
+        self.resumable = set(resumable)  # Commands that are safe to fly again after a lost connection
+        self.queue = queue.Queue()
+        self.running = None  # Taken off the queue, from then on, even while it waits for the connection
+        self.holding = False  # Whether the running command still waits for the connection
+        self.aborted_at = -float("inf")  # time.monotonic() of the last abort; commands received earlier never start
+        self.state = threading.Lock()  # Serialises an abort with the worker taking up and starting a command
+        self.interrupted = None  # Command cut short by a lost connection, for resume()
+        self.connected = threading.Event()  # Cleared while the game connection is down
+        self.connected.set()
+        self.latency = {}  # name -> [count, total queue wait, total run time, max queue wait]
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.work, name="dispatcher")
+        self.worker.daemon = True
+
+    def start(self):
+        # Commands submitted before this wait in the queue
+        self.worker.start()
+        return self
+
+    def submit(self, message):
+        if message == "ping":
+            return None
+        try:
+            command = parse(message)
+        except ValueError as e:
+            print("Ignoring command {!r}: {}".format(message, e))
+            return None
+        if command.name not in self.handlers:
+            print("Unknown command: {}".format(command.name))
+            return None
+        if command.name in PRIORITY:
+            self.preempt(command)
+        else:
+            self.queue.put(command)
+        return command
+
+    def preempt(self, command):
+        if command.name == "abort":
+            # Drop anything still queued, including a command the worker has taken but not started yet,
+            # and interrupt the running maneuver at its next wait
+            with self.state:
+                self.aborted_at = command.received
+                self.flush()
+                if self.running is not None:
+                    waits.cancel.set()
+        self.run(command)
+
+    def connection_lost(self):
+        # Stop the running maneuver at its next wait and hold further commands until resume()
+        self.connected.clear()
+        if self.running is not None:
+            waits.cancel.set()
+
+    def resume(self, timeout=5.):
+        # After reconnecting: fly the interrupted command again if it can pick up where it left off
+        deadline = time.monotonic() + timeout
+        while self.running is not None and not self.holding and time.monotonic() < deadline:
+            time.sleep(0.05)
+        command, self.interrupted = self.interrupted, None
+        self.connected.set()
+        if command is None:
+            return None
+        if command.name not in self.resumable:
+            print("Not resuming {}".format(command.name))
+            return None
+        print("Resuming {}".format(command.name))
+        self.queue.put(command._replace(received=time.monotonic()))
+        return command
+
+    def flush(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.queue.task_done()
+
+    def work(self):
+        while True:
+            command = self.queue.get()
+            self.running = command
+            self.holding = True
+            self.connected.wait()
+            with self.state:
+                self.holding = False
+                aborted = command.received <= self.aborted_at  # Also when the abort came before running was set
+                if not aborted:
+                    waits.cancel.clear()
+            try:
+                if aborted:
+                    print("Aborted before it started: {}".format(command.name))
+                else:
+                    self.run(command)
+            except waits.ManeuverAborted:
+                if not self.connected.is_set():
+                    print("Connection lost during {}".format(command.name))
+                    self.interrupted = command
+                else:
+                    print("Interrupted: {}".format(command.name))
+                    if self.on_preempt is not None:
+                        self.on_preempt()
+            except ConnectionError as e:
+                print("Connection lost during {}: {}".format(command.name, e))
+                self.interrupted = command
+            except Exception as e:
+                print("Command {} failed: {!r}".format(command.name, e))
+            finally:
+                self.running = None
+                self.queue.task_done()
+
+    def run(self, command):
+        started = time.monotonic()
+        try:
+            self.handlers[command.name](*command.args)
+        finally:
+            self.record(command, started, time.monotonic())
+
+    def record(self, command, started, finished):
+        waited = started - command.received
+        with self.lock:
+            entry = self.latency.setdefault(command.name, [0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += waited
+            entry[2] += finished - started
+            entry[3] = max(entry[3], waited)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def pending(self):
+        # Commands waiting behind the running one, oldest first
+        with self.queue.mutex:
+            return list(self.queue.queue)
+
+    def stats(self):
+        with self.lock:
+            return {name: {"count": count,
+                           "mean_wait": total_wait / count,
+                           "max_wait": max_wait,
+                           "mean_run": total_run / count}
+                    for name, (count, total_wait, total_run, max_wait) in self.latency.items()}
+
+    def report(self):
+        running = self.running.name if self.running is not None else "idle"
+        print("Queue depth: {} (running: {})".format(self.depth(), running))
+        for name, entry in sorted(self.stats().items()):
+            print("  {:<14} n={:<4} wait {:.3f}s (max {:.3f}s) run {:.1f}s".format(
+                name, entry["count"], entry["mean_wait"], entry["max_wait"], entry["mean_run"]))
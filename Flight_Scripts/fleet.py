@@ -0,0 +1,414 @@
+# Fleet controller: flies several vessels from one process over a single kRPC connection.
+# Each vessel gets a FlightContext with its own command queue, worked through by a coroutine, and
+# its streams come from a StreamPool shared by the whole fleet (UT is one stream for everyone).
+# Waits are awaits on the fleet clock, which wakes every context once per stream update, so one
+# vessel coasting never holds up another's burn. Time warp is shared by all vessels: the clock only
+# warps while every busy vessel is waiting for a later UT, and only as far as the earliest of them.
+#
+# Relay messages name the vessel as "<vessel>:<command>,<args>" (e.g. "1:setapoapsis,250000"),
+# where <vessel> is its number in the fleet (0 is the active vessel) or its name. Messages without
+# a prefix go to the active vessel, so the Alexa skill's commands keep working unchanged.
+#
+#   python fleet.py                  fly every vessel in the game
+#   python fleet.py "Relay 1" ...    fly the named vessels only (the active vessel is always 0)
+import asyncio
+import os
+import sys
+
+import krpc
+
+import ascent
+import bodies
+import dispatcher
+import guidance
+import maneuver
+import orbital
+import rpcstats
+import snapshot
+import staging
+
+RELAY = "ws://35.242.157.185/"
+
+
+class StreamPool(object):
+    # Streams shared between flight contexts: one server-side stream per (call, arguments),
+    # removed when the last user releases it
+    def __init__(self, conn):
+        self.conn = conn
+        self.streams = {}
+        self.users = {}
+
+    def get(self, func, *args):
+        key = (func, args)
+        if key not in self.streams:
+            self.streams[key] = self.conn.add_stream(func, *args)
+            self.users[key] = 0
+        self.users[key] += 1
+        return self.streams[key]
+
+    def release(self, func, *args):
+        key = (func, args)
+        self.users[key] -= 1
+        if self.users[key] == 0:
+            self.streams.pop(key).remove()
+            del self.users[key]
+
+    def __len__(self):
+        return len(self.streams)
+
+
+class FlightContext(object):
+    # One vessel's state and maneuvers. Maneuvers are coroutines that only await the fleet clock,
+    # so an abort (task cancellation) lands at the next tick with the throttle cut in a finally
+    start_gravity_turn = 250
+    end_gravity_turn = 50000
+    # Every snapshot field the maneuvers read. They are subscribed when the context is set up, since
+    # the first read of a field blocks until a frame carries it, and that would stall the event loop
+    fields = ("body", "apoapsis", "periapsis", "semi_major_axis", "time_to_apoapsis", "time_to_periapsis",
+              "mean_altitude", "apoapsis_altitude")
+
+    def __init__(self, fleet, vessel, number):
+        self.fleet = fleet
+        self.vessel = vessel
+        self.number = number
+        self.name = vessel.name
+        self.ut = fleet.ut
+        self.flight = vessel.flight()
+        self.orbit = vessel.orbit
+        self.altitude = fleet.pool.get(getattr, self.flight, "mean_altitude")
+        self.apoapsis = fleet.pool.get(getattr, self.orbit, "apoapsis_altitude")
+        # Planning and guidance reads, from one physics frame
+        self.snapshots = snapshot.Snapshots(fleet.conn, vessel, self.ut,
+                                            {"mean_altitude": self.altitude, "apoapsis_altitude": self.apoapsis})
+        self.snapshots.subscribe(*self.fields)
+        self.stages = staging.StagingPlan(fleet.conn, vessel)
+        self.executor = maneuver.NodeExecutor(fleet.conn, vessel, self.ut, tick=self.stages.check,
+                                              burn_time=self.stages.burn_time)
+        self.queue = asyncio.Queue()
+        self.command = None  # Command being flown
+        self.task = None
+        self.deadline = None  # UT this context is idling until, while it allows time warp
+        self.handlers = {
+            "launch": self.launch,
+            "circularise": self.circularise,
+            "setapoapsis": self.set_apoapsis,
+            "setperiapsis": self.set_periapsis,
+        }
+
+    def __repr__(self):
+        return "<FlightContext {} {}>".format(self.number, self.name)
+
+    def body(self):
+        return self.fleet.registry[self.snapshots.read("body").body]
+
+    # --- Waiting
+
+    async def wait_until(self, condition, tick=None):
+        while True:
+            if tick is not None:
+                tick()
+            if condition():
+                return
+            await self.fleet.next_update()
+
+    async def sleep(self, seconds):
+        # Game seconds
+        end = self.ut() + seconds
+        await self.wait_until(lambda: self.ut() >= end)
+
+    async def warp_to(self, ut):
+        # Let the fleet clock warp towards ut; it may stop short for another vessel's deadline
+        self.deadline = ut
+        try:
+            await self.wait_until(lambda: self.ut() >= ut)
+        finally:
+            self.deadline = None
+
+    async def aligned(self, tolerance=1.):
+        # The autopilot's error is only defined while it is engaged, so stream it just for the turn
+        auto_pilot = self.vessel.auto_pilot
+        error = self.fleet.pool.get(getattr, auto_pilot, "error")
+        try:
+            await self.wait_until(lambda: error() <= tolerance)
+        finally:
+            self.fleet.pool.release(getattr, auto_pilot, "error")
+
+    # --- Maneuvers
+
+    async def launch(self, desired_alt):
+        vessel = self.vessel
+        vessel.control.throttle = 1
+        self.stages.activate_next_stage()
+        start, end = ascent.lookup(vessel) or (self.start_gravity_turn, self.end_gravity_turn)
+        vessel.auto_pilot.target_pitch_and_heading(90, 90)
+        vessel.auto_pilot.engage()
+        turn = guidance.GravityTurn(vessel, start, end, desired_alt, tick=self.stages.check)
+        period = 1. / self.fleet.rate
+        next_tick = self.ut()
+        while True:
+            await self.wait_until(lambda: self.ut() >= next_tick)
+            if turn.step(guidance.Telemetry(*self.snapshots.read("mean_altitude", "apoapsis_altitude"))):
+                break
+            # Skip missed slots rather than bunching ticks up
+            next_tick = max(next_tick + period, self.ut())
+
+        vessel.control.throttle = 0.25
+        await self.wait_until(lambda: self.apoapsis() >= desired_alt, tick=self.stages.check)
+        vessel.control.throttle = 0.0
+        print("{}: target apoapsis reached".format(self.name))
+
+        current = self.body()
+        climb_height = current.atmosphere_depth if current.has_atmosphere else 7000
+        await self.wait_until(lambda: self.altitude() >= climb_height)
+        vessel.control.toggle_action_group(1)
+        await self.circularise()
+        print("{}: launch complete".format(self.name))
+
+    async def circularise(self, at_apoapsis=True, rcs=False):
+        apsis = "apoapsis" if at_apoapsis else "periapsis"
+        now = self.snapshots.read("body", apsis, "semi_major_axis", "time_to_" + apsis)
+        mu = self.fleet.registry[now.body].gravitational_parameter
+        delta_v = float(orbital.circularisation_delta_v(mu, getattr(now, apsis), now.semi_major_axis))
+        node = self.vessel.control.add_node(now.ut + getattr(now, "time_to_" + apsis), prograde=delta_v)
+        await self.execute(node, rcs)
+
+    async def set_apoapsis(self, desired_alt, rcs=False):
+        await self.set_altitude(desired_alt, True, rcs)
+
+    async def set_periapsis(self, desired_alt, rcs=False):
+        await self.set_altitude(desired_alt, False, rcs)
+
+    async def set_altitude(self, desired_alt, at_apoapsis=True, rcs=False):
+        # Raise or lower the apsis opposite the burn
+        apsis, opposite = ("apoapsis", "periapsis") if at_apoapsis else ("periapsis", "apoapsis")
+        now = self.snapshots.read("body", apsis, "time_to_" + opposite)
+        current = self.fleet.registry[now.body]
+        delta_v = float(orbital.hohmann_elliptical(current.gravitational_parameter, getattr(now, apsis),
+                                                   desired_alt + current.equatorial_radius))
+        node = self.vessel.control.add_node(now.ut + getattr(now, "time_to_" + opposite), prograde=delta_v)
+        await self.execute(node, rcs)
+
+    async def execute(self, node, rcs=False):
+        # NodeExecutor.execute with its blocking waits turned into awaits
+        executor = self.executor
+        try:
+            executor.point(node, rcs)
+            await self.aligned()
+            start = node.ut - executor.burn_duration(node) / 2.
+            await self.warp_to(start - executor.lead_time)
+            await self.wait_until(lambda: self.ut() >= start)
+            burn = maneuver.Burn(executor, node)
+            try:
+                while not burn.step():
+                    await self.sleep(executor.period)
+            finally:
+                burn.close()
+            print("{}: burn complete, {:.2f} m/s left".format(self.name, burn.delta_v))
+            return burn.delta_v
+        finally:
+            node.remove()
+
+    # --- Commands
+
+    async def work(self):
+        while True:
+            command = await self.queue.get()
+            self.command = command
+            self.task = asyncio.ensure_future(self.handlers[command.name](*command.args))
+            self.fleet.started()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                print("{}: interrupted {}".format(self.name, command.name))
+                self.vessel.control.throttle = 0
+            except Exception as e:
+                print("{}: command {} failed: {!r}".format(self.name, command.name, e))
+            finally:
+                self.command = None
+                self.task = None
+                self.fleet.finished()
+                self.queue.task_done()
+
+    def abort(self):
+        # Drop queued commands, interrupt the running one and fire the abort action group
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+        if self.task is not None:
+            self.task.cancel()
+        self.vessel.control.abort = True
+
+    def close(self):
+        pool = self.fleet.pool
+        pool.release(getattr, self.flight, "mean_altitude")
+        pool.release(getattr, self.orbit, "apoapsis_altitude")
+        self.stages.unsubscribe()
+        self.snapshots.close()
+
+
+class Fleet(object):
+    def __init__(self, conn, names=None, rate=20.):
+        # names: vessels to fly besides the active one (default every vessel in the game)
+        self.conn = conn
+        self.rate = rate  # Guidance ticks per game second
+        self.registry = bodies.load(conn)
+        self.pool = StreamPool(conn)
+        self.ut = self.pool.get(getattr, conn.space_center, "ut")
+        self.contexts = []
+        self.updated = None  # asyncio.Condition notified on every clock tick
+        self.busy = None  # asyncio.Event set while any context is flying a command
+        self.running = 0
+        self.workers = []
+        active = conn.space_center.active_vessel
+        self.add(active)
+        for vessel in conn.space_center.vessels:
+            if vessel != active and (names is None or vessel.name in names):
+                self.add(vessel)
+
+    def add(self, vessel):
+        context = FlightContext(self, vessel, len(self.contexts))
+        self.contexts.append(context)
+        if self.updated is not None:
+            self.workers.append(asyncio.ensure_future(context.work()))
+        return context
+
+    def find(self, key):
+        # Context by fleet number or vessel name; None is the active vessel
+        if key is None:
+            return self.contexts[0]
+        key = key.strip()
+        if key.isdigit() and int(key) < len(self.contexts):
+            return self.contexts[int(key)]
+        for context in self.contexts:
+            if context.name.lower() == key.lower():
+                return context
+        raise KeyError("No vessel {!r} in the fleet".format(key))
+
+    # --- Clock
+
+    def started(self):
+        self.running += 1
+        self.busy.set()
+
+    def finished(self):
+        self.running -= 1
+        if self.running == 0:
+            self.busy.clear()
+
+    async def next_update(self):
+        async with self.updated:
+            await self.updated.wait()
+
+    def warp_target(self):
+        # Earliest deadline, if every busy context is waiting on one that is still ahead
+        busy = [context for context in self.contexts if context.task is not None]
+        if not busy or any(context.deadline is None for context in busy):
+            return None
+        target = min(context.deadline for context in busy)
+        return target if target > self.ut() + 1. else None
+
+    def wait_update(self):
+        with self.ut.condition:
+            self.ut.wait(0.5)
+
+    async def clock(self):
+        # Runs in the background while anything is flying; the blocking waits happen on a worker
+        # thread so relay messages (aborts) are still handled during a long warp
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.busy.wait()
+            target = self.warp_target()
+            if target is not None:
+                await loop.run_in_executor(None, self.conn.space_center.warp_to, target)
+            else:
+                await loop.run_in_executor(None, self.wait_update)
+            async with self.updated:
+                self.updated.notify_all()
+
+    def start(self):
+        # Start the clock and one worker per context; call from inside the event loop
+        self.updated = asyncio.Condition()
+        self.busy = asyncio.Event()
+        self.workers = [asyncio.ensure_future(context.work()) for context in self.contexts]
+        self.workers.append(asyncio.ensure_future(self.clock()))
+
+    async def join(self):
+        # Wait for every submitted command to finish
+        await asyncio.gather(*(context.queue.join() for context in self.contexts))
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        for context in self.contexts:
+            context.close()
+        self.pool.release(getattr, self.conn.space_center, "ut")
+
+    # --- Relay
+
+    def submit(self, message):
+        if message == "ping":
+            return None
+        key, separator, rest = message.partition(":")
+        if not separator:
+            key, rest = None, message
+        try:
+            context = self.find(key)
+            command = dispatcher.parse(rest)
+        except (KeyError, ValueError) as e:
+            print("Ignoring command {!r}: {}".format(message, e))
+            return None
+        if command.name == "abort":
+            context.abort()
+        elif command.name == "status":
+            self.report()
+        elif command.name in context.handlers:
+            context.queue.put_nowait(command)
+        else:
+            print("Unknown command: {}".format(command.name))
+            return None
+        return command
+
+    def report(self):
+        print("Fleet: {} vessel(s), {} shared stream(s)".format(len(self.contexts), len(self.pool)))
+        for context in self.contexts:
+            running = context.command.name if context.command is not None else "idle"
+            print("  {} {:<20} {} (queued: {})".format(context.number, context.name, running, context.queue.qsize()))
+
+
+def connect():
+    # Same as Flight.connect(): KRPC_SIM=<scenario>[,<scenario>...] flies against the simulator
+    scenario = os.environ.get("KRPC_SIM")
+    if scenario:
+        import sim
+        return rpcstats.profile(sim.connect(name="Fleet", scenario=scenario))
+    return rpcstats.profile(krpc.connect(name="Fleet", address="127.0.0.1", rpc_port=50000, stream_port=50001))
+
+
+async def serve(conn, names=None, url=RELAY):
+    import websocket
+    loop = asyncio.get_running_loop()
+    fleet = Fleet(conn, names)
+    fleet.start()
+    fleet.report()
+
+    def on_message(ws, message):
+        if message != "ping":
+            print(message)
+        loop.call_soon_threadsafe(fleet.submit, message)
+
+    ws = websocket.WebSocketApp(url, on_message=on_message,
+                                on_open=lambda ws: print("Connected to server!"),
+                                on_close=lambda ws: print("Server connection lost!"))
+    try:
+        await loop.run_in_executor(None, ws.run_forever)
+    finally:
+        fleet.stop()
+
+
+def main(argv=None):
+    names = sys.argv[1:] if argv is None else argv
+    asyncio.run(serve(connect(), names or None))
+
+
+if __name__ == "__main__":
+    main()
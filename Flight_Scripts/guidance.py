@@ -0,0 +1,87 @@
+# Ascent guidance run at a fixed rate.
+# The scheduler ticks on the UT stream at `rate` Hz of game time, independent of how long RPCs take,
+# and records how late each tick started (jitter) and how often a tick ran into the next one (overrun).
+# Each tick works on one telemetry snapshot, and the pitch program is continuous in altitude.
+import collections
+
+import waits
+
+Telemetry = collections.namedtuple("Telemetry", ["ut", "altitude", "apoapsis"])
+
+
+class Scheduler(object):
+    def __init__(self, ut, rate=20.):
+        self.ut = ut  # UT stream
+        self.period = 1. / rate
+        self.ticks = 0
+        self.overruns = 0
+        self.jitter_total = 0.
+        self.jitter_max = 0.
+
+    def run(self, step, snapshots=None, fields=()):
+        # Call step(ut) once per period until it returns True. Given snapshots, step gets
+        # snapshots.read(*fields) instead: ut and fields, all from the tick's physics frame
+        next_tick = self.ut()
+        while True:
+            waits.wait_until(lambda: self.ut() >= next_tick, self.ut)
+            now = self.ut()
+            jitter = now - next_tick
+            self.ticks += 1
+            self.jitter_total += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+            if step(now if snapshots is None else snapshots.read(*fields)):
+                return
+            next_tick += self.period
+            behind = self.ut() - next_tick
+            if behind >= 0:
+                # The tick ran past the next slot: skip the missed slots rather than bunching them up
+                self.overruns += 1
+                next_tick += self.period * (int(behind / self.period) + 1)
+
+    def summary(self):
+        mean = self.jitter_total / self.ticks if self.ticks else 0.
+        return "{} ticks at {:.0f} Hz, jitter mean {:.1f}ms max {:.1f}ms, {} overruns".format(
+            self.ticks, 1. / self.period, mean * 1e3, self.jitter_max * 1e3, self.overruns)
+
+
+class GravityTurn(object):
+    # Pitch falls linearly with altitude from 90 degrees at start to 0 at end; commands are only
+    # sent once the pitch has moved by resolution degrees
+    def __init__(self, vessel, start, end, target_apoapsis, heading=90, resolution=0.25, tick=None, pitch=90.):
+        self.vessel = vessel
+        self.start = start
+        self.end = end
+        self.target_apoapsis = target_apoapsis
+        self.heading = heading
+        self.resolution = resolution
+        self.tick = tick  # Called every guidance tick (e.g. checkFuel)
+        self.commanded = pitch  # Pitch already set on the autopilot
+
+    def pitch(self, altitude):
+        fraction = min(1., max(0., (altitude - self.start) / float(self.end - self.start)))
+        return 90. * (1. - fraction)
+
+    def step(self, telemetry):
+        if self.tick is not None:
+            self.tick()
+        if telemetry.apoapsis > self.target_apoapsis * 0.9:
+            return True
+        pitch = self.pitch(telemetry.altitude)
+        if abs(pitch - self.commanded) >= self.resolution:
+            self.vessel.auto_pilot.target_pitch_and_heading(pitch, self.heading)
+            self.commanded = pitch
+        return False
+
+
+def ascend(vessel, ut, altitude, apoapsis, start, end, target_apoapsis, tick=None, rate=20., snapshots=None):
+    # Fly the gravity turn until the apoapsis is within 90% of the target. ut, altitude and apoapsis
+    # are streams, read one after the other unless snapshots (a snapshot.Snapshots) is given to read
+    # mean_altitude and apoapsis_altitude from one frame; returns the scheduler for its timing statistics
+    turn = GravityTurn(vessel, start, end, target_apoapsis, tick=tick)
+    scheduler = Scheduler(ut, rate)
+    if snapshots is None:
+        scheduler.run(lambda now: turn.step(Telemetry(now, altitude(), apoapsis())))
+    else:
+        scheduler.run(lambda frame: turn.step(Telemetry(*frame)), snapshots, ("mean_altitude", "apoapsis_altitude"))
+    print("Guidance: {}".format(scheduler.summary()))
+    return scheduler
@@ -0,0 +1,271 @@
+# Local two-body propagation from orbital elements.
+# Positions, velocities, phase angles and SOI entries are computed here from an orbit's elements
+# instead of asking the game (orbit.position_at costs a round trip per time, and cannot be asked
+# about while warping). Like orbital.py every function is pure NumPy and takes arrays of times.
+# Elements follow kRPC: angles in radians, the mean anomaly at epoch, and a negative semi-major axis
+# on escape trajectories. Positions come out in a frame fixed to the body being orbited (its
+# reference plane and direction), which is all that comparing two orbits around the same body needs.
+#
+# lambert() solves the transfer between two positions in a given time, over whole grids at once.
+#
+# Tracker holds the vessel's elements, read once and read again only once a burn or an SOI change
+# has moved them.
+import collections
+
+import numpy as np
+
+import orbital
+
+Elements = collections.namedtuple("Elements", ["mu", "semi_major_axis", "eccentricity", "inclination",
+                                               "longitude_of_ascending_node", "argument_of_periapsis",
+                                               "mean_anomaly_at_epoch", "epoch"])
+
+ELEMENT_FIELDS = Elements._fields[1:]  # What kRPC's Orbit calls them (mu comes from the body)
+
+
+def from_body(body, mu):
+    # Elements of a bodies.Body's orbit (cached constants) around a parent with gravitational parameter mu
+    return Elements(mu, *(getattr(body, field) for field in ELEMENT_FIELDS))
+
+
+def rotation(elements):
+    # Perifocal to body frame: columns are the periapsis direction, 90 degrees on, and the orbit normal
+    raan, i, argp = elements.longitude_of_ascending_node, elements.inclination, elements.argument_of_periapsis
+    co, so, ci, si, cw, sw = np.cos(raan), np.sin(raan), np.cos(i), np.sin(i), np.cos(argp), np.sin(argp)
+    return np.array([[co * cw - so * sw * ci, -co * sw - so * cw * ci, so * si],
+                     [so * cw + co * sw * ci, -so * sw + co * cw * ci, -co * si],
+                     [sw * si, cw * si, ci]])
+
+
+def normal(elements):
+    return rotation(elements)[:, 2]
+
+
+def mean_anomaly(elements, ut):
+    a = abs(elements.semi_major_axis)
+    m = elements.mean_anomaly_at_epoch + orbital.mean_motion(elements.mu, a) * (np.asarray(ut, dtype=float) -
+                                                                                elements.epoch)
+    if elements.eccentricity < 1.:
+        m = (m + np.pi) % (2. * np.pi) - np.pi
+    return m
+
+
+def true_anomaly(elements, ut, tolerance=1e-12, iterations=50):
+    # Kepler's equation by Newton's method, for every time at once
+    m = mean_anomaly(elements, ut)
+    e = elements.eccentricity
+    if e < 1.:
+        big_e = m if e < 0.8 else np.where(m < 0., -np.pi, np.pi)  # Starts from which Newton always converges
+        for _ in range(iterations):
+            step = (big_e - e * np.sin(big_e) - m) / (1. - e * np.cos(big_e))
+            big_e = big_e - step
+            if np.all(np.abs(step) < tolerance):
+                break
+        return 2. * np.arctan2(np.sqrt(1. + e) * np.sin(big_e / 2.), np.sqrt(1. - e) * np.cos(big_e / 2.))
+    f = np.arcsinh(m / e)
+    for _ in range(iterations):
+        step = (e * np.sinh(f) - f - m) / (e * np.cosh(f) - 1.)
+        f = f - step
+        if np.all(np.abs(step) < tolerance):
+            break
+    return 2. * np.arctan2(np.sqrt(e + 1.) * np.sinh(f / 2.), np.sqrt(e - 1.) * np.cosh(f / 2.))
+
+
+def state(elements, ut):
+    # Position and velocity (arrays of shape ut.shape + (3,)) relative to the body
+    nu = true_anomaly(elements, ut)
+    e = elements.eccentricity
+    p = elements.semi_major_axis * (1. - e * e)
+    r = p / (1. + e * np.cos(nu))
+    k = np.sqrt(elements.mu / p)
+    zero = np.zeros_like(nu)
+    position = np.stack([r * np.cos(nu), r * np.sin(nu), zero], axis=-1)
+    velocity = np.stack([-k * np.sin(nu), k * (e + np.cos(nu)), zero], axis=-1)
+    matrix = rotation(elements)
+    return position.dot(matrix.T), velocity.dot(matrix.T)
+
+
+def position(elements, ut):
+    return state(elements, ut)[0]
+
+
+def from_state(mu, r, v, ut):
+    # Elements of the orbit through position r with velocity v at ut
+    r = np.asarray(r, dtype=float)
+    v = np.asarray(v, dtype=float)
+    radius = np.linalg.norm(r)
+    h = np.cross(r, v)
+    w = h / np.linalg.norm(h)
+    e_vector = (np.dot(v, v) - mu / radius) * r / mu - np.dot(r, v) * v / mu
+    e = float(np.linalg.norm(e_vector))
+    a = 1. / (2. / radius - np.dot(v, v) / mu)
+    if e > 1e-9:
+        p_axis = e_vector / e
+    else:  # Circular: measure from the ascending node (or the reference direction in the reference plane)
+        node = np.cross((0., 0., 1.), w)
+        p_axis = node / np.linalg.norm(node) if np.linalg.norm(node) > 1e-9 else np.array([1., 0., 0.])
+        p_axis = p_axis - np.dot(p_axis, w) * w
+        p_axis /= np.linalg.norm(p_axis)
+    q_axis = np.cross(w, p_axis)
+    i = float(np.arccos(np.clip(w[2], -1., 1.)))
+    if np.hypot(w[0], w[1]) > 1e-9:
+        raan = float(np.arctan2(w[0], -w[1]))
+        argp = float(np.arctan2(p_axis[2], q_axis[2]))
+    else:  # In the reference plane: no node, so the argument of periapsis is measured from the reference direction
+        raan = 0.
+        argp = float(np.arctan2(p_axis[1] * np.sign(w[2]), p_axis[0]))
+    nu = float(np.arctan2(np.dot(r, q_axis), np.dot(r, p_axis)))
+    if e < 1.:
+        big_e = 2. * np.arctan2(np.sqrt(1. - e) * np.sin(nu / 2.), np.sqrt(1. + e) * np.cos(nu / 2.))
+        m = big_e - e * np.sin(big_e)
+    else:
+        f = 2. * np.arctanh(np.sqrt((e - 1.) / (e + 1.)) * np.tan(nu / 2.))
+        m = e * np.sinh(f) - f
+    return Elements(mu, float(a), e, i, raan, argp, float(m), float(ut))
+
+
+def time_to_periapsis(elements, ut):
+    m = mean_anomaly(elements, ut)
+    n = orbital.mean_motion(elements.mu, abs(elements.semi_major_axis))
+    if elements.eccentricity < 1.:
+        return ((-m) % (2. * np.pi)) / n
+    return -m / n
+
+
+def period(elements):
+    return float(orbital.orbital_period(elements.mu, elements.semi_major_axis)) if elements.eccentricity < 1. \
+        else float("inf")
+
+
+def phase_angle(elements, target, ut):
+    # Degrees (0-360) the target leads the orbit at each ut, measured around the orbit's normal
+    return orbital.signed_phase_angle(position(elements, ut), position(target, ut), normal(elements))
+
+
+def next_phase(elements, target, angle, ut, tolerance=1e-3, iterations=20):
+    # First UT after ut at which the target leads by angle (degrees), for an inner orbit closing on an
+    # outer one: the mean-motion estimate, corrected from the propagated phase until it holds
+    n_inner = orbital.mean_motion(elements.mu, elements.semi_major_axis)
+    n_outer = orbital.mean_motion(target.mu, target.semi_major_axis)
+    closing_rate = float(np.degrees(n_inner - n_outer))
+    t = ut + float(orbital.time_to_phase_angle(phase_angle(elements, target, ut), angle, n_inner, n_outer))
+    for _ in range(iterations):
+        error = (float(phase_angle(elements, target, t)) - angle + 180.) % 360. - 180.
+        t += error / closing_rate
+        if abs(error) < tolerance:
+            break
+    return t
+
+
+def soi_entry(elements, target, soi, ut, horizon=None, step=60., tolerance=1e-3):
+    # First UT within horizon seconds of ut (default one period, or ten days on escape) at which the orbit
+    # comes within soi of the target; None if it does not. Sampled every step seconds, then bisected.
+    horizon = horizon or min(period(elements), 864000.)
+    times = ut + np.arange(0., horizon + step, step)
+    inside = orbital.separation(position(elements, times), position(target, times)) < soi
+    if not inside.any():
+        return None
+    first = int(np.argmax(inside))
+    if first == 0:
+        return ut
+    lo, hi = times[first - 1], times[first]
+    while hi - lo > tolerance:
+        mid = (lo + hi) / 2.
+        if orbital.separation(position(elements, mid), position(target, mid)) < soi:
+            hi = mid
+        else:
+            lo = mid
+    return float(hi)
+
+
+def encounter(elements, target, target_mu, soi, ut, **kwargs):
+    # (UT of SOI entry, UT of periapsis at the target, elements around the target), or None without an encounter
+    entry = soi_entry(elements, target, soi, ut, **kwargs)
+    if entry is None:
+        return None
+    r, v = state(elements, entry)
+    r_target, v_target = state(target, entry)
+    patch = from_state(target_mu, r - r_target, v - v_target, entry)
+    return entry, entry + float(time_to_periapsis(patch, entry)), patch
+
+
+def stumpff(z):
+    # Stumpff functions C(z) and S(z) of the universal variable formulation
+    z = np.asarray(z, dtype=float)
+    c = np.full_like(z, 0.5)
+    s = np.full_like(z, 1. / 6.)
+    positive, negative = z > 1e-8, z < -1e-8
+    root = np.sqrt(z[positive])
+    c[positive] = (1. - np.cos(root)) / z[positive]
+    s[positive] = (root - np.sin(root)) / root ** 3
+    root = np.sqrt(-z[negative])
+    c[negative] = (np.cosh(root) - 1.) / -z[negative]
+    s[negative] = (np.sinh(root) - root) / root ** 3
+    return c, s
+
+
+def lambert(mu, r1, r2, flight_time, normal, iterations=50):
+    # Velocities (v1, v2) of the zero-revolution transfer from position r1 to r2 taking flight_time seconds,
+    # the short or long way round so that it moves in the direction of normal. Every argument broadcasts:
+    # positions along the last axis, e.g. a whole departure x flight time grid in one call.
+    # Universal variables, bisecting on z; transfers of exactly 180 degrees come out as nan.
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    flight_time = np.asarray(flight_time, dtype=float)
+    radius1 = np.linalg.norm(r1, axis=-1)
+    radius2 = np.linalg.norm(r2, axis=-1)
+    cos_angle = np.clip(np.sum(r1 * r2, axis=-1) / (radius1 * radius2), -1., 1.)
+    short_way = np.sum(np.cross(r1, r2) * np.asarray(normal, dtype=float), axis=-1) >= 0.
+    sin_angle = np.where(short_way, 1., -1.) * np.sqrt(1. - cos_angle ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = sin_angle * np.sqrt(radius1 * radius2 / (1. - cos_angle))
+    shape = np.broadcast(a, flight_time).shape
+    low = np.full(shape, -400.)  # Hyperbolic enough for any flight time asked of a planner
+    high = np.full(shape, 4. * np.pi ** 2)  # One full revolution
+
+    def y_of(z):
+        c, s = stumpff(z)
+        return radius1 + radius2 + a * (z * s - 1.) / np.sqrt(c), c, s
+
+    for _ in range(iterations):
+        z = (low + high) / 2.
+        y, c, s = y_of(z)
+        valid = y > 0.
+        y = np.where(valid, y, 0.)
+        t = ((y / c) ** 1.5 * s + a * np.sqrt(y)) / np.sqrt(mu)
+        short = ~valid | (t < flight_time)  # Flight time grows with z, and y < 0 lies below every solution
+        low = np.where(short, z, low)
+        high = np.where(short, high, z)
+    y = y_of((low + high) / 2.)[0]
+    f = (1. - y / radius1)[..., np.newaxis]
+    g = (a * np.sqrt(y / mu))[..., np.newaxis]
+    g_dot = (1. - y / radius2)[..., np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (r2 - f * r1) / g, (g_dot * r2 - r1) / g
+
+
+class Tracker(object):
+    # The vessel's elements, refreshed when the orbit's shape or the body it is around changes
+    def __init__(self, snapshots, registry, tolerance=1e-6):
+        self.snapshots = snapshots  # snapshot.Snapshots of the vessel
+        self.registry = registry  # bodies.Registry
+        self.tolerance = tolerance  # Fractional change in semi-major axis or eccentricity taken as a burn
+        self.body = None  # bodies.Body the cached elements are around
+        self.cached = None
+        self.refreshes = 0
+
+    def elements(self):
+        now = self.snapshots.read("body", "semi_major_axis", "eccentricity")
+        cached = self.cached
+        if (cached is None or self.registry[now.body] is not self.body or
+                abs(now.semi_major_axis - cached.semi_major_axis) > self.tolerance * abs(cached.semi_major_axis) or
+                abs(now.eccentricity - cached.eccentricity) > self.tolerance * max(cached.eccentricity, 1e-3)):
+            self.refresh()
+        return self.cached
+
+    def refresh(self):
+        now = self.snapshots.read("body", *ELEMENT_FIELDS)
+        self.body = self.registry[now.body]
+        self.cached = Elements(self.body.gravitational_parameter, *(getattr(now, field) for field in ELEMENT_FIELDS))
+        self.refreshes += 1
+        return self.cached
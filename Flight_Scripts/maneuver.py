@@ -0,0 +1,121 @@
+# Maneuver node execution shared by the flight scripts.
+# Orient along the node, warp to half the burn time before it, then run a fixed-rate loop
+# (paced on the UT stream) that sets the throttle from the remaining delta-v and the current
+# acceleration, so the burn tapers off and ends within a bounded number of ticks. The throttle
+# moves between a few fixed levels so the taper costs a handful of RPCs rather than one per tick.
+import orbital
+import waits
+
+
+class NodeExecutor(object):
+    def __init__(self, conn, vessel, ut, tick=None, rate=10., lead_time=5., time_constant=0.5,
+                 levels=(1., 0.5, 0.25, 0.1, 0.05), tolerance=0.1, max_taper_ticks=100, burn_time=None):
+        self.conn = conn
+        self.vessel = vessel
+        self.ut = ut  # UT stream
+        self.tick = tick  # Called every control tick (e.g. checkFuel)
+        self.burn_time = burn_time  # burn_time(delta_v) -> seconds across stages (staging.StagingPlan.burn_time)
+        self.period = 1. / rate  # Game seconds between control ticks
+        self.lead_time = lead_time
+        self.time_constant = time_constant  # Seconds over which the remaining delta-v is burnt off while tapering
+        self.levels = sorted(levels, reverse=True)  # Throttle settings, the last is the minimum
+        self.tolerance = tolerance  # Remaining delta-v (m/s) at which the burn stops
+        self.max_taper_ticks = max_taper_ticks
+        self.active = None  # Burn in progress
+        self.aimed = None  # Autopilot of the last point(), waited on by a pointed execute()
+
+    def remaining_burn(self):
+        # Delta-v left on the burn in progress (m/s), nan between burns
+        burn = self.active
+        return burn.delta_v if burn is not None and burn.delta_v is not None else float("nan")
+
+    def point(self, node, rcs=False):
+        # Aim the autopilot along the node without waiting for it to get there
+        self.vessel.control.rcs = rcs
+        auto_pilot = self.vessel.auto_pilot
+        auto_pilot.engage()
+        auto_pilot.reference_frame = node.reference_frame
+        auto_pilot.target_direction = (0, 1, 0)
+        self.aimed = auto_pilot
+        return auto_pilot
+
+    def orient(self, node, rcs=False):
+        self.point(node, rcs).wait()
+
+    def burn_duration(self, node):
+        # Seconds at full thrust for the node's delta-v; only the current stage's engines without burn_time
+        if self.burn_time is not None:
+            return self.burn_time(node.delta_v)
+        vessel = self.vessel
+        return float(orbital.burn_time(node.delta_v, vessel.available_thrust, vessel.specific_impulse, vessel.mass))
+
+    def execute(self, node, rcs=False, pointed=False):
+        # Fly the node and remove it; returns the delta-v left over (m/s, negative on overshoot).
+        # pointed: point() has already aimed the autopilot at the node, so the turn overlaps the coast
+        # and only what is left of it is waited for, in the lead time before the burn
+        if not pointed:
+            self.orient(node, rcs)
+        start = node.ut - self.burn_duration(node) / 2.
+        self.conn.space_center.warp_to(start - self.lead_time)
+        if pointed:
+            self.aimed.wait()
+        waits.wait_until(lambda: self.ut() >= start, self.ut)
+        try:
+            return self.burn(node)
+        finally:
+            node.remove()
+
+    def burn(self, node):
+        burn = Burn(self, node)
+        try:
+            while not burn.step():
+                next_tick = self.ut() + self.period
+                waits.wait_until(lambda: self.ut() >= next_tick, self.ut)
+        finally:
+            burn.close()
+        return burn.delta_v
+
+
+class Burn(object):
+    # One node burn, advanced a control tick at a time by step(); NodeExecutor.burn paces it on
+    # the UT stream, the fleet controller from a coroutine
+    def __init__(self, executor, node):
+        conn = executor.conn
+        self.executor = executor
+        self.control = executor.vessel.control
+        self.remaining = conn.add_stream(node.remaining_burn_vector, node.reference_frame)
+        self.thrust = conn.add_stream(getattr, executor.vessel, "available_thrust")
+        self.mass = conn.add_stream(getattr, executor.vessel, "mass")
+        self.throttle = None
+        self.tapering = 0
+        self.delta_v = None
+        executor.active = self
+
+    def step(self):
+        # Set the throttle for this tick; True once the burn is over
+        executor = self.executor
+        if executor.tick is not None:
+            executor.tick()
+        self.delta_v = delta_v = self.remaining()[1]
+        acceleration = self.thrust() / self.mass()
+        # Stop once less than half a tick at minimum throttle remains
+        if delta_v <= max(executor.tolerance, 0.5 * acceleration * executor.levels[-1] * executor.period):
+            return True
+        wanted = 1. if acceleration <= 0 else min(1., delta_v / (acceleration * executor.time_constant))
+        if wanted < 1.:
+            self.tapering += 1
+            if self.tapering > executor.max_taper_ticks:
+                print("Burn stopped with {:.1f} m/s left".format(delta_v))
+                return True
+        wanted = next((level for level in executor.levels if level <= wanted), executor.levels[-1])
+        if wanted != self.throttle:
+            self.control.throttle = wanted
+            self.throttle = wanted
+        return False
+
+    def close(self):
+        self.executor.active = None
+        self.control.throttle = 0.0
+        self.remaining.remove()
+        self.thrust.remove()
+        self.mass.remove()
@@ -0,0 +1,260 @@
+# Monte Carlo dispersion runs of the Mun mission in the simulator.
+# Each run flies Flight.mun_transfer() (transfer burn, capture and lowering to 30 km) and/or
+# Flight.land_on_mun() in a fresh simulated game whose craft has its thrust, specific impulse and
+# dry mass perturbed, and whose RPCs take a perturbed amount of game time (command timing). Runs are
+# seeded, so any one of them can be flown again on its own with --seed/--runs 1.
+#
+# Runs are spread over a process pool (each worker imports Flight once) and come back one small
+# record at a time; they are folded straight into running statistics and, with --out, written to
+# a JSON lines file, so memory use does not grow with the number of runs.
+#
+#   python montecarlo.py --runs 1000                  transfer and landing from a 100 km Kerbin orbit
+#   python montecarlo.py --mission landing --thrust 0.05 --out runs.jsonl
+import argparse
+import collections
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+MISSIONS = {
+    # name -> (starting scenario, steps)
+    "mun": ("orbit", ("mun_transfer", "land_on_mun")),
+    "transfer": ("orbit", ("mun_transfer",)),
+    "landing": ("munar", ("land_on_mun",)),
+}
+
+Dispersion = collections.namedtuple("Dispersion", ["thrust", "isp", "mass", "timing"])  # Standard deviations, as fractions
+
+
+def disperse(craft, dispersion, rng):
+    # A copy of the craft's segments with every engine and dry mass perturbed
+    result = []
+    for spec in craft:
+        spec = dict(spec, fuel=dict(spec.get("fuel", {})))
+        spec["dry_mass"] *= max(0.1, 1. + rng.normal(0., dispersion.mass))
+        if spec.get("thrust"):
+            spec["thrust"] *= max(0.1, 1. + rng.normal(0., dispersion.thrust))
+            spec["isp"] *= max(0.1, 1. + rng.normal(0., dispersion.isp))
+        result.append(spec)
+    return result
+
+
+def start_worker():
+    # Pool initializer: import the flight script once per process, quietly
+    os.environ["KSP_ASCENT_CACHE"] = ""
+    os.environ.pop("FLIGHT_RECORD", None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import Flight  # noqa: F401
+
+
+def fly(job):
+    # One mission; returns a small record
+    seed, mission, dispersion, limit = job
+    import sim
+    import waits
+    import Flight
+    rng = np.random.RandomState(seed)
+    craft = disperse(sim.DEFAULT_CRAFT, dispersion, rng)
+    rpc_time = 0.002 * math.exp(rng.normal(0., dispersion.timing))
+    scenario, steps = MISSIONS[mission]
+    conn = sim.connect(name="MonteCarlo", scenario=scenario, craft=craft, rpc_time=rpc_time)
+    world = conn.world
+    vessel = world.active
+    started = world.ut
+    used = [0.]  # Delta-v from thrust, integrated over the physics frames
+
+    def frame():
+        engine = vessel.engine
+        if engine is not None and engine.propellant > 0 and not vessel.crashed:
+            used[0] += engine.thrust * (1. if engine.solid else vessel.throttle) / vessel.mass * world.dt
+        if vessel.crashed or world.ut - started > limit:
+            waits.cancel.set()
+
+    waits.cancel.clear()
+    world.listeners.append(frame)
+    wall = time.perf_counter()
+    failure = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            Flight.bind(conn)
+            for step in steps:
+                getattr(Flight, step)()
+    except waits.ManeuverAborted:
+        failure = "crashed" if vessel.crashed else "timed out"
+    except Exception as e:
+        failure = type(e).__name__
+    finally:
+        world.listeners.remove(frame)
+        waits.cancel.clear()
+        conn.close()
+    ended = world.ut
+    if failure is None:
+        world.advance(2.)  # Let a lander that hopped on touchdown settle
+        if "land_on_mun" in steps and not vessel.landed:
+            failure = "crashed" if vessel.crashed else "not landed"
+        elif vessel.body.name != "Mun":
+            failure = "missed the Mun"
+    return {
+        "seed": seed,
+        "success": failure is None,
+        "failure": failure,
+        "delta_v": used[0],
+        "game_seconds": ended - started,
+        "wall_seconds": time.perf_counter() - wall,
+        "propellant_left": vessel.mass - vessel.dry_mass,
+    }
+
+
+class Histogram(object):
+    # Log-spaced bins, kept sparsely, for percentiles to a relative precision without the samples
+    def __init__(self, precision=0.001):
+        self.step = math.log1p(precision)
+        self.counts = collections.Counter()
+        self.total = 0
+
+    def add(self, value):
+        self.counts[int(math.floor(math.log(max(value, 1e-9)) / self.step))] += 1
+        self.total += 1
+
+    def percentile(self, fraction):
+        # Middle of the bin holding that fraction of the samples
+        if not self.total:
+            return float("nan")
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= fraction * self.total:
+                return math.exp((index + 0.5) * self.step)
+
+
+class Summary(object):
+    # Running count, mean, standard deviation (Welford), range and histogram of one quantity
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.histogram = Histogram()
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.histogram.add(value)
+
+    def report(self):
+        if not self.count:
+            return {"count": 0}
+        percentile = lambda fraction: min(self.max, max(self.min, self.histogram.percentile(fraction)))
+        return {"count": self.count, "mean": self.mean, "std": math.sqrt(self.m2 / self.count),
+                "min": self.min, "max": self.max, "p5": percentile(0.05), "p50": percentile(0.5),
+                "p95": percentile(0.95)}
+
+
+class Aggregate(object):
+    def __init__(self):
+        self.runs = 0
+        self.successes = 0
+        self.failures = collections.Counter()
+        self.delta_v = Summary()  # m/s, successful runs
+        self.game_seconds = Summary()
+        self.wall_seconds = Summary()
+
+    def add(self, record):
+        self.runs += 1
+        self.wall_seconds.add(record["wall_seconds"])
+        if record["success"]:
+            self.successes += 1
+            self.delta_v.add(record["delta_v"])
+            self.game_seconds.add(record["game_seconds"])
+        else:
+            self.failures[record["failure"]] += 1
+
+    def report(self):
+        return {"runs": self.runs, "success_rate": self.successes / self.runs if self.runs else 0.,
+                "failures": dict(self.failures), "delta_v": self.delta_v.report(),
+                "time_to_complete": self.game_seconds.report(), "wall_per_run": self.wall_seconds.report()}
+
+
+def run(runs, mission="mun", dispersion=Dispersion(0.02, 0.01, 0.02, 0.5), seed=0, workers=None, out=None,
+        limit=400000., progress=None):
+    # Fly runs missions and return the aggregate; progress(aggregate) is called after each run
+    workers = workers or multiprocessing.cpu_count()
+    jobs = ((seed + i, mission, dispersion, limit) for i in range(runs))
+    aggregate = Aggregate()
+    sink = open(out, "w") if out else None
+    try:
+        with multiprocessing.Pool(workers, initializer=start_worker) as pool:
+            # Small chunks keep every worker busy to the end without a round trip per run
+            for record in pool.imap_unordered(fly, jobs, chunksize=max(1, runs // (workers * 16))):
+                aggregate.add(record)
+                if sink is not None:
+                    sink.write(json.dumps(record) + "\n")
+                if progress is not None:
+                    progress(aggregate)
+    finally:
+        if sink is not None:
+            sink.close()
+    return aggregate
+
+
+def show(report, wall, workers):
+    print("{runs} runs on {workers} worker(s) in {wall:.1f}s ({rate:.2f} runs/s)".format(
+        workers=workers, wall=wall, rate=report["runs"] / wall if wall > 0 else 0., **report))
+    print("  success rate     {:.1%}".format(report["success_rate"]))
+    for reason, count in sorted(report["failures"].items(), key=lambda item: -item[1]):
+        print("  failed           {} x {}".format(count, reason))
+    for name, unit in (("delta_v", "m/s"), ("time_to_complete", "s")):
+        s = report[name]
+        if s["count"]:
+            print("  {:<16} mean {:.0f} {unit}, std {:.1f}, p5 {:.0f}, p50 {:.0f}, p95 {:.0f}, max {:.0f}".format(
+                name, s["mean"], s["std"], s["p5"], s["p50"], s["p95"], s["max"], unit=unit))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo dispersion runs of the Mun mission in the simulator")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--mission", choices=sorted(MISSIONS), default="mun")
+    parser.add_argument("--thrust", type=float, default=0.02, help="thrust standard deviation (fraction)")
+    parser.add_argument("--isp", type=float, default=0.01, help="specific impulse standard deviation (fraction)")
+    parser.add_argument("--mass", type=float, default=0.02, help="dry mass standard deviation (fraction)")
+    parser.add_argument("--timing", type=float, default=0.5,
+                        help="standard deviation of the log of the game time each command takes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first run; run i uses seed + i")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--out", help="write every run's record to this JSON lines file")
+    parser.add_argument("--json", help="write the aggregate report to this file")
+    args = parser.parse_args(argv)
+
+    workers = args.workers or multiprocessing.cpu_count()
+    dispersion = Dispersion(args.thrust, args.isp, args.mass, args.timing)
+    began = time.perf_counter()
+    step = max(1, args.runs // 10)
+
+    def progress(aggregate):
+        if aggregate.runs % step == 0:
+            print("{}/{} runs, {:.1%} successful".format(aggregate.runs, args.runs,
+                                                         aggregate.successes / float(aggregate.runs)))
+
+    aggregate = run(args.runs, args.mission, dispersion, args.seed, workers, args.out, progress=progress)
+    report = aggregate.report()
+    show(report, time.perf_counter() - began, workers)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
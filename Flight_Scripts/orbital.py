@@ -0,0 +1,114 @@
+# Orbital mechanics used by the flight scripts.
+# Pure NumPy with no kRPC dependency: every function takes plain numbers or arrays
+# (e.g. thousands of candidate altitudes at once) and broadcasts like NumPy does.
+import numpy as np
+
+
+def vis_viva(mu, r, a):
+    # Orbital speed at radius r on an orbit with semi-major axis a
+    r = np.asarray(r, dtype=float)
+    a = np.asarray(a, dtype=float)
+    return np.sqrt(mu * ((2. / r) - (1. / a)))
+
+
+def circularisation_delta_v(mu, r, a):
+    # Prograde delta-v to circularise at radius r (an apsis) of an orbit with semi-major axis a
+    return vis_viva(mu, r, r) - vis_viva(mu, r, a)
+
+
+def apsis_change_delta_v(mu, r, a, opposite):
+    # Prograde delta-v at an apsis at radius r (orbit semi-major axis a) that moves the opposite apsis to radius opposite
+    r = np.asarray(r, dtype=float)
+    return vis_viva(mu, r, (r + np.asarray(opposite, dtype=float)) / 2.) - vis_viva(mu, r, a)
+
+
+def hyperbolic_delta_v(mu, r, excess_speed):
+    # Prograde delta-v from a circular orbit at radius r onto an escape with the given hyperbolic excess speed
+    # (and, the other way round, to capture from one)
+    r = np.asarray(r, dtype=float)
+    return np.sqrt(np.asarray(excess_speed, dtype=float) ** 2 + 2. * mu / r) - np.sqrt(mu / r)
+
+
+def ejection_delta_v(mu, r, excess_velocity, normal):
+    # Delta-v from a circular orbit at radius r (orbit normal `normal`) onto the escape hyperbola leaving
+    # along excess_velocity (vectors on the last axis). An asymptote out of the orbit's plane tilts the
+    # hyperbola's plane by the angle whose cosine is `tilt`; inf where no periapsis on the orbit reaches it
+    excess_velocity = np.asarray(excess_velocity, dtype=float)
+    speed = np.linalg.norm(excess_velocity, axis=-1)
+    turn = -1. / (1. + r * speed * speed / mu)  # Cosine of the angle from periapsis to asymptote
+    out = excess_velocity.dot(normal) / np.maximum(speed, 1e-9)
+    in_plane = 1. - out * out
+    tilt = np.sqrt(np.maximum(0., in_plane - turn * turn) / (1. - turn * turn))
+    periapsis = np.sqrt(speed * speed + 2. * mu / r)
+    circular = np.sqrt(mu / r)
+    delta_v = np.sqrt(periapsis * periapsis + circular * circular - 2. * periapsis * circular * tilt)
+    return np.where(in_plane >= turn * turn, delta_v, np.inf)
+
+
+def hohmann_elliptical(mu, r1, r2):
+    # First Hohmann burn: from a circular orbit at r1 onto a transfer orbit reaching r2
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    return np.sqrt(mu / r1) * (np.sqrt((2 * r2) / (r1 + r2)) - 1)
+
+
+def hohmann_circular(mu, r1, r2):
+    # Second Hohmann burn: circularise at r2 after a transfer from r1
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    return np.sqrt(mu / r2) * (1 - np.sqrt((2 * r1) / (r1 + r2)))
+
+
+def burn_time(delta_v, thrust, isp, mass, g=9.80665):
+    # Rocket equation: seconds at full thrust to change velocity by delta_v
+    exhaust_velocity = np.asarray(isp, dtype=float) * g
+    m0 = np.asarray(mass, dtype=float)
+    m1 = m0 / np.exp(np.abs(delta_v) / exhaust_velocity)
+    flow_rate = np.asarray(thrust, dtype=float) / exhaust_velocity
+    return np.abs((m0 - m1) / flow_rate)
+
+
+def orbital_period(mu, a):
+    return 2 * np.pi * np.sqrt(np.asarray(a, dtype=float) ** 3 / mu)
+
+
+def hohmann_phase_angle(r1, r2):
+    # Degrees the target at r2 must lead the vessel at r1 when the transfer burn starts
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    return 180. - 180. * ((r1 + r2) / (2 * r2)) ** 1.5
+
+
+def phase_angle(r1, r2, distance):
+    # Angle (degrees, 0-180) between two position vectors from their lengths and separation
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    cos_angle = (r1 ** 2 + r2 ** 2 - np.asarray(distance, dtype=float) ** 2) / (2 * r1 * r2)
+    return np.degrees(np.arccos(np.clip(cos_angle, -1., 1.)))
+
+
+def separation(p1, p2):
+    # Distance between position vectors along the last axis
+    return np.linalg.norm(np.asarray(p1, dtype=float) - np.asarray(p2, dtype=float), axis=-1)
+
+
+def mean_motion(mu, a):
+    # Radians per second
+    return np.sqrt(mu / np.asarray(a, dtype=float) ** 3)
+
+
+def signed_phase_angle(position, target, normal):
+    # Degrees (0-360) the target leads position, measured in the direction of motion around normal
+    position = np.asarray(position, dtype=float)
+    target = np.asarray(target, dtype=float)
+    sin_part = np.sum(np.asarray(normal, dtype=float) * np.cross(position, target), axis=-1)
+    sin_part /= np.linalg.norm(normal, axis=-1)
+    cos_part = np.sum(position * target, axis=-1)
+    return np.degrees(np.arctan2(sin_part, cos_part)) % 360.
+
+
+def time_to_phase_angle(phase, target_phase, n_inner, n_outer):
+    # Seconds until the lead angle of the outer body falls from phase to target_phase (degrees),
+    # given both mean motions (rad/s); the inner orbit catches up at their difference
+    closing_rate = np.degrees(np.asarray(n_inner, dtype=float) - n_outer)
+    return ((np.asarray(phase, dtype=float) - target_phase) % 360.) / closing_rate
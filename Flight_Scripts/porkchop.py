@@ -0,0 +1,340 @@
+# Transfers to any body, planned by solving Lambert's problem over a grid of departure times and
+# times of flight (a porkchop plot). Each cell holds the hyperbolic excess velocity leaving the origin
+# and the excess speed arriving at the target; the mission's delta-v follows from them (the escape from
+# a circular parking orbit, priced for its plane, the capture into a circular orbit at the target) and
+# the cheapest cell departing in time is refined on a finer grid around it. Grids are solved in NumPy
+# a block of departures at a time, spread over a process pool once they are large.
+#
+# Two kinds of transfer are planned from the vessel's orbit:
+#   - to a moon of the body it orbits (the Mun, Minmus from Kerbin orbit): Lambert from the vessel's
+#     own orbit, flown as one burn at the departure point
+#   - to a body orbiting the same parent as the body it orbits (Duna, Eve from Kerbin orbit, Minmus
+#     from Mun orbit): Lambert between the two bodies; the ejection burn goes where the escape
+#     hyperbola from the parking orbit leaves along the departure excess velocity. Orbits are inclined
+#     (Minmus about 6 degrees, Moho 7, Eve 2.1), so that velocity generally leaves the parking orbit's
+#     plane: the hyperbola is tilted out of it and the burn has a normal component. The time spent
+#     climbing out of the sphere of influence is not accounted for, so expect a correction burn.
+# Nothing else is planned: not the parent being orbited (Kerbin from Mun orbit), nor a moon of another
+# body (Laythe from Kerbin orbit, reached by a transfer to Jool first). targets() lists what is.
+# Body-to-body grids depend only on the two orbits, so they are cached on disk per body pair and
+# epoch window (two synodic periods from a whole number of synodic periods); asking for the same
+# target again in the same window answers from the cache.
+#
+#   python porkchop.py Duna                       best Kerbin-Duna transfer after UT 0, cached game
+#   python porkchop.py Eve --ut 5000000 --departures 400 --flight-times 200 --workers 4
+#
+# The cache lives in ~/.cache/alexa-ksp/porkchop.json; KSP_PORKCHOP_CACHE moves it, and an empty value
+# turns it off.
+import argparse
+import collections
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import bodies
+import kepler
+import orbital
+
+CACHE = os.environ.get("KSP_PORKCHOP_CACHE", os.path.join(os.path.dirname(bodies.CACHE), "porkchop.json"))
+
+PARALLEL_CELLS = 250000  # Grids with more cells than this are solved on a process pool
+FLIGHT_TIMES = (0.5, 1.5)  # Range of times of flight, as fractions of the Hohmann transfer's
+LEAD_TIME = 120.  # Seconds a departure must leave for turning to the burn
+CAPTURE_ALTITUDE = 30000.  # Default capture orbit, above the target's atmosphere
+
+# Departure times, times of flight (s), the excess velocities leaving (m/s, departures x times of flight x 3)
+# and the excess speeds arriving (m/s, departures x times of flight)
+Grid = collections.namedtuple("Grid", ["departures", "flight_times", "departure_excess", "arrival_speed"])
+# A planned transfer; excess_velocity is the velocity to leave with, relative to the origin (the vessel
+# itself for a moon, else the body it orbits), in the frame of the body both orbit
+Transfer = collections.namedtuple("Transfer", ["origin", "target", "departure", "arrival", "departure_delta_v",
+                                               "arrival_delta_v", "excess_velocity"])
+
+porkchops = None  # Cache contents, read on first use
+
+
+def synodic_period(origin, target):
+    # Seconds between alignments of two orbits around the same body
+    rate = abs(float(orbital.mean_motion(origin.mu, abs(origin.semi_major_axis)) -
+                     orbital.mean_motion(target.mu, abs(target.semi_major_axis))))
+    return 2. * math.pi / rate if rate > 0. else max(kepler.period(origin), kepler.period(target))
+
+
+def hohmann_time(origin, target):
+    a = (abs(origin.semi_major_axis) + abs(target.semi_major_axis)) / 2.
+    return float(orbital.orbital_period(origin.mu, a)) / 2.
+
+
+def solve(job):
+    # Excess velocities leaving and speeds arriving for a block of departures against every time of flight;
+    # runs in a worker for large grids
+    origin, target, departures, flight_times = job
+    r1, v_origin = kepler.state(origin, departures)
+    r2, v_target = kepler.state(target, departures[:, np.newaxis] + flight_times[np.newaxis, :])
+    v1, v2 = kepler.lambert(origin.mu, r1[:, np.newaxis, :], r2, flight_times[np.newaxis, :], kepler.normal(origin))
+    return v1 - v_origin[:, np.newaxis, :], np.linalg.norm(v2 - v_target, axis=-1)
+
+
+def porkchop(origin, target, departures, flight_times, workers=None):
+    # Grid of excess velocities between two kepler.Elements around the same body
+    departures = np.asarray(departures, dtype=float)
+    flight_times = np.asarray(flight_times, dtype=float)
+    if workers == 1 or departures.size * flight_times.size <= PARALLEL_CELLS:
+        return Grid(departures, flight_times, *solve((origin, target, departures, flight_times)))
+    workers = workers or multiprocessing.cpu_count()
+    blocks = [block for block in np.array_split(departures, workers * 4) if block.size]
+    with multiprocessing.Pool(workers) as pool:
+        parts = pool.map(solve, [(origin, target, block, flight_times) for block in blocks])
+    return Grid(departures, flight_times, np.concatenate([part[0] for part in parts]),
+                np.concatenate([part[1] for part in parts]))
+
+
+def window(origin, target, ut, departures=200, flight_times=100, workers=None):
+    # Grid over the two synodic periods from the start of the window holding ut
+    synodic = synodic_period(origin, target)
+    start = math.floor(ut / synodic) * synodic
+    hohmann = hohmann_time(origin, target)
+    return porkchop(origin, target, np.linspace(start, start + 2. * synodic, departures),
+                    np.linspace(FLIGHT_TIMES[0] * hohmann, FLIGHT_TIMES[1] * hohmann, flight_times), workers)
+
+
+def cached_window(origin_name, target_name, origin, target, ut, departures=200, flight_times=100, workers=None,
+                  path=None):
+    # window(), from the cache when it already holds this body pair, epoch window, orbits and grid size
+    global porkchops
+    path = CACHE if path is None else path
+    if not path:
+        return window(origin, target, ut, departures, flight_times, workers)
+    if porkchops is None:
+        porkchops = bodies.read(path)
+    key = "{}>{}@{}".format(origin_name, target_name, int(math.floor(ut / synodic_period(origin, target))))
+    entry = porkchops.get(key)
+    if (entry is not None and "departure_excess" in entry and np.allclose(entry["origin"], origin) and
+            np.allclose(entry["target"], target) and entry["departures"][2] == departures and
+            entry["flight_times"][2] == flight_times):
+        return Grid(np.linspace(*entry["departures"]), np.linspace(*entry["flight_times"]),
+                    np.array(entry["departure_excess"]), np.array(entry["arrival_speed"]))
+    grid = window(origin, target, ut, departures, flight_times, workers)
+    porkchops[key] = {
+        "origin": list(origin),
+        "target": list(target),
+        "departures": [grid.departures[0], grid.departures[-1], departures],  # linspace() arguments
+        "flight_times": [grid.flight_times[0], grid.flight_times[-1], flight_times],
+        "departure_excess": np.round(grid.departure_excess, 1).tolist(),
+        "arrival_speed": np.round(grid.arrival_speed, 2).tolist(),
+    }
+    try:
+        bodies.write(path, porkchops, indent=None)
+    except (IOError, OSError) as e:
+        print("Could not save porkchop cache: {}".format(e))
+    return grid
+
+
+def cheapest(grid, cost, after):
+    # (departure, time of flight) of the cheapest cell leaving after `after`; cost(departure excess velocity,
+    # arrival speed) -> total delta-v, applied to whole arrays
+    total = cost(grid.departure_excess, grid.arrival_speed)
+    total = np.where(np.isfinite(total), total, np.inf)
+    total[grid.departures < after, :] = np.inf
+    if not np.isfinite(total).any():
+        raise ValueError("No transfer departs in the planned window")
+    i, j = np.unravel_index(np.argmin(total), total.shape)
+    return grid.departures[i], grid.flight_times[j], i, j
+
+
+def refine(origin, target, grid, cost, after, cells=21):
+    # Cheapest cell of a finer grid spanning the neighbours of the grid's cheapest cell
+    departure, flight_time, i, j = cheapest(grid, cost, after)
+    step_departure = grid.departures[1] - grid.departures[0] if grid.departures.size > 1 else 0.
+    step_flight = grid.flight_times[1] - grid.flight_times[0] if grid.flight_times.size > 1 else 0.
+    departures = np.linspace(max(after, departure - step_departure), departure + step_departure, cells)
+    flight_times = np.linspace(flight_time - step_flight, flight_time + step_flight, cells)
+    return cheapest(porkchop(origin, target, departures, flight_times, workers=1), cost, after)[:2]
+
+
+def excess_velocity(origin, target, departure, flight_time, target_mu, capture_radius, soi=None, iterations=6,
+                    tolerance=100.):
+    # Departure velocity relative to the origin for the chosen cell, aimed to pass the target at the
+    # capture radius (on the side that makes the capture orbit prograde) rather than through its centre.
+    # The first-order miss distance is refined against the periapsis predicted at the target when its
+    # sphere of influence soi is given (the origin being the vessel, whose orbit after the burn is known).
+    normal = kepler.normal(origin)
+    r1, v_origin = kepler.state(origin, departure)
+    r2, v_target = kepler.state(target, departure + flight_time)
+    v1, v2 = kepler.lambert(origin.mu, r1, r2, flight_time, normal)
+    arrival = v2 - v_target
+    speed = np.linalg.norm(arrival)
+    side = np.cross(arrival, normal)
+    side /= np.linalg.norm(side)
+    miss = capture_radius * math.sqrt(1. + 2. * target_mu / (capture_radius * speed * speed))
+    tried = []  # (miss distance, periapsis radius) so far, for the secant
+    for _ in range(iterations):
+        v1 = kepler.lambert(origin.mu, r1, r2 + miss * side, flight_time, normal)[0]
+        if soi is None:
+            break
+        predicted = kepler.encounter(kepler.from_state(origin.mu, r1, v1, departure), target, target_mu, soi, departure)
+        if predicted is None:
+            break
+        patch = predicted[2]
+        periapsis = abs(patch.semi_major_axis) * abs(1. - patch.eccentricity)
+        if abs(periapsis - capture_radius) < tolerance:
+            break
+        tried.append((miss, periapsis))
+        if len(tried) == 1:
+            miss += capture_radius - periapsis
+        else:
+            (m0, p0), (m1, p1) = tried[-2:]
+            miss = m1 + (capture_radius - p1) * (m1 - m0) / (p1 - p0) if p1 != p0 else m1
+    return v1 - v_origin
+
+
+def targets(registry, body):
+    # Names of the bodies plan() reaches from an orbit around body: its moons and the other bodies orbiting its parent
+    return [other.name for other in registry if other.name != body.name and
+            (other.parent == body.name or (body.parent is not None and other.parent == body.parent))]
+
+
+def unreachable(registry, body, name):
+    # Why plan() has no transfer from an orbit around body to the body called name, naming those it has
+    reachable = targets(registry, body)
+    hop = ""
+    if name in registry and registry[name].parent in reachable:
+        hop = " (transfer to {} first)".format(registry[name].parent)
+    return "No transfer planned from {} orbit to {}{}; from here: {}".format(body.name, name, hop,
+                                                                         ", ".join(reachable) or "none")
+
+
+def plan(registry, body, elements, target, ut, altitude=CAPTURE_ALTITUDE, **kwargs):
+    # Cheapest Transfer from the vessel's orbit (kepler.Elements around the bodies.Body body) to the
+    # bodies.Body target, departing after ut; capture is into a circular orbit altitude metres above
+    # the target's atmosphere. kwargs go to window() (grid size, workers) and the cache (path).
+    capture_radius = target.equatorial_radius + (target.atmosphere_depth or 0.) + altitude
+    arrival_cost = lambda speed: orbital.hyperbolic_delta_v(target.gravitational_parameter, capture_radius, speed)
+    after = ut + LEAD_TIME
+    if target.parent == body.name:
+        origin, origin_name = elements, "vessel"
+        destination = kepler.from_body(target, body.gravitational_parameter)
+        kwargs.pop("path", None)  # The vessel's own orbit is not worth caching
+        departure_cost = lambda excess: np.linalg.norm(excess, axis=-1)
+        grid = window(origin, destination, ut, **kwargs)
+    elif body.parent is not None and target.parent == body.parent:
+        mu = registry[body.parent].gravitational_parameter
+        origin, origin_name = kepler.from_body(body, mu), body.name
+        destination = kepler.from_body(target, mu)
+        parking, normal = abs(elements.semi_major_axis), kepler.normal(elements)
+        departure_cost = lambda excess: orbital.ejection_delta_v(body.gravitational_parameter, parking, excess, normal)
+        grid = cached_window(body.name, target.name, origin, destination, ut, **kwargs)
+    else:
+        raise ValueError(unreachable(registry, body, target.name))
+    cost = lambda departure_excess, arrival_speed: departure_cost(departure_excess) + arrival_cost(arrival_speed)
+    departure, flight_time = refine(origin, destination, grid, cost, after)
+    excess = excess_velocity(origin, destination, departure, flight_time, target.gravitational_parameter,
+                             capture_radius, target.sphere_of_influence if origin_name == "vessel" else None)
+    speeds = solve((origin, destination, np.array([departure]), np.array([flight_time])))
+    return Transfer(origin_name, target.name, float(departure),
+                    float(departure + flight_time), float(departure_cost(speeds[0][0, 0])),
+                    float(arrival_cost(speeds[1][0, 0])), tuple(float(x) for x in excess))
+
+
+def correction(registry, body, elements, target, arrival, ut, altitude=CAPTURE_ALTITUDE):
+    # Transfer from the vessel's own orbit around body that keeps the planned arrival UT, for the course
+    # correction once an ejection burn has left the parking orbit's sphere of influence
+    capture_radius = target.equatorial_radius + (target.atmosphere_depth or 0.) + altitude
+    if target.parent != body.name:
+        raise ValueError("No correction planned from {} orbit to {}".format(body.name, target.name))
+    destination = kepler.from_body(target, body.gravitational_parameter)
+    departure = ut + LEAD_TIME
+    excess = excess_velocity(elements, destination, departure, arrival - departure, target.gravitational_parameter,
+                             capture_radius, target.sphere_of_influence)
+    speed = solve((elements, destination, np.array([departure]), np.array([arrival - departure])))[1][0, 0]
+    return Transfer("vessel", target.name, departure, arrival, float(np.linalg.norm(excess)),
+                    float(orbital.hyperbolic_delta_v(target.gravitational_parameter, capture_radius, speed)),
+                    tuple(float(x) for x in excess))
+
+
+def burn(transfer, elements, body, ut):
+    # (UT, prograde, normal, radial) of the burn that flies the transfer from the vessel's orbit
+    excess = np.asarray(transfer.excess_velocity)
+    rotation = kepler.rotation(elements)
+    normal = rotation[:, 2]
+    if transfer.origin == "vessel":
+        at = transfer.departure
+        burn_vector = excess
+    else:
+        # Escape hyperbola from the parking orbit, leaving along the excess velocity. Its periapsis is
+        # the point of the parking orbit `turn` behind the asymptote, so the hyperbola's plane holds
+        # both and tilts out of the parking orbit's as far as the asymptote does
+        speed = np.linalg.norm(excess)
+        asymptote = excess / speed
+        leaving = asymptote - np.dot(asymptote, normal) * normal
+        in_plane = np.linalg.norm(leaving)
+        leaving /= in_plane
+        radius = abs(elements.semi_major_axis)
+        mu = body.gravitational_parameter
+        turn = math.acos(-1. / (1. + radius * speed * speed / mu))  # Periapsis to asymptote
+        if in_plane < abs(math.cos(turn)):
+            raise ValueError("Departure asymptote is {:.0f} degrees out of the parking orbit's plane".format(
+                math.degrees(math.acos(min(1., in_plane)))))
+        behind = math.acos(math.cos(turn) / in_plane)  # Along the parking orbit, from the asymptote's projection
+        point = math.cos(behind) * leaving - math.sin(behind) * np.cross(normal, leaving)
+        anomaly = math.atan2(np.dot(point, rotation[:, 1]), np.dot(point, rotation[:, 0]))
+        n = float(orbital.mean_motion(mu, radius))
+        e = elements.eccentricity
+        big_e = 2. * math.atan2(math.sqrt(1. - e) * math.sin(anomaly / 2.), math.sqrt(1. + e) * math.cos(anomaly / 2.))
+        ahead = (big_e - e * math.sin(big_e) - float(kepler.mean_anomaly(elements, transfer.departure)))
+        at = transfer.departure + ((ahead + math.pi) % (2. * math.pi) - math.pi) / n  # Nearest pass
+        while at < ut + LEAD_TIME:
+            at += kepler.period(elements)
+    position, velocity = kepler.state(elements, at)
+    prograde = velocity / np.linalg.norm(velocity)
+    if transfer.origin != "vessel":
+        # Periapsis speed of the hyperbola, square to the radius and towards the asymptote
+        up = position / np.linalg.norm(position)
+        along = asymptote - np.dot(asymptote, up) * up
+        along /= np.linalg.norm(along)
+        burn_vector = math.sqrt(speed * speed + 2. * mu / np.linalg.norm(position)) * along - velocity
+    radial = np.cross(prograde, normal)  # Outward, square to the velocity
+    return (float(at), float(np.dot(burn_vector, prograde)), float(np.dot(burn_vector, normal)),
+            float(np.dot(burn_vector, radial)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cheapest transfer between two bodies from a porkchop grid")
+    parser.add_argument("target", help="body to go to, e.g. Duna")
+    parser.add_argument("--origin", default="Kerbin", help="body whose orbit the transfer leaves from")
+    parser.add_argument("--parking", type=float, default=100000., help="parking orbit altitude (m)")
+    parser.add_argument("--altitude", type=float, default=CAPTURE_ALTITUDE,
+                        help="capture orbit altitude above the target's atmosphere (m)")
+    parser.add_argument("--ut", type=float, default=0., help="earliest departure (UT)")
+    parser.add_argument("--departures", type=int, default=200, help="departure times in the grid")
+    parser.add_argument("--flight-times", type=int, default=100, help="times of flight in the grid")
+    parser.add_argument("--workers", type=int, help="worker processes for large grids (default: one per CPU)")
+    parser.add_argument("--cache", default=CACHE, help="porkchop cache file")
+    args = parser.parse_args(argv)
+
+    registry = bodies.cached()
+    if args.origin not in registry:
+        parser.error("No body named {}; known bodies: {}".format(args.origin, ", ".join(registry.names())))
+    origin = registry[args.origin]
+    if args.target not in targets(registry, origin):
+        parser.error(unreachable(registry, origin, args.target))
+    target = registry[args.target]
+    parking = kepler.Elements(origin.gravitational_parameter, origin.equatorial_radius + args.parking,
+                              0., 0., 0., 0., 0., args.ut)
+    began = time.perf_counter()
+    transfer = plan(registry, origin, parking, target, args.ut, args.altitude, departures=args.departures,
+                    flight_times=args.flight_times, workers=args.workers, path=args.cache)
+    print("{} to {}: depart UT {:.0f}, arrive UT {:.0f} ({:.1f} days)".format(
+        args.origin, args.target, transfer.departure, transfer.arrival, (transfer.arrival - transfer.departure) / 21600.))
+    print("  ejection {:.0f} m/s, capture {:.0f} m/s, total {:.0f} m/s ({:.2f}s)".format(
+        transfer.departure_delta_v, transfer.arrival_delta_v, transfer.departure_delta_v + transfer.arrival_delta_v,
+        time.perf_counter() - began))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+# Flight recorder: samples streams into preallocated ring buffers and flushes them to a columnar
+# recording on disk, one memory-mapped file per channel.
+# Samples are taken from the UT stream's update callback (on kRPC's stream thread, never in the
+# control loops) every `period` game seconds, and only write into the ring's numpy columns. Channels
+# read there must not wait on anything: a stream's first read waits for its first update, which the
+# stream thread would then never deliver, so every stream channel is started before sampling begins. A
+# flusher thread copies the filled part of the ring into the column files; if it ever falls a whole
+# ring behind, samples are dropped (and counted) rather than blocking. Every sample is tagged with
+# the mission phase and the command being flown, stored as small integer codes.
+#
+# A recording is a directory:
+#   meta.json       channels, sample count, rate, the phase/command names the codes refer to, and
+#                   notes: settings the flight was flown with (gravity turn, staging plan, descent)
+#   <channel>.col   raw little-endian column (float64, or uint16 for the phase/command tags)
+#
+# load() maps it back without parsing anything, so a multi-hour flight opens instantly:
+#   flight = recorder.load("flight.rec")
+#   flight["altitude"][flight.mask(phase="ascent")].max()
+import json
+import math
+import os
+import threading
+import time
+
+import numpy
+
+TAGS = ("phase", "command")
+FLOAT = numpy.dtype("<f8")
+CODE = numpy.dtype("<u2")
+
+
+def write_meta(path, meta):
+    temporary = os.path.join(path, "meta.json.tmp")
+    with open(temporary, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(temporary, os.path.join(path, "meta.json"))
+
+
+class Column(object):
+    # One channel's file, mapped in blocks and grown (and remapped) as the recording gets longer
+    def __init__(self, path, dtype, block):
+        self.path = path
+        self.dtype = dtype
+        self.block = block
+        self.map = None
+        self.size = 0
+        open(path, "wb").close()
+
+    def write(self, start, values):
+        end = start + len(values)
+        if end > self.size:
+            self.size = (end // self.block + 1) * self.block
+            if self.map is not None:
+                self.map.flush()
+            with open(self.path, "r+b") as f:
+                f.truncate(self.size * self.dtype.itemsize)
+            self.map = numpy.memmap(self.path, self.dtype, "r+", shape=(self.size,))
+        self.map[start:end] = values
+
+    def close(self, length):
+        # Trim the spare end of the last block
+        if self.map is not None:
+            self.map.flush()
+            self.map = None
+        with open(self.path, "r+b") as f:
+            f.truncate(length * self.dtype.itemsize)
+
+
+class Recorder(object):
+    def __init__(self, path, ut, channels, phase=None, command=None, rate=10., capacity=4096,
+                 block=65536, flush_interval=1.):
+        # ut: UT stream (sampling is driven by its updates); channels: name -> stream or callable
+        # returning a number without waiting (nan where it has none, e.g. remaining_burn outside a
+        # burn); phase and command: callables returning the tag strings (None or "" for none)
+        self.path = path
+        self.ut = ut
+        self.names = ["ut"] + [name for name in channels if name != "ut"]
+        self.sources = [ut] + [channels[name] for name in self.names[1:]]
+        self.taggers = [phase or (lambda: ""), command or (lambda: "")]
+        self.period = 1. / rate  # Game seconds between samples
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.ring = [numpy.zeros(capacity, FLOAT) for _ in self.names]
+        self.tag_ring = [numpy.zeros(capacity, CODE) for _ in TAGS]
+        self.codes = [{"": 0} for _ in TAGS]  # Tag string -> code, per tag
+        self.notes = {}  # Name -> [fields with the UT they were noted at], for replay
+        self.written = 0  # Samples taken
+        self.flushed = 0  # Samples on disk
+        self.dropped = 0
+        self.next_sample = -math.inf
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.columns = [Column(os.path.join(path, name + ".col"), FLOAT, block) for name in self.names]
+        self.tag_columns = [Column(os.path.join(path, tag + ".col"), CODE, block) for tag in TAGS]
+        self.started = time.time()
+        self.lock = threading.Lock()  # Serialises flushes
+        self.due = threading.Event()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.run, name="recorder")
+        self.flusher.daemon = True
+        self.flusher.start()
+        for source in self.sources:
+            if hasattr(source, "start"):
+                source.start()  # Here, not on the stream thread at the first sample
+        ut.add_callback(self.updated)
+
+    def updated(self, ut):
+        if ut >= self.next_sample:
+            self.next_sample = max(self.next_sample + self.period, ut)
+            try:
+                self.sample()
+            except Exception:
+                self.dropped += 1  # e.g. a source whose connection has just gone
+
+    def sample(self):
+        if self.written - self.flushed >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = self.written % self.capacity
+        for column, source in zip(self.ring, self.sources):
+            column[slot] = source()
+        for column, codes, tagger in zip(self.tag_ring, self.codes, self.taggers):
+            tag = tagger() or ""
+            code = codes.get(tag)
+            if code is None:
+                code = codes[tag] = len(codes)
+            column[slot] = code
+        self.written += 1
+        if self.written - self.flushed >= self.capacity // 2:
+            self.due.set()
+        return True
+
+    def note(self, name, **fields):
+        # Record settings the control code flies with from now on (JSON values), e.g.
+        # note("turn", start=250., end=45000., apoapsis=80000.), so a replay can fly the same
+        with self.lock:
+            self.notes.setdefault(name, []).append(dict(fields, ut=float(self.ut())))
+            write_meta(self.path, self.meta())
+
+    def flush(self):
+        with self.lock:
+            start, end = self.flushed, self.written
+            if end == start:
+                return 0
+            first, last = start % self.capacity, end % self.capacity
+            # The filled part of the ring, in order: one slice, or two when it wraps around
+            if first < last:
+                parts = [(first, last)]
+            else:
+                parts = [(first, self.capacity), (0, last)]
+            for ring, columns in ((self.ring, self.columns), (self.tag_ring, self.tag_columns)):
+                for values, column in zip(ring, columns):
+                    offset = start
+                    for a, b in parts:
+                        column.write(offset, values[a:b])
+                        offset += b - a
+            self.flushed = end
+            write_meta(self.path, self.meta())
+            return end - start
+
+    def meta(self):
+        return {
+            "channels": self.names,
+            "tags": {tag: sorted(codes, key=codes.get) for tag, codes in zip(TAGS, map(dict, self.codes))},
+            "length": self.flushed,
+            "rate": 1. / self.period,
+            "dropped": self.dropped,
+            "started": self.started,
+            "notes": self.notes,
+        }
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.due.wait(self.flush_interval)
+            self.due.clear()
+            self.flush()
+
+    def close(self):
+        self.ut.remove_callback(self.updated)
+        self.stopped.set()
+        self.due.set()
+        self.flusher.join()
+        self.flush()
+        for column in self.columns + self.tag_columns:
+            column.close(self.flushed)
+        print("Recorded {} samples to {} ({} dropped)".format(self.flushed, self.path, self.dropped))
+
+
+class Recording(object):
+    # A recording mapped read-only; recording[channel] is a numpy array view of the file
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.length = self.meta["length"]
+        self.channels = self.meta["channels"]
+        self.tags = self.meta["tags"]  # tag -> names, indexed by code
+        self.columns = {}
+
+    def notes(self, name):
+        # [fields] noted under name, in UT order (none in recordings made before notes were kept)
+        return self.meta.get("notes", {}).get(name, [])
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            dtype = CODE if name in TAGS else FLOAT
+            if self.length == 0:
+                self.columns[name] = numpy.zeros(0, dtype)
+            else:
+                self.columns[name] = numpy.memmap(os.path.join(self.path, name + ".col"), dtype, "r",
+                                                  shape=(self.length,))
+        return self.columns[name]
+
+    def mask(self, **tags):
+        # Boolean mask of the samples with the given tags, e.g. mask(phase="landing")
+        selected = numpy.ones(self.length, bool)
+        for tag, name in tags.items():
+            names = self.tags[tag]
+            if name not in names:
+                return numpy.zeros(self.length, bool)
+            selected &= self[tag] == names.index(name)
+        return selected
+
+    def runs(self, tag):
+        # [(name, first sample, end sample)] for each stretch of samples with the same tag
+        codes = self[tag]
+        if not len(codes):
+            return []
+        edges = numpy.flatnonzero(numpy.diff(codes)) + 1
+        starts = numpy.concatenate(([0], edges))
+        ends = numpy.concatenate((edges, [len(codes)]))
+        return [(self.tags[tag][codes[a]], int(a), int(b)) for a, b in zip(starts, ends)]
+
+
+class Latest(object):
+    # Channels for values a controller computes or reads itself (e.g. the descent's telemetry, in the
+    # frame of the body it lands on): update() with each namedtuple it uses, clear() when it is done
+    def __init__(self, fields):
+        self.fields = fields
+        self.value = None
+
+    def update(self, value):
+        self.value = value
+
+    def clear(self):
+        self.value = None
+
+    def channels(self, prefix):
+        # {prefix + field: callable}, nan while there is no value
+        return {prefix + field: self.reader(index) for index, field in enumerate(self.fields)}
+
+    def reader(self, index):
+        def read():
+            value = self.value  # Once: the controller's thread may replace it meanwhile
+            return float(value[index]) if value is not None else float("nan")
+        return read
+
+
+def load(path):
+    return Recording(path)
@@ -0,0 +1,450 @@
+# Flight replay: runs the control code against a recorded flight (see recorder.py) instead of kRPC.
+# The recording's channels stand in for the streams, open loop: each sample is fed to the same
+# controllers the scripts fly with (guidance.GravityTurn during the ascent, maneuver.Burn for every
+# node burn, descent.Descent for the landing, and the staging.StagingPlan flown, its burnout events
+# evaluated here), and the commands they give are compared with what the recording says the vessel
+# was doing: throttle during burns and the descent, autopilot pitch during the turn and the UTs of
+# staging. Divergence is reported per command, with the first UT it shows up at. The settings come
+# from the recording's notes: each launch's gravity turn, the staging plan and the descent solver.
+#
+#   python replay.py flight.rec                  replay and report (exit status 1 on divergence)
+#   python replay.py flight.rec --start 250 --end 50000 --apoapsis 80000
+#                                                gravity turn of a recording made before turns were noted
+#
+# Replays run as fast as the controllers can step, typically hundreds of times faster than the flight.
+import argparse
+import json
+import math
+import sys
+import time
+
+import descent
+import guidance
+import maneuver
+import recorder
+import staging
+
+# Allowed difference before a sample counts as diverged. The descent re-plans its throttle every
+# guidance tick at the end of the braking, and the recorder samples only some of those ticks
+TOLERANCES = {"throttle": 0.01, "pitch": 0.5, "descent": 0.1, "staging": 0.5}  # throttle fractions, degrees, seconds
+
+
+class ReplayStream(object):
+    # Stands in for a kRPC stream: read() gives the value at the replay's current sample
+    def __init__(self, read):
+        self.read = read
+
+    def __call__(self):
+        return self.read()
+
+    def remove(self):
+        pass
+
+
+class ReplayResources(object):
+    def __init__(self, replay, stage):
+        self.replay = replay
+        self.stage = stage
+        self.names = ["LiquidFuel"]
+
+    def amount(self, name):
+        # Fuel left in this decouple stage: the recording's while it is the stage the flight was on,
+        # none once the recording has staged past it, full while the replay is ahead of the recording
+        recorded = int(self.replay.value("stage")) - 1
+        if self.stage == recorded:
+            return self.replay.value("stage_fuel")
+        return 0. if self.stage > recorded else float("inf")
+
+
+class ReplayControl(object):
+    def __init__(self, replay):
+        self.replay = replay
+        self.current_stage = None  # Set from the recording on the first sample
+        self.rcs = False
+        self._throttle = 0.
+
+    @property
+    def throttle(self):
+        return self._throttle
+
+    @throttle.setter
+    def throttle(self, value):
+        self._throttle = float(value)
+        self.replay.log("throttle", self._throttle)
+
+    def activate_next_stage(self):
+        self.current_stage -= 1
+        self.replay.log("stage", self.current_stage)
+        return []
+
+
+class ReplayAutoPilot(object):
+    def __init__(self, replay):
+        self.replay = replay
+        self.pitch = float("nan")
+        self.heading = float("nan")
+
+    def target_pitch_and_heading(self, pitch, heading):
+        self.pitch, self.heading = float(pitch), float(heading)
+        self.replay.log("pitch", self.pitch)
+
+    def engage(self):
+        pass
+
+
+class ReplayVessel(object):
+    def __init__(self, replay):
+        self.replay = replay
+        self.control = ReplayControl(replay)
+        self.auto_pilot = ReplayAutoPilot(replay)
+
+    def resources_in_decouple_stage(self, stage, cumulative=True):
+        return ReplayResources(self.replay, stage)
+
+
+class ReplayNode(object):
+    reference_frame = None
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def remaining_burn_vector(self, reference_frame=None):
+        return (0., self.replay.value("remaining_burn"), 0.)
+
+
+class ReplayExpression(object):
+    # kRPC expressions as closures, evaluated on the replay's current sample
+    @staticmethod
+    def call(call):
+        return call
+
+    @staticmethod
+    def constant_double(value):
+        return lambda: value
+
+    @staticmethod
+    def less_than_or_equal(a, b):
+        return lambda: a() <= b()
+
+    @staticmethod
+    def or_(a, b):
+        return lambda: a() or b()
+
+
+class ReplayEvent(object):
+    # A server-side event, checked against the recording instead of in the game
+    def __init__(self, condition):
+        self.stream = ReplayStream(condition)
+
+    def start(self):
+        pass
+
+    def remove(self):
+        pass
+
+
+class ReplayKRPC(object):
+    Expression = ReplayExpression
+
+    def add_event(self, condition):
+        return ReplayEvent(condition)
+
+
+class ReplayConnection(object):
+    # Just enough of a kRPC connection for the controllers: add_stream maps each call onto a channel
+    def __init__(self, replay):
+        self.replay = replay
+        self.krpc = ReplayKRPC()
+
+    def get_call(self, func, *args):
+        return lambda: func(*args)
+
+    def add_stream(self, func, *args):
+        if func is getattr:
+            return self.replay.channel(args[1])
+        if isinstance(getattr(func, "__self__", None), (ReplayResources, ReplayNode)):
+            return ReplayStream(lambda: func(*args))
+        raise ValueError("No recorded channel for {!r}".format(func))
+
+
+class Comparison(object):
+    # Replayed commands against the recorded state, for one command channel
+    def __init__(self, name, tolerance):
+        self.name = name
+        self.tolerance = tolerance
+        self.samples = 0
+        self.diverged = 0
+        self.max_error = 0.
+        self.total_error = 0.
+        self.first_ut = None
+
+    def add(self, ut, replayed, recorded, following=float("nan")):
+        # The recorder samples independently of the control ticks, so a command given at one sample
+        # may only show in the next one: the closer of the two counts
+        if math.isnan(replayed) or math.isnan(recorded):
+            return
+        error = abs(replayed - recorded)
+        if not math.isnan(following):
+            error = min(error, abs(replayed - following))
+        self.samples += 1
+        self.total_error += error
+        self.max_error = max(self.max_error, error)
+        if error > self.tolerance:
+            self.diverged += 1
+            if self.first_ut is None:
+                self.first_ut = ut
+
+    def summary(self):
+        return {"samples": self.samples, "diverged": self.diverged, "max_error": self.max_error,
+                "mean_error": self.total_error / self.samples if self.samples else 0.,
+                "first_divergence_ut": self.first_ut}
+
+
+class Replay(object):
+    def __init__(self, recording, target_apoapsis=None, start=None, end=None, tolerances=None):
+        # target_apoapsis, start and end override the gravity turn noted in the recording
+        self.recording = recording
+        self.index = 0
+        self.events = []  # (ut, command, value) given by the replayed controllers
+        self.tolerances = dict(TOLERANCES, **(tolerances or {}))
+        self.target_apoapsis = target_apoapsis
+        self.start = start
+        self.end = end
+        self.conn = ReplayConnection(self)
+        self.vessel = ReplayVessel(self)
+        self.ut = self.channel("ut")
+        self.comparisons = {name: Comparison(name, self.tolerances[name])
+                            for name in ("throttle", "pitch", "descent")}
+        self.staging = []  # (recorded ut, replayed ut) of each staging, either None if missing
+        self.steps = 0
+        self.wall = 0.
+
+    def value(self, name):
+        return float(self.recording[name][self.index])
+
+    def channel(self, name):
+        # Stream of a recorded channel (nan throughout if it was not recorded)
+        if name not in self.recording.channels:
+            return ReplayStream(lambda: float("nan"))
+        column = self.recording[name]
+        return ReplayStream(lambda: float(column[self.index]))
+
+    def recorded(self, name):
+        # Value of a channel at the current sample and at the next one (nan at the end)
+        column = self.recording[name]
+        following = float(column[self.index + 1]) if self.index + 1 < len(column) else float("nan")
+        return float(column[self.index]), following
+
+    def log(self, command, value):
+        self.events.append((self.value("ut"), command, value))
+
+    def launch_target(self):
+        # From a "launch,<apoapsis>" command tag, when the flight was flown through the relay
+        for name in self.recording.tags.get("command", []):
+            if name.startswith("launch,"):
+                return float(name.split(",")[1])
+        return None
+
+    def noted(self, name, ut):
+        # The settings last noted under name by ut (None if there are none)
+        latest = None
+        for note in self.recording.notes(name):
+            if note["ut"] <= ut:
+                latest = note
+        return latest
+
+    def gravity_turn(self, ut):
+        # The gravity turn of the launch under way at ut: as noted, with the overrides given
+        note = self.noted("turn", ut) or {}
+        start = self.start if self.start is not None else note.get("start")
+        end = self.end if self.end is not None else note.get("end")
+        apoapsis = self.target_apoapsis or note.get("apoapsis") or self.launch_target()
+        if None in (start, end, apoapsis):
+            return None  # Not noted (an older recording) and not given
+        return guidance.GravityTurn(self.vessel, start, end, apoapsis)
+
+    def staging_plan(self):
+        # The staging plan flown, or a StageMonitor for a recording made before it was noted
+        notes = self.recording.notes("staging")
+        if not notes:
+            return staging.StageMonitor(self.conn, self.vessel)
+        note = notes[-1]
+        stages = [staging.Stage(**dict(stage, fuels=tuple(stage["fuels"]))) for stage in note["stages"]]
+        return staging.StagingPlan(self.conn, self.vessel, note["threshold"], stages=stages)
+
+    def descent(self, ut):
+        # The descent controller of the landing noted by ut
+        note = self.noted("descent", ut)
+        if note is None:
+            return None
+        return descent.Descent(self.vessel, descent.Solver(note["mu"], note["radius"], note["target"], note["throttle"]),
+                               period=note["period"])
+
+    def telemetry(self):
+        # The descent's telemetry recorded at this sample (None outside the descent)
+        values = [self.value("descent_" + field) for field in descent.Telemetry._fields]
+        if math.isnan(values[0]):
+            return None
+        return descent.Telemetry(*values[:-1], landed=bool(values[-1]))
+
+    def run(self):
+        recording = self.recording
+        phases = recording.tags["phase"]
+        phase = recording["phase"]
+        remaining = recording["remaining_burn"]
+        channels = recording.channels
+        executor = maneuver.NodeExecutor(self.conn, self.vessel, self.ut)
+        descending = "descent_ut" in channels
+        stages = None
+        turn = None
+        burn = None
+        landing = None
+        stepped = None  # UT of the descent telemetry last stepped on
+        recorded_stage = None
+        started = time.perf_counter()
+        for i in range(len(recording)):
+            self.index = i
+            ut = self.value("ut")
+            if stages is None and "stage" in channels and "stage_fuel" in channels:
+                self.vessel.control.current_stage = int(self.value("stage"))
+                stages = self.staging_plan()
+                recorded_stage = self.vessel.control.current_stage
+            if stages is not None:
+                self.replay_staging(stages, ut, recorded_stage)
+                recorded_stage = int(self.value("stage"))
+
+            # Ascent: the gravity turn runs from the first ascent sample until it hands over
+            ascending = phases[phase[i]] == "ascent"
+            if ascending and turn is None and "target_pitch" in channels:
+                turn = self.gravity_turn(ut) or False
+            if not ascending and turn is False:
+                turn = None  # Ready for the next launch
+            if turn and ascending:
+                self.steps += 1
+                if turn.step(guidance.Telemetry(ut, self.value("altitude"), self.value("apoapsis"))):
+                    turn = False  # Handed over to the fine tuning
+                else:
+                    self.comparisons["pitch"].add(ut, turn.commanded, *self.recorded("target_pitch"))
+
+            # Node burns: a recorded remaining_burn marks the samples of a burn
+            burning = not math.isnan(remaining[i])
+            if burning and burn is None:
+                burn = maneuver.Burn(executor, ReplayNode(self))
+            if burn is not None:
+                if burning:
+                    self.steps += 1
+                    if burn.step():
+                        burn.close()
+                        burn = False  # Replay finished first; the recording is still burning
+                    if burn:
+                        self.comparisons["throttle"].add(ut, burn.throttle, *self.recorded("throttle"))
+                    else:
+                        self.comparisons["throttle"].add(ut, 0., *self.recorded("throttle"))
+                else:
+                    if burn:
+                        burn.close()
+                    burn = None
+
+            # Descent: stepped on each new telemetry sample the landing recorded
+            telemetry = self.telemetry() if descending else None
+            if telemetry is None:
+                landing = stepped = None
+            elif telemetry.ut != stepped:
+                stepped = telemetry.ut
+                if landing is None:
+                    landing = self.descent(ut)
+                if landing:
+                    self.steps += 1
+                    if landing.step(telemetry):
+                        landing = False  # Landed; the recording follows until the descent ends
+                    else:
+                        commanded = landing.commanded if landing.commanded is not None else 0.
+                        self.comparisons["descent"].add(ut, commanded, *self.recorded("throttle"))
+        self.wall = time.perf_counter() - started
+        return self
+
+    def replay_staging(self, stages, ut, recorded_stage):
+        recorded = int(self.value("stage"))
+        if recorded < recorded_stage:
+            channels = self.recording.channels
+            thrust = self.recording["available_thrust"][self.index - 1] if "available_thrust" in channels else 1.
+            if thrust == 0 and self.vessel.control.current_stage == recorded_stage:
+                # Staged with no engine lit (liftoff): an ignition rather than a burnout, so follow it
+                self.vessel.control.current_stage = recorded
+                stages.subscribe()
+            else:
+                self.match_staging(recorded_ut=ut)
+        self.steps += 1
+        if stages.check():
+            self.match_staging(replayed_ut=ut)
+
+    def match_staging(self, recorded_ut=None, replayed_ut=None):
+        # Pair each staging with the first one from the other side still unpaired
+        missing = 0 if recorded_ut is not None else 1
+        for i, (recorded, replayed) in enumerate(self.staging):
+            if (recorded, replayed)[missing] is None:
+                self.staging[i] = (recorded if recorded is not None else recorded_ut,
+                                   replayed if replayed is not None else replayed_ut)
+                return
+        self.staging.append((recorded_ut, replayed_ut))
+
+    def report(self):
+        ut = self.recording["ut"]
+        flown = float(ut[-1] - ut[0]) if len(ut) else 0.
+        tolerance = self.tolerances["staging"]
+        staging_diverged = [pair for pair in self.staging
+                            if None in pair or abs(pair[0] - pair[1]) > tolerance]
+        return {
+            "samples": len(self.recording),
+            "steps": self.steps,
+            "flight_seconds": flown,
+            "wall_seconds": self.wall,
+            "speedup": flown / self.wall if self.wall > 0 else 0.,
+            "step_micros": self.wall / self.steps * 1e6 if self.steps else 0.,
+            "commands": {name: comparison.summary() for name, comparison in self.comparisons.items()},
+            "staging": [{"recorded_ut": a, "replayed_ut": b} for a, b in self.staging],
+            "staging_diverged": len(staging_diverged),
+        }
+
+    def diverged(self):
+        report = self.report()
+        return report["staging_diverged"] > 0 or any(c["diverged"] for c in report["commands"].values())
+
+
+def show(report):
+    print("Replayed {samples} samples ({flight_seconds:.0f}s of flight) in {wall_seconds:.2f}s, "
+          "{speedup:.0f}x real time, {step_micros:.0f}us per controller step".format(**report))
+    for name, c in sorted(report["commands"].items()):
+        if not c["samples"]:
+            print("  {:<9} not exercised".format(name))
+            continue
+        first = "" if c["first_divergence_ut"] is None else ", first at UT {:.2f}".format(c["first_divergence_ut"])
+        print("  {:<9} {} of {} samples diverged, max error {:.3f} mean {:.4f}{}".format(
+            name, c["diverged"], c["samples"], c["max_error"], c["mean_error"], first))
+    for stage in report["staging"]:
+        recorded, replayed = stage["recorded_ut"], stage["replayed_ut"]
+        print("  staging   recorded at {} replayed at {}".format(
+            "-" if recorded is None else "{:.2f}".format(recorded),
+            "-" if replayed is None else "{:.2f}".format(replayed)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded flight through the control code")
+    parser.add_argument("recording", help="directory written by the flight recorder (FLIGHT_RECORD)")
+    parser.add_argument("--apoapsis", type=float, help="target apoapsis of the recorded launch (m), if not noted")
+    parser.add_argument("--start", type=float, help="gravity turn start altitude (m), if not noted")
+    parser.add_argument("--end", type=float, help="gravity turn end altitude (m), if not noted")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    replay = Replay(recorder.load(args.recording), args.apoapsis, args.start, args.end).run()
+    report = replay.report()
+    show(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if replay.diverged() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# Opt-in RPC accounting for a kRPC connection (or the simulator's).
+# Wraps conn._invoke, which every remote call goes through, and records per procedure the call
+# count, a latency histogram and the calling functions, grouped by the current mission phase.
+# Enable with KRPC_PROFILE=1 (report printed at exit) or KRPC_PROFILE=<file>.json (also saved).
+import atexit
+import collections
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+BUCKETS = 16  # Latency histogram: bucket i holds calls under 2**i microseconds (the last is open-ended)
+
+# Modules whose frames are skipped when looking for the calling function
+INTERNAL = ("rpcstats.py", "sim.py", os.sep + "krpc" + os.sep)
+
+current = "idle"  # Mission phase RPCs are attributed to
+stats = {}  # (phase, procedure) -> Entry
+lock = threading.Lock()
+installed = []
+
+
+class Entry(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.histogram = [0] * BUCKETS
+        self.callers = collections.Counter()
+
+    def add(self, latency, caller):
+        self.count += 1
+        self.total += latency
+        micros = latency * 1e6
+        self.histogram[min(BUCKETS - 1, int(math.log2(micros)) + 1 if micros >= 1 else 0)] += 1
+        self.callers[caller] += 1
+
+    def percentile(self, fraction):
+        # Upper bound (seconds) of the histogram bucket holding the given fraction of calls
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if seen >= target:
+                return 2 ** i / 1e6
+        return float("inf")
+
+
+def mark(phase):
+    # Attribute subsequent RPCs to phase (ascent, coast, circularise, transfer, capture, landing)
+    global current
+    current = phase
+
+
+def caller():
+    frame = sys._getframe(2)
+    while frame is not None and any(name in frame.f_code.co_filename for name in INTERNAL):
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return "{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+
+def install(conn):
+    # Start recording every RPC made through conn
+    invoke = conn._invoke
+
+    def recorded(service, procedure, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return invoke(service, procedure, *args, **kwargs)
+        finally:
+            latency = time.perf_counter() - started
+            key = (current, "{}.{}".format(service, procedure))
+            who = caller()
+            with lock:
+                if key not in stats:
+                    stats[key] = Entry()
+                stats[key].add(latency, who)
+
+    conn._invoke = recorded
+    installed.append(conn)
+    return conn
+
+
+def profile(conn):
+    # install() if KRPC_PROFILE is set, reporting when the interpreter exits
+    target = os.environ.get("KRPC_PROFILE")
+    if not target:
+        return conn
+    if not installed:
+        atexit.register(report, None if target == "1" else target)
+    return install(conn)
+
+
+def summary():
+    with lock:
+        phases = collections.OrderedDict()
+        for (phase, procedure), entry in sorted(stats.items(), key=lambda item: -item[1].count):
+            phases.setdefault(phase, []).append({
+                "procedure": procedure,
+                "count": entry.count,
+                "total_seconds": entry.total,
+                "mean_seconds": entry.total / entry.count,
+                "p50_seconds": entry.percentile(0.5),
+                "p95_seconds": entry.percentile(0.95),
+                "histogram": list(entry.histogram),
+                "callers": dict(entry.callers.most_common()),
+            })
+        return phases
+
+
+def report(path=None):
+    phases = summary()
+    print("RPC summary ({} calls)".format(sum(e["count"] for entries in phases.values() for e in entries)))
+    for phase, entries in phases.items():
+        print("  {} ({} calls, {:.3f}s)".format(phase, sum(e["count"] for e in entries),
+                                               sum(e["total_seconds"] for e in entries)))
+        for e in entries[:10]:
+            top = ", ".join("{} x{}".format(name, n) for name, n in list(e["callers"].items())[:2])
+            print("    {:<56} {:>7} mean {:7.2f}ms p95 <{:.2f}ms  {}".format(
+                e["procedure"], e["count"], e["mean_seconds"] * 1e3, e["p95_seconds"] * 1e3, top))
+    if path is not None:
+        with open(path, "w") as f:
+            json.dump(phases, f, indent=2)
+        print("RPC summary saved to {}".format(path))
@@ -0,0 +1,136 @@
+# Mission plan queue for chained apsis burns (circularise, raise or lower the opposite apsis).
+# Each step is planned one burn ahead: as a burn starts, the step after it is planned from the
+# orbit that burn is predicted to leave (an impulsive prograde burn at an apsis keeps that point an
+# apsis, so the new orbit follows from vis-viva). The step after the burn is either the next one
+# of the same plan or, through upcoming(), the next command waiting in the queue. When the burn
+# ends, one snapshot of the orbit (every field from the same physics frame) checks the prediction; if it
+# agrees, the prepared node is committed straight away, otherwise the step is planned again from the
+# orbit as observed. Within a plan, the next step's node is added as soon as a burn ends and the
+# autopilot turns to it while the vessel coasts to its apsis, so no burn starts with a turn (a step
+# planned again moves that node). A step planned ahead for a queued command gets its node when that
+# command is flown.
+import collections
+
+import orbital
+
+# Orbit of the vessel around a body (mu, equatorial radius); radii in metres, UTs of the next passes
+Orbit = collections.namedtuple("Orbit", ["mu", "radius", "periapsis", "semi_major_axis", "ut_periapsis",
+                                         "ut_apoapsis"])
+# A burn at the apsis `at` ("periapsis" or "apoapsis") that moves the opposite apsis to altitude
+# `target`; a target of None circularises
+Step = collections.namedtuple("Step", ["name", "at", "target"])
+Maneuver = collections.namedtuple("Maneuver", ["step", "ut", "delta_v", "orbit"])  # orbit: planned from
+
+
+def circularise(at="apoapsis"):
+    return Step("circularise", at, None)
+
+
+def set_apoapsis(altitude):
+    return Step("apoapsis", "periapsis", altitude)
+
+
+def set_periapsis(altitude):
+    return Step("periapsis", "apoapsis", altitude)
+
+
+def radius_at(orbit, at):
+    return orbit.periapsis if at == "periapsis" else 2. * orbit.semi_major_axis - orbit.periapsis
+
+
+def ut_at(orbit, at):
+    return orbit.ut_periapsis if at == "periapsis" else orbit.ut_apoapsis
+
+
+def plan(step, orbit):
+    r = radius_at(orbit, step.at)
+    opposite = r if step.target is None else orbit.radius + step.target
+    delta_v = float(orbital.apsis_change_delta_v(orbit.mu, r, orbit.semi_major_axis, opposite))
+    return Maneuver(step, ut_at(orbit, step.at), delta_v, orbit)
+
+
+def predict(maneuver):
+    # Orbit after the maneuver, flown as an impulse at its node
+    orbit = maneuver.orbit
+    r = radius_at(orbit, maneuver.step.at)
+    speed = float(orbital.vis_viva(orbit.mu, r, orbit.semi_major_axis)) + maneuver.delta_v
+    a = 1. / (2. / r - speed * speed / orbit.mu)
+    opposite = 2. * a - r
+    period = float(orbital.orbital_period(orbit.mu, a)) if a > 0 else float("inf")
+    # The burn point stays an apsis: passed again a period on, the opposite one half a period on
+    if r <= opposite:
+        return orbit._replace(periapsis=r, semi_major_axis=a, ut_periapsis=maneuver.ut + period,
+                              ut_apoapsis=maneuver.ut + period / 2.)
+    return orbit._replace(periapsis=opposite, semi_major_axis=a, ut_periapsis=maneuver.ut + period / 2.,
+                          ut_apoapsis=maneuver.ut + period)
+
+
+def agrees(predicted, actual, at, distance=1000., fraction=0.005, seconds=2.):
+    # Whether a step at `at` planned on the predicted orbit still fits the actual one
+    if predicted.mu != actual.mu:
+        return False  # Changed sphere of influence
+    tolerance = max(distance, fraction * abs(actual.semi_major_axis))
+    return (abs(radius_at(predicted, at) - radius_at(actual, at)) <= tolerance and
+            abs(predicted.semi_major_axis - actual.semi_major_axis) <= tolerance and
+            abs(ut_at(predicted, at) - ut_at(actual, at)) <= seconds)
+
+
+class Sequencer(object):
+    def __init__(self, vessel, executor, snapshots, registry, upcoming=None):
+        self.vessel = vessel
+        self.executor = executor  # maneuver.NodeExecutor flying the burns
+        self.snapshots = snapshots  # snapshot.Snapshots of the vessel
+        self.registry = registry  # bodies.Registry, for the constants of the body being orbited
+        self.upcoming = upcoming  # upcoming() -> the next queued Step, or None
+        self.prepared = None  # Maneuver planned ahead for the step after the current one
+        self.ahead = 0  # Steps committed as planned ahead
+        self.replanned = 0  # Steps whose prediction was off, planned again after the burn
+
+    def observe(self):
+        now = self.snapshots.read("body", "periapsis", "semi_major_axis", "time_to_periapsis", "time_to_apoapsis")
+        body = self.registry[now.body]
+        return Orbit(body.gravitational_parameter, body.equatorial_radius, now.periapsis, now.semi_major_axis,
+                     now.ut + now.time_to_periapsis, now.ut + now.time_to_apoapsis)
+
+    def commit(self, step):
+        # (maneuver, planned ahead) for this step: the one prepared during the last burn if it still fits
+        prepared, self.prepared = self.prepared, None
+        actual = self.observe()
+        if prepared is not None and prepared.step == step:
+            if agrees(prepared.orbit, actual, step.at):
+                self.ahead += 1
+                return prepared, True
+            self.replanned += 1
+        return plan(step, actual), False
+
+    def fly(self, steps, rcs=False):
+        # Fly the steps in order; returns the maneuvers flown
+        steps = list(steps)
+        flown = []
+        node = None  # Of the step planned ahead, added and pointed at since the last burn ended
+        try:
+            for i, step in enumerate(steps):
+                maneuver, ahead = self.commit(step)
+                if node is not None and not ahead:
+                    # Planned for an orbit the burn did not leave: move it, the autopilot follows the node
+                    node.ut = maneuver.ut
+                    node.prograde = maneuver.delta_v
+                pointed = node is not None
+                if node is None:
+                    node = self.vessel.control.add_node(maneuver.ut, prograde=maneuver.delta_v)
+                following = steps[i + 1] if i + 1 < len(steps) else self.upcoming() if self.upcoming else None
+                if following is not None:
+                    self.prepared = plan(following, predict(maneuver))
+                print("Executing {} burn, {:.1f} m/s{}".format(step.name, maneuver.delta_v,
+                                                               " (planned ahead)" if ahead else ""))
+                node, flying = None, node  # execute() removes it
+                self.executor.execute(flying, rcs, pointed)
+                flown.append(maneuver)
+                if i + 1 < len(steps):
+                    prepared = self.prepared
+                    node = self.vessel.control.add_node(prepared.ut, prograde=prepared.delta_v)
+                    self.executor.point(node, rcs)
+        finally:
+            if node is not None:
+                node.remove()
+        return flown
@@ -0,0 +1,1805 @@
+# Local stand-in for the subset of the kRPC SpaceCenter API the flight scripts use.
+#
+# The world is a deterministic patched-conic simulation in each body's equatorial plane:
+# point-mass gravity of the current sphere of influence, thrust along the vessel's attitude,
+# exponential-atmosphere drag and fuel burn per stage. Bodies are non-rotating and terrain is flat.
+#
+# Time runs in lockstep with the client instead of the wall clock: every RPC costs `rpc_time`
+# game seconds, waiting on a stream or event advances one physics frame, and warp_to()
+# propagates coasting orbits analytically. A mission therefore runs as fast as the CPU allows
+# and always produces the same result. `latency` adds a real sleep to each RPC to model a slow link.
+import collections
+import enum
+import math
+import os
+import threading
+import time
+
+G0 = 9.80665
+FUEL_DENSITY = 5.  # kg per unit of fuel, as in KSP
+
+
+# --- Two-body orbits -------------------------------------------------------------------------
+
+class Conic(object):
+    # Keplerian orbit in the plane, built from a position and velocity relative to the body at epoch
+    def __init__(self, mu, r, v, epoch):
+        self.mu = mu
+        self.epoch = epoch
+        rx, ry = r
+        vx, vy = v
+        radius = math.hypot(rx, ry)
+        v2 = vx * vx + vy * vy
+        self.sign = -1. if rx * vy - ry * vx < 0 else 1.
+        energy = v2 / 2. - mu / radius
+        if abs(energy) < 1e-9:
+            energy = -1e-9  # Nudge parabolic trajectories onto an ellipse
+        rv = rx * vx + ry * vy
+        ex = ((v2 - mu / radius) * rx - rv * vx) / mu
+        ey = ((v2 - mu / radius) * ry - rv * vy) / mu
+        e = math.hypot(ex, ey)
+        self.argp = math.atan2(ey, ex) if e > 1e-9 else 0.
+        self.a = -mu / (2. * energy)
+        self.e = min(e, 1. - 1e-9) if energy < 0 else max(e, 1. + 1e-9)
+        self.n = math.sqrt(mu / abs(self.a) ** 3)
+        self.m0 = self.mean_from_true(self.sign * (math.atan2(ry, rx) - self.argp))
+
+    @classmethod
+    def from_elements(cls, mu, a, e, argp, mean_anomaly, epoch=0.):
+        orbit = cls.__new__(cls)
+        orbit.mu, orbit.a, orbit.e, orbit.argp, orbit.m0, orbit.epoch = mu, a, e, argp, mean_anomaly, epoch
+        orbit.sign = 1.
+        orbit.n = math.sqrt(mu / abs(a) ** 3)
+        return orbit
+
+    @property
+    def elliptic(self):
+        return self.e < 1.
+
+    def mean_from_true(self, nu):
+        e = self.e
+        if self.elliptic:
+            big_e = 2. * math.atan2(math.sqrt(1. - e) * math.sin(nu / 2.), math.sqrt(1. + e) * math.cos(nu / 2.))
+            return big_e - e * math.sin(big_e)
+        limit = math.acos(-1. / e) - 1e-9
+        nu = max(-limit, min(limit, (nu + math.pi) % (2. * math.pi) - math.pi))
+        f = 2. * math.atanh(math.sqrt((e - 1.) / (e + 1.)) * math.tan(nu / 2.))
+        return e * math.sinh(f) - f
+
+    def mean_anomaly(self, t):
+        m = self.m0 + self.n * (t - self.epoch)
+        if self.elliptic:
+            m = (m + math.pi) % (2. * math.pi) - math.pi
+        return m
+
+    def true_anomaly(self, t):
+        m = self.mean_anomaly(t)
+        e = self.e
+        if self.elliptic:
+            big_e = m if e < 0.8 else math.pi
+            for _ in range(50):
+                step = (big_e - e * math.sin(big_e) - m) / (1. - e * math.cos(big_e))
+                big_e -= step
+                if abs(step) < 1e-12:
+                    break
+            return 2. * math.atan2(math.sqrt(1. + e) * math.sin(big_e / 2.), math.sqrt(1. - e) * math.cos(big_e / 2.))
+        f = math.asinh(m / e)
+        for _ in range(50):
+            step = (e * math.sinh(f) - f - m) / (e * math.cosh(f) - 1.)
+            f -= step
+            if abs(step) < 1e-12:
+                break
+        return 2. * math.atan2(math.sqrt(e + 1.) * math.sinh(f / 2.), math.sqrt(e - 1.) * math.cosh(f / 2.))
+
+    def state_at(self, t):
+        nu = self.true_anomaly(t)
+        e = self.e
+        p = self.a * (1. - e * e)
+        radius = p / (1. + e * math.cos(nu))
+        theta = self.argp + self.sign * nu
+        c, s = math.cos(theta), math.sin(theta)
+        k = math.sqrt(self.mu / p)
+        vr = k * e * math.sin(nu)
+        vt = self.sign * k * (1. + e * math.cos(nu))
+        return (radius * c, radius * s), (vr * c - vt * s, vr * s + vt * c)
+
+    @property
+    def periapsis(self):
+        return self.a * (1. - self.e)
+
+    @property
+    def apoapsis(self):
+        return self.a * (1. + self.e)
+
+    @property
+    def period(self):
+        return 2. * math.pi / self.n if self.elliptic else float("inf")
+
+    def time_to_periapsis(self, t):
+        m = self.mean_anomaly(t)
+        if self.elliptic:
+            return ((-m) % (2. * math.pi)) / self.n
+        return -m / self.n
+
+    def time_to_apoapsis(self, t):
+        if not self.elliptic:
+            return float("inf")
+        return ((math.pi - self.mean_anomaly(t)) % (2. * math.pi)) / self.n
+
+
+# --- Vector helpers (2D, in the equatorial plane) --------------------------------------------
+
+def add(a, b):
+    return (a[0] + b[0], a[1] + b[1])
+
+
+def sub(a, b):
+    return (a[0] - b[0], a[1] - b[1])
+
+
+def scale(a, k):
+    return (a[0] * k, a[1] * k)
+
+
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1]
+
+
+def norm(a):
+    return math.hypot(a[0], a[1])
+
+
+def unit(a, fallback=(1., 0.)):
+    length = norm(a)
+    return (a[0] / length, a[1] / length) if length > 1e-12 else fallback
+
+
+def perpendicular(a):
+    return (-a[1], a[0])
+
+
+# --- Bodies and craft ------------------------------------------------------------------------
+
+class Body(object):
+    def __init__(self, name, mu, radius, soi, parent=None, orbit=None, atmosphere_depth=0.,
+                 surface_density=0., scale_height=5600., rotational_period=0.):
+        self.name = name
+        self.mu = mu
+        self.radius = radius
+        self.soi = soi
+        self.parent = parent
+        self.conic = orbit
+        self.atmosphere_depth = atmosphere_depth
+        self.surface_density = surface_density
+        self.scale_height = scale_height
+        self.rotational_period = rotational_period
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+    def state(self, t):
+        # Position and velocity relative to the parent body
+        if self.conic is None:
+            return (0., 0.), (0., 0.)
+        return self.conic.state_at(t)
+
+    def absolute_position(self, t):
+        if self.parent is None:
+            return (0., 0.)
+        return add(self.parent.absolute_position(t), self.state(t)[0])
+
+    def absolute_velocity(self, t):
+        if self.parent is None:
+            return (0., 0.)
+        return add(self.parent.absolute_velocity(t), self.state(t)[1])
+
+    def density(self, altitude):
+        if altitude >= self.atmosphere_depth:
+            return 0.
+        return self.surface_density * math.exp(-altitude / self.scale_height)
+
+
+def make_bodies():
+    # Stock KSP constants; every orbit lies in the sun's equatorial plane
+    sun = Body("Sun", 1.1723328e18, 261600000., float("inf"))
+
+    def planet(name, mu, radius, soi, parent, a, e=0., argp=0., mean_anomaly=math.pi, **kwargs):
+        orbit = Conic.from_elements(parent.mu, a, e, math.radians(argp), mean_anomaly)
+        return Body(name, mu, radius, soi, parent, orbit, **kwargs)
+
+    kerbin = planet("Kerbin", 3.5316e12, 600000., 84159286., sun, 13599840256., atmosphere_depth=70000.,
+                    surface_density=1.223, scale_height=5600., rotational_period=21549.425)
+    bodies = [sun, kerbin,
+              planet("Mun", 6.5138398e10, 200000., 2429559., kerbin, 12000000., mean_anomaly=1.7,
+                     rotational_period=138984.38),
+              planet("Minmus", 1.7658e9, 60000., 2247428., kerbin, 47000000., mean_anomaly=0.9,
+                     rotational_period=40400.),
+              planet("Duna", 3.0136321e11, 320000., 47921949., sun, 20726155264., e=0.051, argp=135.5,
+                     atmosphere_depth=50000., surface_density=0.0667, scale_height=5700., rotational_period=65517.859),
+              planet("Eve", 8.1717302e12, 700000., 85109365., sun, 9832684544., e=0.01, argp=15.,
+                     atmosphere_depth=90000., surface_density=6.2, scale_height=7200., rotational_period=80500.)]
+    return collections.OrderedDict((body.name, body) for body in bodies)
+
+
+# Segments from the first stage to fire up to the payload. Fuel is in KSP units.
+DEFAULT_CRAFT = [
+    {"name": "booster", "dry_mass": 2000., "fuel": {"LiquidFuel": 3600.}, "thrust": 380000., "isp": 290.},
+    {"name": "upper", "dry_mass": 800., "fuel": {"LiquidFuel": 1000.}, "thrust": 120000., "isp": 340.},
+    {"name": "lander", "dry_mass": 1200., "fuel": {"LiquidFuel": 480.}, "thrust": 60000., "isp": 320.},
+]
+
+
+class Segment(object):
+    def __init__(self, spec, decouple_stage):
+        self.name = spec["name"]
+        self.dry_mass = spec["dry_mass"]
+        self.fuel = dict(spec.get("fuel", {}))
+        self.capacity = dict(self.fuel)
+        self.thrust = spec.get("thrust", 0.)
+        self.isp = spec.get("isp", 0.)
+        self.decouple_stage = decouple_stage
+        self.dropped = False
+
+    @property
+    def mass(self):
+        return self.dry_mass + FUEL_DENSITY * sum(self.fuel.values())
+
+    @property
+    def solid(self):
+        return "SolidFuel" in self.fuel
+
+    @property
+    def propellant(self):
+        return sum(self.fuel.values())
+
+    def burn(self, units):
+        # Remove units of propellant spread over this segment's fuels
+        total = self.propellant
+        for name in self.fuel:
+            self.fuel[name] = max(0., self.fuel[name] - units * self.fuel[name] / total) if total > 0 else 0.
+
+
+class VesselState(object):
+    def __init__(self, name, body, r, v, craft, stage, ut):
+        self.name = name
+        self.body = body
+        self.r = r
+        self.v = v
+        top = len(craft) - 1
+        self.segments = [Segment(spec, top - 1 - i) for i, spec in enumerate(craft)]
+        for segment in self.segments:
+            segment.dropped = segment.decouple_stage >= stage
+        self.top = top
+        self.current_stage = stage
+        self.throttle = 0.
+        self.attitude = unit(r) if norm(v) < 1e-3 else unit(v)
+        self.autopilot = False
+        self.target_frame = None
+        self.target_direction = (0., 1., 0.)
+        self.target_pitch_heading = None
+        self.aimed_at = ut  # UT the autopilot target last changed
+        self.sas = False
+        self.sas_mode = SASMode.stability_assist
+        self.rcs = False
+        self.abort = False
+        self.action_groups = set()
+        self.nodes = []
+        self.landed = norm(v) < 1e-3 and norm(r) <= body.radius + 1.
+        self.crashed = False
+        self.launched = not self.landed
+        self.launch_ut = ut
+        self.drag_area = 1.  # Cd * A in m^2
+
+    @property
+    def mass(self):
+        return sum(segment.mass for segment in self.segments if not segment.dropped)
+
+    @property
+    def dry_mass(self):
+        return sum(segment.dry_mass for segment in self.segments if not segment.dropped)
+
+    @property
+    def engine(self):
+        # The segment whose engine is burning: ignited at the same time as the one below drops
+        index = self.top - self.current_stage
+        if 0 <= index <= self.top and self.segments[index].thrust > 0:
+            return self.segments[index]
+        return None
+
+    @property
+    def available_thrust(self):
+        engine = self.engine
+        return engine.thrust if engine is not None and engine.propellant > 0 else 0.
+
+    @property
+    def altitude(self):
+        return norm(self.r) - self.body.radius
+
+    @property
+    def coasting(self):
+        return (self.crashed or self.landed or self.throttle <= 0 or self.available_thrust <= 0) and \
+            self.altitude >= self.body.atmosphere_depth
+
+    def conic(self, ut):
+        return Conic(self.body.mu, self.r, self.v, ut)
+
+    def activate_next_stage(self):
+        if self.current_stage <= 0:
+            return []
+        self.current_stage -= 1
+        self.launched = True
+        for segment in self.segments:
+            if segment.decouple_stage == self.current_stage:
+                segment.dropped = True
+        return []
+
+
+class SASMode(enum.Enum):
+    stability_assist = 0
+    maneuver = 1
+    prograde = 2
+    retrograde = 3
+    normal = 4
+    anti_normal = 5
+    radial = 6
+    anti_radial = 7
+    target = 8
+    anti_target = 9
+
+
+class VesselSituation(enum.Enum):
+    pre_launch = 0
+    orbiting = 1
+    sub_orbital = 2
+    escaping = 3
+    flying = 4
+    landed = 5
+    splashed = 6
+    docked = 7
+
+
+class NodeState(object):
+    def __init__(self, vessel, ut, prograde, normal, radial, conic):
+        self.vessel = vessel
+        self.body = vessel.body
+        self.ut = ut
+        self.prograde = prograde
+        self.normal = normal
+        self.radial = radial
+        self.removed = False
+        self.place(conic)
+
+    def place(self, conic):
+        # Burn and target orbit from ut and the components, on the vessel's orbit (conic); again on each change
+        r, v = conic.state_at(self.ut)
+        forward = unit(v)
+        outward = perpendicular(forward)
+        if dot(outward, r) < 0:
+            outward = scale(outward, -1.)
+        self.position = r
+        self.velocity = v
+        self.burn = add(scale(forward, self.prograde), scale(outward, self.radial))
+        self.direction = unit(self.burn, forward)
+        self.target = Conic(self.body.mu, r, add(v, self.burn), self.ut)  # Orbit after the burn
+
+    def remaining(self, now):
+        # As in KSP: velocity at the node on the planned orbit minus where the current orbit will be then
+        vessel = self.vessel
+        if vessel.body is not self.body or vessel.landed or vessel.crashed:
+            return self.burn
+        return sub(self.target.state_at(self.ut)[1], vessel.conic(now).state_at(self.ut)[1])
+
+
+# --- World -----------------------------------------------------------------------------------
+
+class World(object):
+    def __init__(self, dt=0.02):
+        self.ut = 0.
+        self.dt = dt
+        self.bodies = make_bodies()
+        self.vessels = []
+        self.active = None
+        self.pending = 0.
+        self.steps = 0
+        self.listeners = []  # Called after every physics frame
+        self.scene = GameScene.flight  # Set to another scene to stand in for KSP reloading
+        self.lock = threading.RLock()
+
+    def add_vessel(self, vessel):
+        self.vessels.append(vessel)
+        if self.active is None:
+            self.active = vessel
+        return vessel
+
+    def advance(self, seconds):
+        with self.lock:
+            self.pending += seconds
+            while self.pending >= self.dt:
+                self.pending -= self.dt
+                self.step()
+
+    def step(self):
+        with self.lock:
+            for vessel in self.vessels:
+                self.integrate(vessel, self.dt)
+            self.ut += self.dt
+            self.steps += 1
+            for vessel in self.vessels:
+                self.transitions(vessel)
+        for listener in list(self.listeners):
+            listener()
+
+    def warp_to(self, ut):
+        # Coast analytically while every vessel is coasting, otherwise fall back to physics frames
+        with self.lock:
+            while self.ut < ut - 1e-9:
+                if all(vessel.coasting for vessel in self.vessels):
+                    self.coast(min(ut, self.ut + self.coast_chunk()))
+                else:
+                    self.step()
+            self.pending = 0.
+        for listener in list(self.listeners):
+            listener()
+
+    def coast_chunk(self):
+        chunk = 600.
+        for vessel in self.vessels:
+            if not (vessel.landed or vessel.crashed):
+                chunk = min(chunk, max(1., vessel.conic(self.ut).period / 200.))
+        return chunk
+
+    def coast(self, t):
+        for vessel in self.vessels:
+            if vessel.landed or vessel.crashed:
+                continue
+            event = find_event(vessel.body, vessel.conic(self.ut), self.ut, t)
+            if event is not None:
+                t = min(t, event[0])
+        for vessel in self.vessels:
+            if not (vessel.landed or vessel.crashed):
+                vessel.r, vessel.v = vessel.conic(self.ut).state_at(t)
+        self.ut = t
+        for vessel in self.vessels:
+            self.transitions(vessel)
+
+    def attitude(self, vessel):
+        if vessel.autopilot:
+            if vessel.target_pitch_heading is not None:
+                pitch, heading = vessel.target_pitch_heading
+                up = unit(vessel.r)
+                east = perpendicular(up)
+                if math.sin(math.radians(heading)) < 0:
+                    east = scale(east, -1.)
+                return unit(add(scale(up, math.sin(math.radians(pitch))), scale(east, math.cos(math.radians(pitch)))))
+            if vessel.target_frame is not None:
+                return unit(vessel.target_frame.from_local(vessel.target_direction), vessel.attitude)
+        elif vessel.sas and norm(vessel.v) > 0.1:
+            if vessel.sas_mode == SASMode.prograde:
+                return unit(vessel.v)
+            if vessel.sas_mode == SASMode.retrograde:
+                return scale(unit(vessel.v), -1.)
+            if vessel.sas_mode == SASMode.radial:
+                return unit(vessel.r)
+            if vessel.sas_mode == SASMode.anti_radial:
+                return scale(unit(vessel.r), -1.)
+            if vessel.sas_mode == SASMode.maneuver and vessel.nodes:
+                return vessel.nodes[0].direction
+        return vessel.attitude
+
+    def integrate(self, vessel, dt):
+        if vessel.crashed:
+            return
+        vessel.attitude = self.attitude(vessel)
+        thrust = 0.
+        engine = vessel.engine
+        if engine is not None and engine.propellant > 0:
+            throttle = 1. if engine.solid else vessel.throttle
+            if throttle > 0:
+                flow = engine.thrust * throttle / (engine.isp * G0) / FUEL_DENSITY  # units per second
+                fraction = min(1., engine.propellant / (flow * dt))
+                engine.burn(flow * dt * fraction)
+                thrust = engine.thrust * throttle * fraction
+        mass = vessel.mass
+        accel = thrust / mass
+        body = vessel.body
+        if vessel.landed:
+            if accel * dot(vessel.attitude, unit(vessel.r)) <= body.mu / norm(vessel.r) ** 2:
+                return
+            vessel.landed = False
+            vessel.launched = True
+        thrust_accel = scale(vessel.attitude, accel)
+
+        def derivative(r, v):
+            radius = norm(r)
+            a = add(scale(r, -body.mu / radius ** 3), thrust_accel)
+            rho = body.density(radius - body.radius)
+            if rho > 0:
+                a = add(a, scale(v, -0.5 * rho * norm(v) * vessel.drag_area / mass))
+            return v, a
+
+        r, v = vessel.r, vessel.v
+        k1r, k1v = derivative(r, v)
+        k2r, k2v = derivative(add(r, scale(k1r, dt / 2.)), add(v, scale(k1v, dt / 2.)))
+        k3r, k3v = derivative(add(r, scale(k2r, dt / 2.)), add(v, scale(k2v, dt / 2.)))
+        k4r, k4v = derivative(add(r, scale(k3r, dt)), add(v, scale(k3v, dt)))
+        vessel.r = add(r, scale(add(add(k1r, scale(k2r, 2.)), add(scale(k3r, 2.), k4r)), dt / 6.))
+        vessel.v = add(v, scale(add(add(k1v, scale(k2v, 2.)), add(scale(k3v, 2.), k4v)), dt / 6.))
+
+    def transitions(self, vessel):
+        if vessel.landed or vessel.crashed:
+            return
+        body = vessel.body
+        if body.parent is not None and norm(vessel.r) > body.soi:
+            position, velocity = body.state(self.ut)
+            vessel.r, vessel.v, vessel.body = add(vessel.r, position), add(vessel.v, velocity), body.parent
+            return
+        for child in body.children:
+            position, velocity = child.state(self.ut)
+            if norm(sub(vessel.r, position)) < child.soi:
+                vessel.r, vessel.v, vessel.body = sub(vessel.r, position), sub(vessel.v, velocity), child
+                return
+        if vessel.altitude <= 0:
+            if norm(vessel.v) <= 15.:
+                vessel.landed = True
+            else:
+                vessel.crashed = True
+                vessel.throttle = 0.
+            vessel.r = scale(unit(vessel.r), body.radius)
+            vessel.v = (0., 0.)
+
+
+def find_event(body, conic, t0, t1, surface=True):
+    # First time in (t0, t1] the orbit leaves the body's SOI, enters a child's SOI or (with surface)
+    # drops into the atmosphere / onto the ground. Assumes at most one crossing in the interval.
+    # Returns (ut, body on the far side) or None.
+    floor = body.radius + body.atmosphere_depth
+
+    def crossed(t):
+        r = conic.state_at(t)[0]
+        radius = norm(r)
+        if radius > body.soi:
+            return body.parent
+        if surface and radius < floor:
+            return body
+        for child in body.children:
+            if norm(sub(r, child.state(t)[0])) < child.soi:
+                return child
+        return None
+
+    if crossed(t1) is None:
+        return None
+    lo, hi = t0, t1
+    while hi - lo > 1e-3:
+        mid = (lo + hi) / 2.
+        if crossed(mid) is None:
+            lo = mid
+        else:
+            hi = mid
+    return hi, crossed(hi)
+
+
+def predict_transition(body, conic, ut):
+    # Next SOI change of an orbit, searched over one period (or ten days on escape trajectories)
+    horizon = conic.period if conic.elliptic else 864000.
+    chunk = max(1., min(600., horizon / 400.))
+    t = ut
+    while t < ut + horizon:
+        t_next = min(ut + horizon, t + chunk)
+        event = find_event(body, conic, t, t_next, surface=False)
+        if event is not None:
+            return event
+        t = t_next
+    return None
+
+
+# --- Remote objects --------------------------------------------------------------------------
+
+class remote_property(object):
+    # Property whose reads and writes go through SimConnection._invoke like a kRPC call,
+    # except while a stream is being evaluated
+    def __init__(self, fget):
+        self.fget = fget
+        self.fset = None
+        self.name = fget.__name__
+
+    def __set_name__(self, owner, name):
+        self.owner = owner.__name__
+
+    def setter(self, fset):
+        self.fset = fset
+        return self
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if obj._conn.streaming:
+            return self.fget(obj)
+        return obj._conn._invoke("SpaceCenter", "{}_get_{}".format(self.owner, self.name), self.fget, obj)
+
+    def __set__(self, obj, value):
+        if self.fset is None:
+            raise AttributeError(self.name)
+        obj._conn._invoke("SpaceCenter", "{}_set_{}".format(self.owner, self.name), self.fset, obj, value)
+
+
+def remote_method(fn):
+    def call(self, *args, **kwargs):
+        if self._conn.streaming:
+            return fn(self, *args, **kwargs)
+        procedure = "{}_{}".format(type(self).__name__, fn.__name__)
+        return self._conn._invoke("SpaceCenter", procedure, fn, self, *args, **kwargs)
+    call.__name__ = fn.__name__
+    return call
+
+
+class Remote(object):
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def _world(self):
+        return self._conn.world
+
+
+class ReferenceFrame(Remote):
+    # kind: "body" (centred on a body, equatorial axes), "orbital" / "node" (y forward),
+    # "surface" (x up, y north, z east) or "vessel" (y along the vessel's attitude)
+    def __init__(self, conn, kind, owner):
+        Remote.__init__(self, conn)
+        self.kind = kind
+        self.owner = owner
+
+    def origin(self, ut):
+        if self.kind == "body":
+            return self.owner.absolute_position(ut)
+        vessel = self.owner.vessel if self.kind == "node" else self.owner
+        return add(vessel.body.absolute_position(ut), vessel.r)
+
+    def origin_velocity(self, ut):
+        if self.kind == "body":
+            return self.owner.absolute_velocity(ut)
+        vessel = self.owner.vessel if self.kind == "node" else self.owner
+        return add(vessel.body.absolute_velocity(ut), vessel.v)
+
+    def axes(self):
+        # (forward, side) for frames with a y-forward convention
+        if self.kind == "node":
+            forward = self.owner.direction
+            side = perpendicular(forward)
+            return forward, side if dot(side, self.owner.position) >= 0 else scale(side, -1.)
+        if self.kind == "orbital":
+            forward = unit(self.owner.v, perpendicular(unit(self.owner.r)))
+        else:
+            forward = self.owner.attitude
+        side = perpendicular(forward)
+        return forward, side if dot(side, self.owner.r) >= 0 else scale(side, -1.)
+
+    def to_local(self, vector):
+        if self.kind == "body":
+            return (vector[0], 0., vector[1])
+        if self.kind == "surface":
+            up = unit(self.owner.r)
+            return (dot(vector, up), 0., dot(vector, perpendicular(up)))
+        forward, side = self.axes()
+        return (dot(vector, side), dot(vector, forward), 0.)
+
+    def from_local(self, vector):
+        if self.kind == "body":
+            return (vector[0], vector[2])
+        if self.kind == "surface":
+            up = unit(self.owner.r)
+            return add(scale(up, vector[0]), scale(perpendicular(up), vector[2]))
+        forward, side = self.axes()
+        return add(scale(side, vector[0]), scale(forward, vector[1]))
+
+
+class Orbit(Remote):
+    # source() returns (body, conic) at the current UT; next_orbit patches are fixed conics
+    def __init__(self, conn, source, start=None):
+        Remote.__init__(self, conn)
+        self._source = source
+        self._start = start
+
+    def _now(self):
+        return self._world.ut if self._start is None else max(self._world.ut, self._start)
+
+    @remote_property
+    def body(self):
+        return CelestialBody(self._conn, self._source()[0])
+
+    @remote_property
+    def apoapsis(self):
+        return self._source()[1].apoapsis
+
+    @remote_property
+    def periapsis(self):
+        return self._source()[1].periapsis
+
+    @remote_property
+    def apoapsis_altitude(self):
+        body, conic = self._source()
+        return conic.apoapsis - body.radius
+
+    @remote_property
+    def periapsis_altitude(self):
+        body, conic = self._source()
+        return conic.periapsis - body.radius
+
+    @remote_property
+    def semi_major_axis(self):
+        return self._source()[1].a
+
+    @remote_property
+    def eccentricity(self):
+        return self._source()[1].e
+
+    @remote_property
+    def inclination(self):
+        return 0. if self._source()[1].sign > 0 else math.pi  # Retrograde orbits are flipped over
+
+    @remote_property
+    def period(self):
+        return self._source()[1].period
+
+    @remote_property
+    def radius(self):
+        return norm(self._source()[1].state_at(self._now())[0])
+
+    @remote_property
+    def speed(self):
+        return norm(self._source()[1].state_at(self._now())[1])
+
+    @remote_property
+    def mean_anomaly(self):
+        return self._source()[1].mean_anomaly(self._now())
+
+    @remote_property
+    def true_anomaly(self):
+        return self._source()[1].true_anomaly(self._now())
+
+    @remote_property
+    def argument_of_periapsis(self):
+        conic = self._source()[1]
+        return conic.argp if conic.sign > 0 else -conic.argp  # Measured the other way round when flipped over
+
+    @remote_property
+    def longitude_of_ascending_node(self):
+        return 0.
+
+    @remote_property
+    def mean_anomaly_at_epoch(self):
+        return self._source()[1].m0
+
+    @remote_property
+    def epoch(self):
+        return self._source()[1].epoch
+
+    @remote_property
+    def time_to_apoapsis(self):
+        return self._source()[1].time_to_apoapsis(self._now())
+
+    @remote_property
+    def time_to_periapsis(self):
+        return self._source()[1].time_to_periapsis(self._now())
+
+    @remote_property
+    def time_to_soi_change(self):
+        body, conic = self._source()
+        event = predict_transition(body, conic, self._now())
+        return float("nan") if event is None else event[0] - self._world.ut
+
+    @remote_property
+    def next_orbit(self):
+        body, conic = self._source()
+        event = predict_transition(body, conic, self._now())
+        if event is None:
+            return None
+        t, new_body = event
+        r, v = conic.state_at(t)
+        if new_body is body.parent:
+            position, velocity = body.state(t)
+            r, v = add(r, position), add(v, velocity)
+        else:
+            position, velocity = new_body.state(t)
+            r, v = sub(r, position), sub(v, velocity)
+        patch = Conic(new_body.mu, r, v, t)
+        return Orbit(self._conn, lambda: (new_body, patch), start=t)
+
+    @remote_method
+    def position_at(self, ut, reference_frame):
+        body, conic = self._source()
+        position = add(body.absolute_position(ut), conic.state_at(ut)[0])
+        return reference_frame.to_local(sub(position, reference_frame.origin(ut)))
+
+    @remote_method
+    def ut_at_true_anomaly(self, true_anomaly):
+        conic = self._source()[1]
+        m = conic.mean_from_true(true_anomaly)
+        now = self._now()
+        dt = (m - conic.mean_anomaly(now)) / conic.n
+        if conic.elliptic:
+            dt %= conic.period
+        return now + dt
+
+
+class CelestialBody(Remote):
+    def __init__(self, conn, body):
+        Remote.__init__(self, conn)
+        self._body = body
+
+    def __eq__(self, other):
+        return isinstance(other, CelestialBody) and other._body is self._body
+
+    def __hash__(self):
+        return hash(self._body.name)
+
+    def __repr__(self):
+        return "<CelestialBody {}>".format(self._body.name)
+
+    @remote_property
+    def name(self):
+        return self._body.name
+
+    @remote_property
+    def gravitational_parameter(self):
+        return self._body.mu
+
+    @remote_property
+    def mass(self):
+        return self._body.mu / 6.67408e-11
+
+    @remote_property
+    def surface_gravity(self):
+        return self._body.mu / self._body.radius ** 2
+
+    @remote_property
+    def equatorial_radius(self):
+        return self._body.radius
+
+    @remote_property
+    def sphere_of_influence(self):
+        return self._body.soi
+
+    @remote_property
+    def has_atmosphere(self):
+        return self._body.atmosphere_depth > 0
+
+    @remote_property
+    def atmosphere_depth(self):
+        return self._body.atmosphere_depth
+
+    @remote_property
+    def rotational_period(self):
+        return self._body.rotational_period
+
+    @remote_property
+    def rotational_speed(self):
+        return 0.
+
+    @remote_property
+    def orbit(self):
+        body = self._body
+        if body.parent is None:
+            return None
+        return Orbit(self._conn, lambda: (body.parent, body.conic))
+
+    @remote_property
+    def satellites(self):
+        return [CelestialBody(self._conn, child) for child in self._body.children]
+
+    @remote_property
+    def reference_frame(self):
+        return ReferenceFrame(self._conn, "body", self._body)
+
+    @remote_property
+    def non_rotating_reference_frame(self):
+        return ReferenceFrame(self._conn, "body", self._body)
+
+    @remote_method
+    def position(self, reference_frame):
+        ut = self._world.ut
+        return reference_frame.to_local(sub(self._body.absolute_position(ut), reference_frame.origin(ut)))
+
+    @remote_method
+    def velocity(self, reference_frame):
+        ut = self._world.ut
+        return reference_frame.to_local(sub(self._body.absolute_velocity(ut), reference_frame.origin_velocity(ut)))
+
+
+class Resources(Remote):
+    def __init__(self, conn, segments):
+        Remote.__init__(self, conn)
+        self._segments = segments
+
+    @remote_property
+    def names(self):
+        names = []
+        for segment in self._segments():
+            names.extend(name for name in segment.fuel if name not in names)
+        return names
+
+    @remote_method
+    def has_resource(self, name):
+        return any(name in segment.fuel for segment in self._segments())
+
+    @remote_method
+    def amount(self, name):
+        return sum(segment.fuel.get(name, 0.) for segment in self._segments())
+
+    @remote_method
+    def max(self, name):
+        return sum(segment.capacity.get(name, 0.) for segment in self._segments())
+
+
+class Engine(Remote):
+    def __init__(self, conn, state, segment):
+        Remote.__init__(self, conn)
+        self._state = state
+        self._segment = segment
+
+    @remote_property
+    def part(self):
+        return Part(self._conn, self._state, self._segment)
+
+    @remote_property
+    def active(self):
+        return self._state.engine is self._segment
+
+    @remote_property
+    def max_thrust(self):
+        return self._segment.thrust
+
+    @remote_property
+    def max_vacuum_thrust(self):
+        return self._segment.thrust
+
+    @remote_property
+    def vacuum_specific_impulse(self):
+        return self._segment.isp
+
+    @remote_property
+    def propellant_names(self):
+        return list(self._segment.fuel)
+
+
+class Part(Remote):
+    # One part per craft segment: its tanks, engine and the decoupler below it
+    def __init__(self, conn, state, segment):
+        Remote.__init__(self, conn)
+        self._state = state
+        self._segment = segment
+
+    @remote_property
+    def name(self):
+        return self._segment.name
+
+    @remote_property
+    def stage(self):
+        # Activation stage: the engine lights when the stage below is dropped (-1 without an engine)
+        if self._segment.thrust <= 0:
+            return -1
+        return self._state.top - self._state.segments.index(self._segment)
+
+    @remote_property
+    def decouple_stage(self):
+        return self._segment.decouple_stage
+
+    @remote_property
+    def mass(self):
+        return self._segment.mass
+
+    @remote_property
+    def dry_mass(self):
+        return self._segment.dry_mass
+
+    @remote_property
+    def engine(self):
+        return Engine(self._conn, self._state, self._segment) if self._segment.thrust > 0 else None
+
+    @remote_property
+    def resources(self):
+        return Resources(self._conn, lambda: [self._segment])
+
+
+class Parts(Remote):
+    def __init__(self, conn, state):
+        Remote.__init__(self, conn)
+        self._state = state
+
+    @remote_property
+    def all(self):
+        return [Part(self._conn, self._state, s) for s in self._state.segments if not s.dropped]
+
+    @remote_property
+    def engines(self):
+        return [Engine(self._conn, self._state, s) for s in self._state.segments if not s.dropped and s.thrust > 0]
+
+    @remote_method
+    def in_decouple_stage(self, stage):
+        return [Part(self._conn, self._state, s) for s in self._state.segments
+                if not s.dropped and s.decouple_stage == stage]
+
+
+class Node(Remote):
+    def __init__(self, conn, state):
+        Remote.__init__(self, conn)
+        self._state = state
+
+    @remote_property
+    def ut(self):
+        return self._state.ut
+
+    @ut.setter
+    def ut(self, ut):
+        state = self._state
+        state.ut = float(ut)
+        state.place(state.vessel.conic(self._world.ut))
+
+    @remote_property
+    def time_to(self):
+        return self._state.ut - self._world.ut
+
+    @remote_property
+    def delta_v(self):
+        return norm(self._state.burn)
+
+    @remote_property
+    def remaining_delta_v(self):
+        return norm(self._state.remaining(self._world.ut))
+
+    @remote_property
+    def prograde(self):
+        return self._state.prograde
+
+    @prograde.setter
+    def prograde(self, prograde):
+        state = self._state
+        state.prograde = float(prograde)
+        state.place(state.vessel.conic(self._world.ut))
+
+    @remote_property
+    def radial(self):
+        return self._state.radial
+
+    @remote_property
+    def normal(self):
+        return self._state.normal
+
+    @remote_property
+    def reference_frame(self):
+        return ReferenceFrame(self._conn, "node", self._state)
+
+    @remote_property
+    def orbital_reference_frame(self):
+        return ReferenceFrame(self._conn, "node", self._state)
+
+    @remote_property
+    def orbit(self):
+        state = self._state
+        return Orbit(self._conn, lambda: (state.body, state.target), start=state.ut)
+
+    @remote_method
+    def burn_vector(self, reference_frame=None):
+        frame = reference_frame or ReferenceFrame(self._conn, "node", self._state)
+        return frame.to_local(self._state.burn)
+
+    @remote_method
+    def remaining_burn_vector(self, reference_frame=None):
+        frame = reference_frame or ReferenceFrame(self._conn, "node", self._state)
+        return frame.to_local(self._state.remaining(self._world.ut))
+
+    @remote_method
+    def remove(self):
+        state = self._state
+        state.removed = True
+        if state in state.vessel.nodes:
+            state.vessel.nodes.remove(state)
+
+
+class Control(Remote):
+    def __init__(self, conn, vessel):
+        Remote.__init__(self, conn)
+        self._vessel = vessel
+
+    @remote_property
+    def throttle(self):
+        return self._vessel.throttle
+
+    @throttle.setter
+    def throttle(self, value):
+        self._vessel.throttle = max(0., min(1., float(value)))
+
+    @remote_property
+    def sas(self):
+        return self._vessel.sas
+
+    @sas.setter
+    def sas(self, value):
+        self._vessel.sas = bool(value)
+
+    @remote_property
+    def sas_mode(self):
+        return self._vessel.sas_mode
+
+    @sas_mode.setter
+    def sas_mode(self, value):
+        self._vessel.sas_mode = value
+
+    @remote_property
+    def rcs(self):
+        return self._vessel.rcs
+
+    @rcs.setter
+    def rcs(self, value):
+        self._vessel.rcs = bool(value)
+
+    @remote_property
+    def abort(self):
+        return self._vessel.abort
+
+    @abort.setter
+    def abort(self, value):
+        self._vessel.abort = bool(value)
+        if value:
+            self._vessel.throttle = 0.
+
+    @remote_property
+    def current_stage(self):
+        return self._vessel.current_stage
+
+    @remote_property
+    def nodes(self):
+        return [Node(self._conn, node) for node in self._vessel.nodes]
+
+    @remote_method
+    def activate_next_stage(self):
+        return self._vessel.activate_next_stage()
+
+    @remote_method
+    def toggle_action_group(self, group):
+        self._vessel.action_groups ^= {group}
+
+    @remote_method
+    def get_action_group(self, group):
+        return group in self._vessel.action_groups
+
+    @remote_method
+    def add_node(self, ut, prograde=0., normal=0., radial=0.):
+        vessel = self._vessel
+        state = NodeState(vessel, float(ut), float(prograde), float(normal), float(radial),
+                          vessel.conic(self._world.ut))
+        vessel.nodes.append(state)
+        return Node(self._conn, state)
+
+    @remote_method
+    def remove_nodes(self):
+        for node in self._vessel.nodes:
+            node.removed = True
+        self._vessel.nodes = []
+
+
+class AutoPilot(Remote):
+    settle_time = 1.  # Game seconds wait() takes to turn the vessel
+
+    def __init__(self, conn, vessel):
+        Remote.__init__(self, conn)
+        self._vessel = vessel
+
+    @remote_method
+    def engage(self):
+        self._vessel.autopilot = True
+
+    @remote_method
+    def disengage(self):
+        self._vessel.autopilot = False
+
+    @remote_method
+    def wait(self):
+        self._world.advance(self.settle_time)
+
+    @remote_method
+    def target_pitch_and_heading(self, pitch, heading):
+        self._vessel.target_pitch_heading = (float(pitch), float(heading))
+
+    @remote_property
+    def target_pitch(self):
+        target = self._vessel.target_pitch_heading
+        return target[0] if target is not None else float("nan")
+
+    @remote_property
+    def target_heading(self):
+        target = self._vessel.target_pitch_heading
+        return target[1] if target is not None else float("nan")
+
+    @remote_property
+    def error(self):
+        # Degrees off target: the turn takes settle_time from the last target change
+        turning = self.settle_time - (self._world.ut - self._vessel.aimed_at)
+        return 90. * max(0., turning) / self.settle_time
+
+    @remote_property
+    def reference_frame(self):
+        return self._vessel.target_frame
+
+    @reference_frame.setter
+    def reference_frame(self, frame):
+        self._vessel.target_frame = frame
+        self._vessel.target_pitch_heading = None
+        self._vessel.aimed_at = self._world.ut
+
+    @remote_property
+    def target_direction(self):
+        return self._vessel.target_direction
+
+    @target_direction.setter
+    def target_direction(self, direction):
+        self._vessel.target_direction = tuple(direction)
+        self._vessel.target_pitch_heading = None
+        self._vessel.aimed_at = self._world.ut
+
+    @remote_property
+    def sas(self):
+        return self._vessel.sas
+
+    @sas.setter
+    def sas(self, value):
+        self._vessel.sas = bool(value)
+
+    @remote_property
+    def sas_mode(self):
+        return self._vessel.sas_mode
+
+    @sas_mode.setter
+    def sas_mode(self, value):
+        self._vessel.sas_mode = value
+
+
+class Flight(Remote):
+    def __init__(self, conn, vessel, frame):
+        Remote.__init__(self, conn)
+        self._vessel = vessel
+        self._frame = frame
+
+    @remote_property
+    def mean_altitude(self):
+        return self._vessel.altitude
+
+    @remote_property
+    def surface_altitude(self):
+        return self._vessel.altitude
+
+    @remote_property
+    def bedrock_altitude(self):
+        return self._vessel.altitude
+
+    @remote_property
+    def elevation(self):
+        return 0.
+
+    @remote_property
+    def speed(self):
+        frame = self._frame
+        if frame.kind == "body":
+            ut = self._world.ut
+            velocity = add(self._vessel.body.absolute_velocity(ut), self._vessel.v)
+            return norm(sub(velocity, frame.origin_velocity(ut)))
+        return norm(self._vessel.v)
+
+    @remote_property
+    def vertical_speed(self):
+        return dot(self._vessel.v, unit(self._vessel.r))
+
+    @remote_property
+    def horizontal_speed(self):
+        return abs(dot(self._vessel.v, perpendicular(unit(self._vessel.r))))
+
+    @remote_property
+    def velocity(self):
+        return self._frame.to_local(self._vessel.v)
+
+    @remote_property
+    def direction(self):
+        return self._frame.to_local(self._vessel.attitude)
+
+    @remote_property
+    def pitch(self):
+        return math.degrees(math.asin(max(-1., min(1., dot(self._vessel.attitude, unit(self._vessel.r))))))
+
+    @remote_property
+    def heading(self):
+        return 90. if dot(self._vessel.attitude, perpendicular(unit(self._vessel.r))) >= 0 else 270.
+
+    @remote_property
+    def atmosphere_density(self):
+        return self._vessel.body.density(self._vessel.altitude)
+
+    @remote_property
+    def dynamic_pressure(self):
+        return 0.5 * self._vessel.body.density(self._vessel.altitude) * norm(self._vessel.v) ** 2
+
+
+class Vessel(Remote):
+    def __init__(self, conn, state):
+        Remote.__init__(self, conn)
+        self._state = state
+        self._control = Control(conn, state)
+        self._auto_pilot = AutoPilot(conn, state)
+        self._orbit = Orbit(conn, lambda: (state.body, state.conic(self._world.ut)))
+
+    def __eq__(self, other):
+        return isinstance(other, Vessel) and other._state is self._state
+
+    def __hash__(self):
+        return id(self._state)
+
+    @remote_property
+    def name(self):
+        return self._state.name
+
+    @remote_property
+    def situation(self):
+        state = self._state
+        if state.crashed:
+            return VesselSituation.landed
+        if state.landed:
+            return VesselSituation.landed if state.launched else VesselSituation.pre_launch
+        if state.altitude < state.body.atmosphere_depth:
+            return VesselSituation.flying
+        conic = state.conic(self._world.ut)
+        if not conic.elliptic:
+            return VesselSituation.escaping
+        if conic.periapsis > state.body.radius + state.body.atmosphere_depth:
+            return VesselSituation.orbiting
+        return VesselSituation.sub_orbital
+
+    @remote_property
+    def met(self):
+        return self._world.ut - self._state.launch_ut
+
+    @remote_property
+    def control(self):
+        return self._control
+
+    @remote_property
+    def auto_pilot(self):
+        return self._auto_pilot
+
+    @remote_property
+    def orbit(self):
+        return self._orbit
+
+    @remote_property
+    def mass(self):
+        return self._state.mass
+
+    @remote_property
+    def dry_mass(self):
+        return self._state.dry_mass
+
+    @remote_property
+    def thrust(self):
+        engine = self._state.engine
+        if engine is None or engine.propellant <= 0:
+            return 0.
+        return engine.thrust * (1. if engine.solid else self._state.throttle)
+
+    @remote_property
+    def available_thrust(self):
+        return self._state.available_thrust
+
+    @remote_property
+    def max_thrust(self):
+        return self._state.available_thrust
+
+    @remote_property
+    def specific_impulse(self):
+        engine = self._state.engine
+        return engine.isp if engine is not None and engine.propellant > 0 else 0.
+
+    @remote_property
+    def vacuum_specific_impulse(self):
+        engine = self._state.engine
+        return engine.isp if engine is not None else 0.
+
+    @remote_property
+    def resources(self):
+        state = self._state
+        return Resources(self._conn, lambda: [s for s in state.segments if not s.dropped])
+
+    @remote_property
+    def parts(self):
+        return Parts(self._conn, self._state)
+
+    @remote_method
+    def resources_in_decouple_stage(self, stage, cumulative=True):
+        state = self._state
+        if cumulative:
+            return Resources(self._conn, lambda: [s for s in state.segments
+                                                  if not s.dropped and s.decouple_stage >= stage])
+        return Resources(self._conn, lambda: [s for s in state.segments
+                                              if not s.dropped and s.decouple_stage == stage])
+
+    @remote_method
+    def flight(self, reference_frame=None):
+        return Flight(self._conn, self._state, reference_frame or ReferenceFrame(self._conn, "surface", self._state))
+
+    @remote_property
+    def reference_frame(self):
+        return ReferenceFrame(self._conn, "vessel", self._state)
+
+    @remote_property
+    def orbital_reference_frame(self):
+        return ReferenceFrame(self._conn, "orbital", self._state)
+
+    @remote_property
+    def surface_reference_frame(self):
+        return ReferenceFrame(self._conn, "surface", self._state)
+
+    @remote_method
+    def position(self, reference_frame):
+        ut = self._world.ut
+        position = add(self._state.body.absolute_position(ut), self._state.r)
+        return reference_frame.to_local(sub(position, reference_frame.origin(ut)))
+
+    @remote_method
+    def velocity(self, reference_frame):
+        ut = self._world.ut
+        velocity = add(self._state.body.absolute_velocity(ut), self._state.v)
+        return reference_frame.to_local(sub(velocity, reference_frame.origin_velocity(ut)))
+
+
+class SpaceCenter(Remote):
+    VesselSituation = VesselSituation
+
+    def __init__(self, conn):
+        Remote.__init__(self, conn)
+        self._vessels = {}
+        self._rails_warp_factor = 0
+
+    def _vessel(self, state):
+        if id(state) not in self._vessels:
+            self._vessels[id(state)] = Vessel(self._conn, state)
+        return self._vessels[id(state)]
+
+    @remote_property
+    def active_vessel(self):
+        return self._vessel(self._world.active)
+
+    @active_vessel.setter
+    def active_vessel(self, vessel):
+        self._world.active = vessel._state
+
+    @remote_property
+    def vessels(self):
+        return [self._vessel(state) for state in self._world.vessels]
+
+    @remote_property
+    def bodies(self):
+        return collections.OrderedDict((name, CelestialBody(self._conn, body))
+                                       for name, body in self._world.bodies.items())
+
+    @remote_property
+    def ut(self):
+        return self._world.ut
+
+    @remote_property
+    def g(self):
+        return 6.67408e-11
+
+    @remote_property
+    def rails_warp_factor(self):
+        return self._rails_warp_factor
+
+    @rails_warp_factor.setter
+    def rails_warp_factor(self, factor):
+        self._rails_warp_factor = factor
+
+    @remote_method
+    def warp_to(self, ut, max_rails_rate=100000., max_physics_rate=2.):
+        self._world.warp_to(ut)
+
+
+# --- Streams, expressions and events ---------------------------------------------------------
+
+class Stream(object):
+    def __init__(self, conn, func, args, kwargs):
+        self._conn = conn
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self.condition = threading.Condition()
+        self.rate = 0
+        self.callbacks = []
+        self.removed = False
+
+    def __call__(self):
+        self._conn.check_connected()
+        self._conn.idle()
+        return self.value()
+
+    def value(self):
+        with self._conn.stream_evaluation():
+            return self._func(*self._args, **self._kwargs)
+
+    def start(self, wait=True):
+        pass
+
+    def wait(self, timeout=None):
+        # The next stream update is the next physics frame
+        self._conn.world.step()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def remove(self):
+        self.removed = True
+        self._conn.streams.discard(self)
+
+
+class Call(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Expression(object):
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+
+
+class ExpressionBuilder(object):
+    # conn.krpc.Expression: builds server-side expressions that the sim evaluates every frame
+    def __init__(self, conn):
+        self._conn = conn
+
+    def _build(self, procedure, evaluate):
+        return self._conn._invoke("KRPC", "Expression_static_" + procedure, lambda: Expression(evaluate))
+
+    def call(self, call):
+        def evaluate():
+            with self._conn.stream_evaluation():
+                return call.func(*call.args, **call.kwargs)
+        return self._build("Call", evaluate)
+
+    def constant_double(self, value):
+        return self._build("ConstantDouble", lambda: value)
+
+    constant_float = constant_double
+    constant_int = constant_double
+
+    def constant_bool(self, value):
+        return self._build("ConstantBool", lambda: value)
+
+    def _compare(self, name, op):
+        return lambda lhs, rhs: self._build(name, lambda: op(lhs.evaluate(), rhs.evaluate()))
+
+    def __getattr__(self, name):
+        comparisons = {
+            "equal": lambda a, b: a == b,
+            "not_equal": lambda a, b: a != b,
+            "greater_than": lambda a, b: a > b,
+            "greater_than_or_equal": lambda a, b: a >= b,
+            "less_than": lambda a, b: a < b,
+            "less_than_or_equal": lambda a, b: a <= b,
+            "and_": lambda a, b: a and b,
+            "or_": lambda a, b: a or b,
+            "add": lambda a, b: a + b,
+            "subtract": lambda a, b: a - b,
+            "multiply": lambda a, b: a * b,
+            "divide": lambda a, b: a / b,
+        }
+        if name not in comparisons:
+            raise AttributeError(name)
+        return self._compare(name, comparisons[name])
+
+    def not_(self, arg):
+        return self._build("Not", lambda: not arg.evaluate())
+
+
+class Event(object):
+    def __init__(self, conn, expression):
+        self._conn = conn
+        self._expression = expression
+        self.condition = threading.Condition()
+        self.callbacks = []
+
+    def stream(self):
+        return bool(self._expression.evaluate())
+
+    def wait(self, timeout=None):
+        # Run physics frames until the expression holds (at most `timeout` game seconds)
+        world = self._conn.world
+        frames = None if timeout is None else max(1, int(math.ceil(timeout / world.dt)))
+        while not self.stream():
+            if frames is not None:
+                if frames == 0:
+                    return
+                frames -= 1
+            world.step()
+
+    def start(self):
+        pass
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove(self):
+        pass
+
+
+class Status(object):
+    version = "sim"
+
+
+class GameScene(enum.Enum):
+    space_center = 0
+    flight = 1
+    tracking_station = 2
+    editor_vab = 3
+    editor_sph = 4
+
+
+class KRPC(object):
+    GameScene = GameScene
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.Expression = ExpressionBuilder(conn)
+
+    @property
+    def current_game_scene(self):
+        return self._conn._invoke("KRPC", "get_CurrentGameScene", lambda: self._conn.world.scene)
+
+    def get_status(self):
+        return self._conn._invoke("KRPC", "GetStatus", lambda: Status())
+
+    def add_event(self, expression):
+        return self._conn._invoke("KRPC", "AddEvent", lambda: Event(self._conn, expression))
+
+
+class SimConnection(object):
+    idle_reads = 20  # Stream reads without any RPC before the game moves on a frame anyway
+
+    def __init__(self, world, latency=0., rpc_time=0.002):
+        self.world = world
+        self.latency = latency
+        self.rpc_time = rpc_time
+        self.rpc_count = 0
+        self.streams = set()
+        self.streaming = False
+        self.reads = 0
+        self.notifying = False
+        self.space_center = SpaceCenter(self)
+        self.krpc = KRPC(self)
+        self.stream_update_condition = threading.Condition()
+        self.update_callbacks = []  # Run after every frame's stream callbacks, as kRPC runs them per update message
+        self.connected = True
+        world.listeners.append(self.notify)
+
+    def check_connected(self):
+        if not self.connected:
+            raise ConnectionResetError("Simulator connection closed")
+
+    def _invoke(self, service, procedure, fn, *args, **kwargs):
+        # Every remote call lands here: one round trip of game time (and optional wall-clock latency)
+        self.check_connected()
+        self.rpc_count += 1
+        self.reads = 0
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.world.advance(self.rpc_time)
+        return fn(*args, **kwargs)
+
+    def stream_evaluation(self):
+        conn = self
+
+        class Evaluation(object):
+            def __enter__(self):
+                self.previous = conn.streaming
+                conn.streaming = True
+
+            def __exit__(self, *exc):
+                conn.streaming = self.previous
+
+        return Evaluation()
+
+    def idle(self):
+        if self.notifying:
+            return  # Reads from stream callbacks don't move the game on
+        self.reads += 1
+        if self.reads >= self.idle_reads:
+            self.reads = 0
+            self.world.step()
+
+    def notify(self):
+        self.notifying = True
+        try:
+            for stream in list(self.streams):
+                if stream.callbacks:
+                    value = stream.value()
+                    for callback in list(stream.callbacks):
+                        callback(value)
+            for callback in list(self.update_callbacks):
+                callback()
+        finally:
+            self.notifying = False
+
+    def add_stream(self, func, *args, **kwargs):
+        stream = self._invoke("KRPC", "AddStream", lambda: Stream(self, func, args, kwargs))
+        self.streams.add(stream)
+        return stream
+
+    def get_call(self, func, *args, **kwargs):
+        return Call(func, args, kwargs)
+
+    def wait_for_stream_update(self, timeout=None):
+        self.world.step()
+
+    def add_stream_update_callback(self, callback):
+        self.update_callbacks.append(callback)
+
+    def remove_stream_update_callback(self, callback):
+        self.update_callbacks.remove(callback)
+
+    def close(self):
+        if self.connected:
+            self.connected = False
+            self.world.listeners.remove(self.notify)
+
+    def drop(self):
+        # Lose the link as if the game had gone away: every later call and stream read raises
+        # ConnectionResetError, while the world carries on for the next connect(world=...)
+        self.close()
+
+
+# --- Scenarios -------------------------------------------------------------------------------
+
+def orbit_state(mu, periapsis, apoapsis, true_anomaly=0., argp=0.):
+    # Position and velocity on the orbit with the given apsis radii (prograde, in the plane)
+    a = (periapsis + apoapsis) / 2.
+    e = (apoapsis - periapsis) / (apoapsis + periapsis)
+    conic = Conic.from_elements(mu, a, e, argp, 0.)
+    conic.m0 = conic.mean_from_true(true_anomaly)
+    return conic.state_at(0.)
+
+
+def scenario_state(world, scenario, craft):
+    bodies = world.bodies
+    top = len(craft) - 1
+    kerbin, mun = bodies["Kerbin"], bodies["Mun"]
+    if scenario == "pad":
+        return VesselState("Sim Vessel", kerbin, (kerbin.radius, 0.), (0., 0.), craft, top + 1, world.ut)
+    if scenario == "orbit":  # 100 km circular Kerbin orbit, booster dropped
+        r, v = orbit_state(kerbin.mu, kerbin.radius + 100000., kerbin.radius + 100000.)
+        return VesselState("Sim Vessel", kerbin, r, v, craft, top - 1, world.ut)
+    if scenario == "suborbital":  # Coasting out of the atmosphere towards a 100 km apoapsis
+        r, v = orbit_state(kerbin.mu, kerbin.radius - 300000., kerbin.radius + 100000., math.radians(150.))
+        return VesselState("Sim Vessel", kerbin, r, v, craft, top - 1, world.ut)
+    if scenario == "munar":  # 30 km circular Mun orbit, lander only
+        r, v = orbit_state(mun.mu, mun.radius + 30000., mun.radius + 30000.)
+        return VesselState("Sim Lander", mun, r, v, craft, 0, world.ut)
+    raise ValueError("Unknown scenario: {}".format(scenario))
+
+
+def connect(name=None, address=None, rpc_port=None, stream_port=None, scenario="pad", craft=None,
+            latency=None, rpc_time=0.002, dt=0.02, ut=0., world=None):
+    # Drop-in for krpc.connect(); the address and ports are ignored.
+    # latency defaults to $KRPC_SIM_LATENCY (seconds of real sleep per RPC).
+    # scenario may list several, comma separated, for one vessel each (the first is active).
+    # Passing the world of an earlier connection reconnects to the same game instead
+    if latency is None:
+        latency = float(os.environ.get("KRPC_SIM_LATENCY", 0.))
+    if world is not None:
+        return SimConnection(world, latency, rpc_time)
+    world = World(dt)
+    world.ut = ut
+    scenarios = scenario.split(",")
+    for i, name in enumerate(scenarios):
+        state = world.add_vessel(scenario_state(world, name.strip(), craft or DEFAULT_CRAFT))
+        if len(scenarios) > 1:
+            state.name = "{} {}".format(state.name, i + 1)
+    return SimConnection(world, latency, rpc_time)
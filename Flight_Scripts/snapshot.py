@@ -0,0 +1,94 @@
+# Consistent reads of several vessel and orbit fields at once, for maneuver planning.
+# Reading vessel.orbit.apoapsis, then semi_major_axis, then time_to_apoapsis costs a round trip each,
+# and the game moves on between them, so a plan mixes values from different physics frames.
+# Snapshots streams each field instead (one AddStream the first time it is asked for, none after).
+# kRPC sends a physics frame's stream values in one update message and runs the stream update
+# callbacks once the whole message has been stored, so a callback copies every field there, on the
+# stream thread, and read() returns the latest copy. Nothing is read while holding a lock the stream
+# thread needs: kRPC stores values under locks of its own, so holding stream_update_condition would
+# not keep a frame out, and starting a stream under it would wait on an update that cannot land.
+import collections
+import threading
+
+ORBIT_FIELDS = ("body", "apoapsis", "periapsis", "apoapsis_altitude", "periapsis_altitude", "semi_major_axis",
+                "eccentricity", "inclination", "longitude_of_ascending_node", "argument_of_periapsis",
+                "mean_anomaly_at_epoch", "epoch", "radius", "speed", "period", "time_to_apoapsis",
+                "time_to_periapsis", "time_to_soi_change")
+VESSEL_FIELDS = ("mass", "dry_mass", "thrust", "available_thrust", "specific_impulse", "vacuum_specific_impulse")
+FLIGHT_FIELDS = ("mean_altitude", "surface_altitude", "vertical_speed", "horizontal_speed")  # vessel.flight()
+
+
+class Snapshots(object):
+    timeout = 1.  # Seconds to wait for a frame carrying new fields; none come while the game is paused
+
+    def __init__(self, conn, vessel, ut=None, shared=None):
+        # shared: field -> stream the caller already has, read through instead of adding another
+        self.conn = conn
+        self.vessel = vessel
+        self.orbit = vessel.orbit
+        self.flight = None  # vessel.flight(), fetched the first time a flight field is asked for
+        self.streams = dict(shared or {})
+        self.streams["ut"] = ut if ut is not None else conn.add_stream(getattr, conn.space_center, "ut")
+        self.owned = set() if ut is not None else {"ut"}  # Streams this object added, removed by close()
+        self.started = ()  # (field, stream) pairs with a value, copied by capture()
+        self.frame = {}  # Field -> value, from the last update message
+        self.captured = threading.Condition()
+        self.types = {}  # Fields -> namedtuple type
+        conn.add_stream_update_callback(self.capture)
+
+    def source(self, field):
+        if field in ORBIT_FIELDS:
+            return self.orbit
+        if field in VESSEL_FIELDS:
+            return self.vessel
+        if field in FLIGHT_FIELDS:
+            if self.flight is None:
+                self.flight = self.vessel.flight()
+            return self.flight
+        raise KeyError("No snapshot field {!r}".format(field))
+
+    def subscribe(self, *fields):
+        # Add and start the streams for fields up front, so the first read() costs no round trips either
+        fields = ("ut",) + fields
+        new = [field for field in fields if field not in dict(self.started)]
+        if not new:
+            return
+        for field in new:
+            if field not in self.streams:
+                self.streams[field] = self.conn.add_stream(getattr, self.source(field), field)
+                self.owned.add(field)
+            self.streams[field].start()  # Waits for the first value
+        self.started = self.started + tuple((field, self.streams[field]) for field in new)
+        self.settle(fields)
+
+    def settle(self, fields):
+        # Wait for an update message carrying all of fields
+        with self.conn.stream_update_condition:
+            self.conn.wait_for_stream_update(self.timeout)  # The simulator steps a frame here
+        with self.captured:
+            if self.captured.wait_for(lambda: all(field in self.frame for field in fields), self.timeout):
+                return
+        self.capture()  # Nothing came: the game is paused, so values read now agree with each other
+
+    def capture(self):
+        # Stream update callback: copy every field once the message's values have all been stored
+        frame = {field: stream() for field, stream in self.started}
+        with self.captured:
+            self.frame = frame
+            self.captured.notify_all()
+
+    def read(self, *fields):
+        # Namedtuple of ut and fields, all from the same physics frame
+        self.subscribe(*fields)
+        fields = ("ut",) + tuple(field for field in fields if field != "ut")
+        if fields not in self.types:
+            self.types[fields] = collections.namedtuple("Snapshot", fields)
+        frame = self.frame
+        return self.types[fields](*[frame[field] for field in fields])
+
+    def close(self):
+        self.conn.remove_stream_update_callback(self.capture)
+        self.started = ()
+        for field in self.owned:
+            self.streams.pop(field).remove()
+        self.owned.clear()
@@ -0,0 +1,217 @@
+# Staging monitor: keeps the current decouple stage's fuel amounts as kRPC streams,
+# so checking for burnout costs no RPCs until a stage is actually dropped.
+#
+# StagingPlan goes further: it reads the part tree once, works out every stage's delta-v and burn
+# time, and registers a server-side event per stage that fires at its burnout, so the game decides
+# when to stage and the client only reads a boolean. Its burn_time() spans stages, for node planning.
+import collections
+import math
+
+import orbital
+
+FUELS = ("LiquidFuel", "SolidFuel")
+G0 = 9.80665
+
+# One activation stage of a staging plan: mass at ignition, propellant mass it burns (kg), vacuum
+# thrust (N) and combined specific impulse (s) of its engines, and the fuels its burnout is watched on
+Stage = collections.namedtuple("Stage", ["number", "mass", "propellant", "thrust", "isp", "delta_v", "burn_time",
+                                         "fuels"])
+
+
+class StageMonitor(object):
+    def __init__(self, conn, vessel, threshold=0.1):
+        self.conn = conn
+        self.vessel = vessel
+        self.threshold = threshold
+        self.stage = None
+        self.fuels = {}
+        self.subscribe()
+
+    def subscribe(self):
+        # Re-bind the fuel streams to the stage that will be decoupled next
+        self.unsubscribe()
+        self.stage = self.vessel.control.current_stage - 1
+        resources = self.vessel.resources_in_decouple_stage(self.stage)
+        names = resources.names
+        for name in FUELS:
+            if name in names:
+                self.fuels[name] = self.conn.add_stream(resources.amount, name)
+
+    def unsubscribe(self):
+        for stream in self.fuels.values():
+            stream.remove()
+        self.fuels = {}
+
+    def activate_next_stage(self):
+        result = self.vessel.control.activate_next_stage()
+        self.subscribe()
+        return result
+
+    def fuel_left(self):
+        # Least fuel left in the stage that will be decoupled next (nan if it carries none)
+        amounts = [stream() for stream in self.fuels.values()]
+        return min(amounts) if amounts else float("nan")
+
+    def check(self):
+        # Stage if the current stage's liquid or solid fuel has run out
+        staged = False
+        for name in FUELS:
+            amount = self.fuels.get(name)
+            if amount is not None and amount() <= self.threshold:
+                self.activate_next_stage()
+                staged = True
+        return staged
+
+
+def read_stages(vessel):
+    # The vessel's stages from the current one down to the last, from one read of its part tree
+    parts = []
+    for part in vessel.parts.all:
+        engine = part.engine
+        parts.append((part.stage, part.decouple_stage, part.mass, part.dry_mass,
+                      (engine.max_vacuum_thrust, engine.vacuum_specific_impulse) if engine is not None else None))
+    stages = []
+    for number in range(vessel.control.current_stage, -1, -1):
+        # While stage `number` is the current one, parts decoupled by a later stage are still attached,
+        # its engines are those activated by now, and they burn the tanks the next stage drops
+        attached = [part for part in parts if part[1] < number]
+        engines = [part[4] for part in attached if part[4] is not None and part[0] >= number and part[4][0] > 0]
+        mass = sum(part[2] for part in attached)
+        propellant = sum(part[2] - part[3] for part in attached if part[1] == number - 1)
+        thrust = sum(t for t, _ in engines)
+        flow = sum(t / isp for t, isp in engines if isp > 0)
+        isp = thrust / flow if flow > 0 else 0.
+        if thrust > 0 and isp > 0 and 0 < propellant < mass:
+            delta_v = isp * G0 * math.log(mass / (mass - propellant))
+            burn = propellant * isp * G0 / thrust
+        else:
+            delta_v = burn = 0.
+        names = vessel.resources_in_decouple_stage(number - 1, cumulative=False).names if propellant > 0 else []
+        stages.append(Stage(number, mass, propellant, thrust, isp, delta_v, burn,
+                            tuple(name for name in FUELS if name in names)))
+    return stages
+
+
+class StagingPlan(object):
+    # Drop-in for StageMonitor driven by a precomputed plan and server-side burnout events.
+    # stages: the plan as read_stages() gives it, read from the part tree when not given (a replay
+    # passes the one recorded)
+    def __init__(self, conn, vessel, threshold=0.1, stages=None):
+        self.conn = conn
+        self.vessel = vessel
+        self.threshold = threshold
+        self.stages = {stage.number: stage for stage in (read_stages(vessel) if stages is None else stages)}
+        # The last stage has nothing to stage to
+        self.events = {number: self.burnout_event(stage) for number, stage in self.stages.items()
+                       if stage.fuels and number > 0}
+        self.mass = conn.add_stream(getattr, vessel, "mass")
+        self.fuel = None  # Streams for fuel_left(), one per fuel of the current stage, while watching
+        self.watching = False
+        self.current = None
+        self.stage = None
+        self.subscribe()
+
+    def burnout_event(self, stage):
+        # Fires once any of the stage's fuels is down to the threshold
+        expression = self.conn.krpc.Expression
+        resources = self.vessel.resources_in_decouple_stage(stage.number - 1, cumulative=False)
+        condition = None
+        for name in stage.fuels:
+            empty = expression.less_than_or_equal(expression.call(self.conn.get_call(resources.amount, name)),
+                                                  expression.constant_double(self.threshold))
+            condition = empty if condition is None else expression.or_(condition, empty)
+        event = self.conn.krpc.add_event(condition)
+        event.start()
+        return event
+
+    def subscribe(self):
+        # Follow the vessel to its current stage
+        self.current = self.vessel.control.current_stage
+        self.stage = self.current - 1  # Decouple stage dropped next, as in StageMonitor
+        self.drop_fuel()
+        if self.watching:
+            self.follow_fuel()
+
+    def unsubscribe(self):
+        for event in self.events.values():
+            event.remove()
+        self.events = {}
+        self.mass.remove()
+        self.drop_fuel()
+
+    def watch_fuel(self):
+        # Keep fuel_left()'s streams started from now on, across staging, so reading it never waits
+        # on a stream's first update (the flight recorder reads it on kRPC's stream thread)
+        self.watching = True
+        if self.fuel is None:
+            self.follow_fuel()
+
+    def follow_fuel(self):
+        stage = self.stages.get(self.current)
+        if stage is None or not stage.fuels:
+            return
+        resources = self.vessel.resources_in_decouple_stage(self.stage, cumulative=False)
+        fuel = [self.conn.add_stream(resources.amount, name) for name in stage.fuels]
+        for stream in fuel:
+            stream.start()
+        self.fuel = fuel
+
+    def drop_fuel(self):
+        # Remove the previous stage's fuel_left() streams
+        fuel, self.fuel = self.fuel, None
+        for stream in fuel or ():
+            stream.remove()
+
+    def activate_next_stage(self):
+        result = self.vessel.control.activate_next_stage()
+        self.subscribe()
+        return result
+
+    def fuel_left(self):
+        # Least fuel left in the stage that will be decoupled next (nan if it carries none, or before watch_fuel())
+        fuel = self.fuel
+        return min(stream() for stream in fuel) if fuel else float("nan")
+
+    def check(self):
+        # Stage once the current stage's burnout event has fired
+        event = self.events.get(self.current)
+        if event is not None and event.stream():
+            self.activate_next_stage()
+            return True
+        return False
+
+    def burn_time(self, delta_v):
+        # Seconds to burn delta_v from now, staging on as each stage runs dry (inf if the plan runs out)
+        mass = self.mass()
+        left = abs(delta_v)
+        seconds = 0.
+        for number in range(self.current, -1, -1):
+            stage = self.stages.get(number)
+            if stage is None or stage.delta_v <= 0:
+                continue
+            if number == self.current:
+                # Partly burnt: what has gone since the plan was read came out of this stage's tanks
+                propellant = stage.propellant - (stage.mass - mass)
+                if propellant <= 0:
+                    continue
+                start, available = mass, stage.isp * G0 * math.log(mass / (mass - propellant))
+            else:
+                start, propellant, available = stage.mass, stage.propellant, stage.delta_v
+            if left <= available:
+                return seconds + float(orbital.burn_time(left, stage.thrust, stage.isp, start))
+            seconds += propellant * stage.isp * G0 / stage.thrust
+            left -= available
+        return float("inf") if left > 0 else seconds
+
+    def delta_v(self):
+        # Total delta-v left (m/s)
+        return sum(stage.delta_v for number, stage in self.stages.items() if number < self.current) + \
+            self.remaining_delta_v()
+
+    def remaining_delta_v(self):
+        stage = self.stages.get(self.current)
+        if stage is None or stage.delta_v <= 0:
+            return 0.
+        mass = self.mass()
+        propellant = stage.propellant - (stage.mass - mass)
+        return stage.isp * G0 * math.log(mass / (mass - propellant)) if propellant > 0 else 0.
@@ -0,0 +1,291 @@
+# Connection supervisor for the two links a flight script depends on: kRPC and the relay.
+# Each link reconnects by itself with exponential backoff when it drops, and records how long it
+# was down. For kRPC a heartbeat thread notices the loss (a dead socket, or KSP leaving the flight
+# scene on a reload), opens a fresh connection, re-creates every stream registered through
+# add_stream() and then runs the on_connect hooks so the script can rebind its vessel and resume
+# the interrupted maneuver. Until then, reads of a supervised stream raise LinkLost.
+#
+# Both links take their connect/app factory as an argument, so they run against local stand-ins:
+# sim.connect (drop() a connection to cut it) for kRPC and websocket-server/index.js for the relay.
+import random
+import threading
+import time
+
+LINK_ERRORS = (OSError, EOFError)  # ConnectionError is an OSError
+OPCODE_TEXT = 0x1  # websocket.ABNF opcodes
+OPCODE_BINARY = 0x2
+
+
+class LinkLost(ConnectionError):
+    pass
+
+
+class Backoff(object):
+    def __init__(self, initial=0.25, factor=2., maximum=10., jitter=0.1):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter  # Fraction of each delay randomised, so clients don't retry in lockstep
+
+    def delays(self):
+        delay = self.initial
+        while True:
+            yield delay * (1. + random.uniform(-self.jitter, self.jitter))
+            delay = min(self.maximum, delay * self.factor)
+
+
+class Link(object):
+    # Up/down state and time-to-recover bookkeeping shared by both links
+    def __init__(self, name, backoff=None, on_lost=()):
+        self.name = name
+        self.backoff = backoff or Backoff()
+        self.lost_hooks = list(on_lost)  # Called with the reason when the link goes down
+        self.up = threading.Event()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.changing = threading.RLock()  # Held while loss or reconnect hooks run, so they never interleave
+        self.lost_at = None
+        self.attempts = 0  # Reconnection attempts since the link was first opened
+        self.recoveries = []  # Seconds from each loss to the link being usable again
+        self.generation = 0  # Connections opened since the first, so a late report of an old one is ignored
+
+    def lost(self, reason, generation=None):
+        # Mark the link down; False if it already was, or if generation says the loss was of an earlier connection
+        if generation not in (None, self.generation):
+            return False  # Without waiting on the reconnect hooks, which may be waiting on this thread's command
+        with self.changing:
+            with self.lock:
+                if not self.up.is_set() or generation not in (None, self.generation):
+                    return False
+                self.up.clear()
+                self.lost_at = time.monotonic()
+            print("{} link lost: {}".format(self.name, reason))
+            for hook in self.lost_hooks:
+                hook(reason)
+        return True
+
+    def recovered(self):
+        with self.lock:
+            took = time.monotonic() - self.lost_at
+            self.recoveries.append(took)
+            self.lost_at = None
+            self.up.set()
+        print("{} link recovered in {:.2f}s".format(self.name, took))
+        return took
+
+    def wait(self, timeout=None):
+        # Block until the link is up; False on timeout
+        return self.up.wait(timeout)
+
+    def stop(self):
+        self.stopped.set()
+
+    def summary(self):
+        if not self.recoveries:
+            return "{}: no outages".format(self.name)
+        return "{}: {} outage(s), recovery mean {:.2f}s max {:.2f}s, {} attempt(s)".format(
+            self.name, len(self.recoveries), sum(self.recoveries) / len(self.recoveries),
+            max(self.recoveries), self.attempts)
+
+
+class SupervisedStream(object):
+    # A stream that follows the connection: recipe(conn) builds it again after every reconnect
+    def __init__(self, link, recipe):
+        self.link = link
+        self.recipe = recipe
+        self.stream = None
+        self.callbacks = []
+        self.started = False  # Started again after a reconnect, so a callback never reads it unstarted
+
+    def bind(self, conn):
+        self.stream = self.recipe(conn)
+        if self.started:
+            self.stream.start()
+        for callback in self.callbacks:
+            self.stream.add_callback(callback)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        self.stream.add_callback(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+        try:
+            self.stream.remove_callback(callback)
+        except LINK_ERRORS:
+            pass
+
+    def start(self, wait=True):
+        self.started = True
+        self.stream.start(wait)
+
+    def __call__(self):
+        generation = self.link.generation  # A read begun before a reconnect must not mark the new link down
+        if not self.link.up.is_set():
+            raise LinkLost("{} link is down".format(self.link.name))
+        try:
+            return self.stream()
+        except LINK_ERRORS as e:
+            self.link.lost(e, generation)
+            raise LinkLost(str(e))
+
+    # waits.wait_until sleeps on these
+    @property
+    def condition(self):
+        return self.stream.condition
+
+    def wait(self, timeout=None):
+        self.stream.wait(timeout)
+
+    def remove(self):
+        self.link.streams.remove(self)
+        try:
+            self.stream.remove()
+        except LINK_ERRORS:
+            pass
+
+
+class KRPCLink(Link):
+    def __init__(self, connect, on_connect=(), on_lost=(), heartbeat=1., backoff=None):
+        # connect() returns a new kRPC connection; each on_connect hook gets it after a reconnect
+        Link.__init__(self, "kRPC", backoff, on_lost)
+        self.connect = connect
+        self.hooks = list(on_connect)
+        self.heartbeat = heartbeat  # Seconds between liveness checks
+        self.streams = []
+        self.wake = threading.Event()  # Cuts the heartbeat wait short when a stream read finds the link down
+        self.conn = connect()
+        self.up.set()
+        self.watcher = threading.Thread(target=self.watch, name="krpc-supervisor")
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def add_stream(self, recipe):
+        # recipe(conn) -> stream, e.g. lambda conn: conn.add_stream(getattr, conn.space_center, "ut")
+        stream = SupervisedStream(self, recipe)
+        stream.bind(self.conn)
+        self.streams.append(stream)
+        return stream
+
+    def on_connect(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def check(self):
+        # One RPC; raises on a dead socket, and a scene change leaves every remote object stale
+        conn = self.conn
+        if conn.krpc.current_game_scene != conn.krpc.GameScene.flight:
+            raise LinkLost("game left the flight scene")
+
+    def lost(self, reason, generation=None):
+        self.wake.set()
+        return Link.lost(self, reason, generation)
+
+    def watch(self):
+        while True:
+            self.wake.wait(self.heartbeat)
+            self.wake.clear()
+            if self.stopped.is_set():
+                return
+            if self.up.is_set():
+                try:
+                    self.check()
+                except LINK_ERRORS as e:
+                    self.lost(e)
+            if not self.up.is_set():
+                self.reconnect()
+
+    def reconnect(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        for delay in self.backoff.delays():
+            if self.stopped.is_set():
+                return
+            self.attempts += 1
+            try:
+                conn = self.connect()
+                self.conn = conn
+                self.check()
+                self.generation += 1
+                for stream in self.streams:
+                    stream.bind(conn)
+                # Streams are readable again for the hooks, which run after those of the loss
+                with self.changing:
+                    self.up.set()
+                    for hook in self.hooks:
+                        hook(conn)
+            except Exception as e:
+                # Includes kRPC errors while the game is still loading
+                self.up.clear()
+                print("{} reconnect failed ({!r}), retrying in {:.2f}s".format(self.name, e, delay))
+                self.stopped.wait(delay)
+                continue
+            self.recovered()
+            return
+
+    def stop(self):
+        Link.stop(self)
+        self.wake.set()
+        self.watcher.join()
+        self.conn.close()
+
+
+class RelayLink(Link):
+    def __init__(self, url, on_message, app=None, backoff=None):
+        # app(url, on_open=, on_message=, on_error=, on_close=) defaults to websocket.WebSocketApp
+        Link.__init__(self, "Relay", backoff)
+        if app is None:
+            import websocket
+            app = websocket.WebSocketApp
+        self.url = url
+        self.handler = on_message
+        self.app = app
+        self.ws = None
+        self.delays = None
+        self.opened_at = None  # time.monotonic() of the latest handshake
+
+    def opened(self, ws):
+        print("Connected to server!")
+        self.opened_at = time.monotonic()
+        self.delays = None
+        if self.lost_at is None:
+            self.up.set()
+        else:
+            self.recovered()
+
+    def closed(self, ws, *reason):
+        self.lost("connection closed")
+
+    def errored(self, ws, error):
+        self.lost(error)
+
+    def send(self, data, binary=True):
+        # False if the relay is down; the caller decides whether to retry
+        ws = self.ws
+        if ws is None or not self.up.is_set():
+            return False
+        try:
+            ws.send(data, opcode=OPCODE_BINARY if binary else OPCODE_TEXT)
+        except Exception:
+            return False
+        return True
+
+    def run(self):
+        # Serve messages until stop(); each time the socket closes wait out the backoff and reopen
+        while not self.stopped.is_set():
+            self.ws = self.app(self.url, on_open=self.opened, on_message=lambda ws, message: self.handler(message),
+                               on_error=self.errored, on_close=self.closed)
+            self.ws.run_forever()
+            if self.stopped.is_set():
+                break
+            if self.delays is None:
+                self.delays = self.backoff.delays()
+            self.attempts += 1
+            self.stopped.wait(next(self.delays))
+
+    def stop(self):
+        Link.stop(self)
+        if self.ws is not None:
+            self.ws.close()
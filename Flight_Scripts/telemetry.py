@@ -0,0 +1,204 @@
+# Telemetry frames pushed from the flight computer to the relay, for dashboards and the voice skill.
+# A frame is a 5 byte header followed by one varint per field present:
+#
+#   byte 0     0x54 ('T')
+#   byte 1     version << 4 | 1 for a key frame (absolute values), 0 for a delta frame
+#   bytes 2-3  sequence number (uint16, little endian), so a receiver can spot a missed delta
+#   byte 4     bit mask of the fields present, in FIELDS order
+#
+# Values are quantised to integers (see FIELDS) and zigzag varint encoded; a delta frame carries only
+# the fields that changed, as differences from the previous frame. A receiver that missed a frame
+# waits for the next key frame. websocket-server/index.js decodes the same format to downsample
+# per subscriber.
+#
+#   python telemetry.py [relay url] [frames per second]    print the telemetry the relay is serving
+import struct
+import sys
+import threading
+import time
+
+MAGIC = 0x54
+VERSION = 1
+HEADER = struct.Struct("<BBHB")
+
+# (name, scale): value * scale is rounded to an integer; phase is an index into PHASES
+FIELDS = (
+    ("ut", 1000.),  # ms
+    ("altitude", 1.),  # m
+    ("apoapsis", 1.),
+    ("periapsis", 1.),
+    ("stage", 1.),
+    ("fuel", 10.),  # Tenths of a unit of liquid fuel
+    ("throttle", 100.),  # Percent
+    ("phase", None),
+)
+NAMES = tuple(name for name, _ in FIELDS)
+
+# Mission phases as marked with rpcstats.mark(); anything else is sent as idle
+PHASES = ("idle", "ascent", "coast", "circularise", "transfer", "capture", "landing")
+
+
+def quantise(sample):
+    values = []
+    for name, scale in FIELDS:
+        value = sample[name]
+        if scale is None:
+            values.append(PHASES.index(value) if value in PHASES else 0)
+        else:
+            values.append(int(round(value * scale)))
+    return values
+
+
+def restore(values):
+    sample = {}
+    for (name, scale), value in zip(FIELDS, values):
+        sample[name] = PHASES[value] if scale is None else value / scale
+    return sample
+
+
+def write_varint(out, value):
+    value = value * 2 if value >= 0 else -value * 2 - 1  # Zigzag: small magnitudes stay short
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(frame, offset):
+    value = shift = 0
+    while True:
+        byte = frame[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            break
+    return (value >> 1 if value % 2 == 0 else -(value >> 1) - 1), offset
+
+
+class Encoder(object):
+    def __init__(self, keyframe_every=50):
+        self.keyframe_every = keyframe_every  # Frames between key frames, for receivers joining late
+        self.sequence = 0
+        self.last = None  # Quantised values of the previous frame
+        self.since_key = 0
+
+    def encode(self, sample):
+        # Frame bytes, or None if nothing changed since the last frame (and no key frame is due)
+        values = quantise(sample)
+        key = self.last is None or self.since_key >= self.keyframe_every
+        if key:
+            mask = (1 << len(FIELDS)) - 1
+            payload = values
+            self.since_key = 0
+        else:
+            changes = [(i, value - previous) for i, (value, previous) in enumerate(zip(values, self.last))
+                       if value != previous]
+            # UT always moves, so a frame with nothing else in it is not worth sending
+            if all(i == 0 for i, _ in changes):
+                return None
+            mask = sum(1 << i for i, _ in changes)
+            payload = [delta for _, delta in changes]
+        out = bytearray(HEADER.pack(MAGIC, VERSION << 4 | int(key), self.sequence, mask))
+        for value in payload:
+            write_varint(out, value)
+        self.sequence = (self.sequence + 1) & 0xffff
+        self.since_key += 1
+        self.last = values
+        return bytes(out)
+
+
+class Decoder(object):
+    def __init__(self):
+        self.values = None
+        self.sequence = None
+
+    def decode(self, frame):
+        # Latest sample after applying frame, or None while waiting for a key frame
+        magic, kind, sequence, mask = HEADER.unpack_from(frame)
+        if magic != MAGIC or kind >> 4 != VERSION:
+            raise ValueError("Not a telemetry frame")
+        key = kind & 1
+        if not key and (self.values is None or sequence != (self.sequence + 1) & 0xffff):
+            self.values = None  # Missed a frame: wait for the next key frame
+            return None
+        values = [0] * len(FIELDS) if key else list(self.values)
+        offset = HEADER.size
+        for i in range(len(FIELDS)):
+            if mask & 1 << i:
+                value, offset = read_varint(frame, offset)
+                values[i] = value if key else values[i] + value
+        self.values = values
+        self.sequence = sequence
+        return restore(values)
+
+
+class Publisher(object):
+    # Samples sources (name -> callable, one per FIELDS entry) rate times a second on its own thread
+    # and sends the encoded frames; samples that fail (e.g. the link is down) are skipped
+    def __init__(self, sources, send, rate=5., keyframe_every=50):
+        self.sources = sources
+        self.send = send
+        self.period = 1. / rate
+        self.encoder = Encoder(keyframe_every)
+        self.frames = 0
+        self.bytes = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="telemetry")
+        self.thread.daemon = True
+
+    def sample(self):
+        return {name: self.sources[name]() for name in NAMES}
+
+    def publish(self):
+        frame = self.encoder.encode(self.sample())
+        if frame is None:
+            return None
+        if self.send(frame) is False:
+            self.encoder.last = None  # Not delivered: the next frame has to be a key frame
+            return None
+        self.frames += 1
+        self.bytes += len(frame)
+        return frame
+
+    def run(self):
+        next_tick = time.monotonic()
+        failing = False
+        while not self.stopped.is_set():
+            try:
+                self.publish()
+                failing = False
+            except Exception as e:
+                if not failing:
+                    print("Telemetry sample failed: {!r}".format(e))
+                failing = True
+                self.encoder.last = None
+            next_tick += self.period
+            self.stopped.wait(max(0., next_tick - time.monotonic()))
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+
+def watch(url, rate=1.):
+    # Subscribe to the relay and print every sample
+    import websocket
+    decoder = Decoder()
+
+    def on_message(ws, message):
+        if isinstance(message, bytes):
+            sample = decoder.decode(message)
+            if sample is not None:
+                print(" ".join("{}={}".format(name, sample[name]) for name in NAMES))
+
+    ws = websocket.WebSocketApp(url, on_open=lambda ws: ws.send("subscribe,{}".format(rate)), on_message=on_message)
+    ws.run_forever()
+
+
+if __name__ == "__main__":
+    watch(sys.argv[1] if len(sys.argv) > 1 else "ws://35.242.157.185/",
+          float(sys.argv[2]) if len(sys.argv) > 2 else 1.)
@@ -0,0 +1,79 @@
+# Dispatcher tests: python -m pytest test_dispatcher.py (or python -m unittest test_dispatcher)
+import threading
+import time
+import unittest
+
+import dispatcher
+import waits
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class AbortTest(unittest.TestCase):
+    def setUp(self):
+        self.flown = []
+        self.aborts = 0
+        self.commands = dispatcher.Dispatcher({
+            "launch": lambda altitude: self.flown.append(("launch", altitude)),
+            "circularise": lambda: self.flown.append(("circularise",)),
+            "abort": self.abort,
+        }).start()
+
+    def tearDown(self):
+        self.commands.connected.set()
+        waits.cancel.clear()
+
+    def abort(self):
+        self.aborts += 1
+
+    def test_abort_while_connection_down(self):
+        # The worker has taken the burn off the queue and is waiting for the link: the abort must still stop it
+        self.commands.connected.clear()
+        self.commands.submit("launch,80000")
+        wait_for(lambda: self.commands.running is not None)
+        self.commands.submit("abort")
+        self.commands.connected.set()
+        self.commands.queue.join()
+        self.assertEqual(self.flown, [])
+        self.assertEqual(self.aborts, 1)
+        self.assertIsNone(self.commands.running)
+
+    def test_abort_drops_queued(self):
+        self.commands.connected.clear()
+        self.commands.submit("launch,80000")
+        self.commands.submit("circularise")
+        wait_for(lambda: self.commands.running is not None)
+        self.commands.submit("abort")
+        self.commands.connected.set()
+        self.commands.queue.join()
+        self.assertEqual(self.flown, [])
+
+    def test_commands_after_abort_run(self):
+        self.commands.submit("abort")
+        self.commands.submit("launch,80000")
+        self.commands.queue.join()
+        self.assertEqual(self.flown, [("launch", 80000)])
+
+    def test_abort_interrupts_running(self):
+        started = threading.Event()
+
+        def burn():
+            started.set()
+            waits.wait_until(lambda: False)
+
+        self.commands.handlers["circularise"] = burn
+        self.commands.submit("circularise")
+        started.wait(5.)
+        self.commands.submit("abort")
+        self.commands.queue.join()
+        self.assertIsNone(self.commands.running)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# Transfer window planning: predicts when a target body reaches the Hohmann phase angle
+# from both orbits' elements, so the flight scripts can warp there once instead of polling.
+# Phases and arrivals are propagated locally (kepler.py) from the vessel's tracked elements and
+# the target's cached ones, so planning costs no round trips and works while warping.
+import kepler
+import orbital
+import porkchop
+
+
+def current_phase(orbits, target, mu, ut):
+    # Lead angle of the target (a bodies.Body) over the vessel (degrees, 0-360) around the vessel's orbit normal;
+    # orbits is the vessel's kepler.Tracker
+    return float(kepler.phase_angle(orbits.elements(), kepler.from_body(target, mu), ut))
+
+
+def transfer_window(orbits, target, mu, ut):
+    # UT of the next Hohmann window, the phase angle needed then and the phase angle now.
+    # target is a bodies.Body; mu is the gravitational parameter of the body both orbit
+    elements = orbits.elements()
+    target_elements = kepler.from_body(target, mu)
+    optimal = float(orbital.hohmann_phase_angle(elements.semi_major_axis, target.semi_major_axis))
+    phase = float(kepler.phase_angle(elements, target_elements, ut))
+    return kepler.next_phase(elements, target_elements, optimal, ut), optimal, phase
+
+
+def warp_to_window(conn, orbits, target, mu, ut, tolerance=1., lead_time=10., attempts=3):
+    # Warp straight to the window; the re-plan on arrival doubles as the verification step.
+    # ut is the flight script's UT stream. Returns the phase angle reached and the optimal one.
+    for _ in range(attempts):
+        window, optimal, phase = transfer_window(orbits, target, mu, ut())
+        print("Phase: {:.1f}, window in {:.0f}s".format(phase, window - ut()))
+        if window - ut() <= lead_time:
+            break
+        conn.space_center.warp_to(window - lead_time)
+    if window > ut():
+        conn.space_center.warp_to(window)
+    phase = current_phase(orbits, target, mu, ut())
+    if abs(phase - optimal) > tolerance:
+        print("Phase {:.1f} is off the optimal {:.1f}".format(phase, optimal))
+    return phase, optimal
+
+
+def arrival(orbits, target, mu, ut):
+    # (UT of entering the target's sphere of influence, UT of the periapsis there) on the current trajectory,
+    # predicted locally; raises if the trajectory misses the target
+    predicted = kepler.encounter(orbits.elements(), kepler.from_body(target, mu), target.gravitational_parameter,
+                                 target.sphere_of_influence, ut)
+    if predicted is None:
+        raise RuntimeError("No encounter with {} predicted".format(target.name))
+    return predicted[0], predicted[1]
+
+
+def node_to(vessel, orbits, registry, target, ut, **kwargs):
+    # Plan the cheapest transfer to target (a bodies.Body) departing after ut and add its burn as a node;
+    # returns the node and the porkchop.Transfer. kwargs go to porkchop.plan()
+    elements = orbits.elements()
+    plan = porkchop.plan(registry, orbits.body, elements, target, ut, **kwargs)
+    at, prograde, normal, radial = porkchop.burn(plan, elements, orbits.body, ut)
+    return vessel.control.add_node(at, prograde=prograde, normal=normal, radial=radial), plan
+
+
+def correction_node(vessel, orbits, registry, plan, ut):
+    # Course correction that keeps plan's arrival, as a node; returns the node and the corrected porkchop.Transfer
+    elements = orbits.elements()
+    fixed = porkchop.correction(registry, orbits.body, elements, registry[plan.target], plan.arrival, ut)
+    at, prograde, normal, radial = porkchop.burn(fixed, elements, orbits.body, ut)
+    return vessel.control.add_node(at, prograde=prograde, normal=normal, radial=radial), fixed
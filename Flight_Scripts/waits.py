@@ -0,0 +1,85 @@
+# Blocking waits for the flight scripts.
+# Sleeps on kRPC stream update conditions (or server-side events) instead of
+# spinning on `while ...: pass`, so a coast to apoapsis costs no CPU.
+import threading
+import time
+
+min_sleep = 0.005  # Adaptive sleep fallback bounds (seconds)
+max_sleep = 0.25
+
+wakeups = 0  # Condition checks made by wait_until / wait_for_event, for the benchmarks
+
+# Set (e.g. by the command dispatcher) to make every wait in the running maneuver raise ManeuverAborted
+cancel = threading.Event()
+
+
+class ManeuverAborted(Exception):
+    pass
+
+
+def check_cancelled():
+    if cancel.is_set():
+        raise ManeuverAborted()
+
+
+def sleep(seconds):
+    # time.sleep() that returns early with ManeuverAborted when the maneuver is cancelled
+    if cancel.wait(seconds):
+        raise ManeuverAborted()
+
+
+def wait_until(condition, stream=None, timeout=None, tick=None):
+    # Block until condition() is true. With a stream, wake on each of its updates;
+    # without one, poll with an exponentially growing sleep. tick() runs on every
+    # wake-up (e.g. checkFuel). Returns False if the timeout expired first.
+    global wakeups
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = min_sleep
+    while True:
+        wakeups += 1
+        check_cancelled()
+        if tick is not None:
+            tick()
+        if condition():
+            return True
+        remaining = max_sleep
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            remaining = min(remaining, max_sleep)
+        if stream is not None:
+            # Only hold the lock while sleeping so the stream thread is never stalled by our RPCs
+            with stream.condition:
+                stream.wait(remaining)
+        else:
+            cancel.wait(min(delay, remaining))
+            delay = min(delay * 2, max_sleep)
+
+
+def wait_for_event(event, timeout=None):
+    # Block on a server-side kRPC event (conn.krpc.add_event)
+    global wakeups
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wakeups += 1
+        check_cancelled()
+        remaining = max_sleep
+        if deadline is not None:
+            remaining = min(deadline - time.monotonic(), max_sleep)
+            if remaining <= 0:
+                return False
+        with event.condition:
+            event.wait(remaining)
+        if event.stream():
+            return True
+
+
+def add_threshold_event(conn, call, value, rising=True):
+    # Server-side event that fires when the streamed call crosses value
+    expression = conn.krpc.Expression
+    lhs = expression.call(call)
+    rhs = expression.constant_double(value)
+    if rising:
+        return conn.krpc.add_event(expression.greater_than_or_equal(lhs, rhs))
+    return conn.krpc.add_event(expression.less_than_or_equal(lhs, rhs))
@@ -1,13 +1,121 @@
 const WebSocket = require("ws");
 
-const wss = new WebSocket.Server({ port: 80 });
+const wss = new WebSocket.Server({ port: process.env.PORT || 80 });
+
+// Telemetry frames (format in Flight_Scripts/telemetry.py) arrive from the flight computer as binary
+// messages. The relay keeps the latest values and sends every subscriber its own delta-encoded stream
+// at the rate it asked for with "subscribe,<frames per second>", starting with a key frame.
+const MAGIC = 0x54;
+const VERSION = 1;
+const FIELDS = 8;
+const KEYFRAME_EVERY = 50;
+const MAX_RATE = 20;
+
+let latest = null; // Quantised values from the last frame, null until a key frame arrives
+let sequence = 0;
+const subscribers = new Map(); // connection -> { period, next, last, sequence, sinceKey }
+
+function readVarint(frame, offset) {
+	// Arithmetic rather than bit operations: UT in ms does not fit in 32 bits
+	let value = 0;
+	let scale = 1;
+	let byte;
+	do {
+		byte = frame[offset++];
+		value += (byte & 0x7f) * scale;
+		scale *= 128;
+	} while (byte >= 0x80);
+	return [value % 2 === 0 ? value / 2 : -(value + 1) / 2, offset];
+}
+
+function writeVarint(out, value) {
+	value = value >= 0 ? value * 2 : -value * 2 - 1;
+	while (value >= 0x80) {
+		out.push((value % 128) | 0x80);
+		value = Math.floor(value / 128);
+	}
+	out.push(value);
+}
+
+function decode(frame) {
+	if (frame.length < 5 || frame[0] !== MAGIC || frame[1] >> 4 !== VERSION) {
+		return;
+	}
+	const key = frame[1] & 1;
+	const frameSequence = frame.readUInt16LE(2);
+	const mask = frame[4];
+	if (!key && (latest === null || frameSequence !== ((sequence + 1) & 0xffff))) {
+		latest = null; // Missed a frame: wait for the next key frame
+		return;
+	}
+	const values = key ? new Array(FIELDS).fill(0) : latest.slice();
+	let offset = 5;
+	for (let i = 0; i < FIELDS; i++) {
+		if (mask & (1 << i)) {
+			let value;
+			[value, offset] = readVarint(frame, offset);
+			values[i] = key ? value : values[i] + value;
+		}
+	}
+	latest = values;
+	sequence = frameSequence;
+}
+
+function encode(subscriber) {
+	// Frame taking this subscriber from what it was last sent to the latest values, or null if only UT moved
+	const key = subscriber.last === null || subscriber.sinceKey >= KEYFRAME_EVERY;
+	let mask = 0;
+	const payload = [];
+	for (let i = 0; i < FIELDS; i++) {
+		if (key || latest[i] !== subscriber.last[i]) {
+			mask |= 1 << i;
+			payload.push(key ? latest[i] : latest[i] - subscriber.last[i]);
+		}
+	}
+	if (!key && (mask & ~1) === 0) {
+		return null;
+	}
+	const out = [MAGIC, (VERSION << 4) | (key ? 1 : 0), subscriber.sequence & 0xff, subscriber.sequence >> 8, mask];
+	payload.forEach((value) => writeVarint(out, value));
+	subscriber.sequence = (subscriber.sequence + 1) & 0xffff;
+	subscriber.sinceKey = key ? 1 : subscriber.sinceKey + 1;
+	subscriber.last = latest;
+	return Buffer.from(out);
+}
+
+setInterval(() => {
+	if (latest === null) {
+		return;
+	}
+	const now = Date.now();
+	subscribers.forEach((subscriber, client) => {
+		if (now < subscriber.next || client.readyState !== WebSocket.OPEN) {
+			return;
+		}
+		subscriber.next = now + subscriber.period;
+		const frame = encode(subscriber);
+		if (frame !== null) {
+			client.send(frame);
+		}
+	});
+}, 25);
 
 wss.on("connection", function connection(connection) {
 	console.log("Client connected!");
 
-	setInterval(() => connection.send("ping"), 5000);
+	const ping = setInterval(() => connection.send("ping"), 5000);
 
 	connection.on("message", function incoming(data) {
+		if (typeof data !== "string") {
+			decode(data);
+			return;
+		}
+		const subscribe = data.match(/^subscribe(?:,([\d.]+))?$/);
+		if (subscribe) {
+			const rate = Math.min(MAX_RATE, parseFloat(subscribe[1] || "1")) || 1;
+			subscribers.set(connection, { period: 1000 / rate, next: 0, last: null, sequence: 0, sinceKey: 0 });
+			return;
+		}
 		console.log(data);
 		wss.clients.forEach(function each(client) {
 			if (client !== connection && client.readyState === WebSocket.OPEN) {
@@ -15,4 +123,9 @@ wss.on("connection", function connection(connection) {
 			}
 		});
 	});
-});
\ No newline at end of file
+
+	connection.on("close", function close() {
+		clearInterval(ping);
+		subscribers.delete(connection);
+	});
+});